@@ -18,27 +18,371 @@
 # LR54 Quick Reboot Script
 # ============================================
 # See #usage on changing default options
+#
+# Reboots in a daily maintenance window, by wall-clock time, once the
+# router has been up for MIN_UPTIME. A reboot is deferred while WAN traffic
+# or the number of user sessions is above its limit, and a window that
+# stays busy throughout is skipped, up to MAX_SKIPPED_WINDOWS in a row,
+# after which the next window reboots as it opens, busy or not.
+# Outside the window, the router is only rebooted early when it needs it:
+# uptime past MAX_UPTIME or free memory below MEMORY_FREE_MIN percent,
+# deferred while busy for at most BUSY_MAX_DEFER seconds.
+#
+# With --debug, 'show tech-support' is captured on a background thread as
+# soon as a reboot is due, while the traffic checks go on, and the reboot
+# waits up to CAPTURE_TIMEOUT for it. Captures are rotated, keeping at most
+# CAPTURE_KEEP files and CAPTURE_MAX_BYTES in total.
+#
+# The commands and output labels read below are constants, adjust them to
+# the firmware if its output differs. Off the router, sim/digidevice is a
+# fake digidevice.cli, see sim/rebootsim.py.
 # ============================================
 
+import os
+import re
 import sys
-from time import sleep
+import threading
+import time
 from datetime import datetime
 from digidevice import cli
 
-REBOOT_TIME = 86340
+REBOOT_TIME = 86340  # seconds, reboot interval with --window any
+MAINTENANCE_WINDOW = "02:00-04:00"  # local time, "any" for no window
+MIN_UPTIME = 43200  # seconds up before a reboot in the window
+MAX_UPTIME = 259200  # seconds, reboot early when up longer than this
+MEMORY_FREE_MIN = 10.0  # percent, reboot early below this free memory
+TRAFFIC_LIMIT = 20000  # bytes/s on WAN_INTERFACE, busier defers a reboot
+SESSION_LIMIT = 0  # user sessions, more defers a reboot
+BUSY_MAX_DEFER = 3600  # seconds an early reboot waits for a quiet moment
+MAX_SKIPPED_WINDOWS = 2  # busy windows skipped before rebooting anyway
+CHECK_INTERVAL = 60  # seconds between checks
+CAPTURE_DIR = ""  # Directory for tech-support captures, "" for the current directory
+CAPTURE_KEEP = 5  # tech-support captures kept
+CAPTURE_MAX_BYTES = 20 * 1024 * 1024  # total size of the captures kept
+CAPTURE_TIMEOUT = 300  # seconds a reboot waits for its capture
 DEBUG = False
 
+WAN_INTERFACE = "wan"
+CMD_SYSTEM = "show system"
+CMD_INTERFACE = "show network interface {0}"
+CMD_USERS = "show users"
+CMD_TECH_SUPPORT = "show tech-support {0}"
+CMD_REBOOT = "reboot"
+CAPTURE_PREFIX = "tech_support_"
+CAPTURE_SUFFIX = ".log"
+
+UNIT_BYTES = {'': 1, 'b': 1, 'kb': 1024, 'kib': 1024, 'mb': 1024 ** 2, 'mib': 1024 ** 2,
+              'gb': 1024 ** 3, 'gib': 1024 ** 3}
+UNIT_SECONDS = {'day': 86400, 'hour': 3600, 'minute': 60, 'min': 60, 'second': 1, 'sec': 1}
+DURATION_RE = re.compile(r'(\d+)\s*(day|hour|minute|min|second|sec)', re.IGNORECASE)
+SIZE_RE = re.compile(r'([\d.]+)\s*([kmg]i?b|b)?', re.IGNORECASE)
+
 
 def usage():
     print("""Usage:
-    python {} [--help | --debug | --time <seconds>]
+    python {0} [--help | --debug | --window <HH:MM-HH:MM|any> | --time <seconds>]
 
 Options:
     --help              Print this help and exit
-    --debug             Output 'show tech-support' to tech_support_[timestamp].log file
-    --time <seconds>    Reboot time in seconds [default: {}]
+    --debug             Capture 'show tech-support' to tech_support_[timestamp].log before a reboot
+    --window <window>   Daily maintenance window, local time, or any [default: {1}]
+    --time <seconds>    Reboot interval in seconds with --window any [default: {2}]
+
+""".format(sys.argv[0], MAINTENANCE_WINDOW, REBOOT_TIME))
+
+
+def key_values(output):
+    """Return the 'Label : value' lines of command output, by lower case label"""
+    values = {}
+    for line in output.splitlines():
+        label, sep, value = line.partition(':')
+        if sep:
+            values[label.strip().lower()] = value.strip()
+    return values
+
+
+def parse_duration(text):
+    """Seconds in e.g. '3 Days, 2 Hours, 10 Minutes, 5 Seconds'"""
+    return sum(int(count) * UNIT_SECONDS[unit.lower()] for count, unit in DURATION_RE.findall(text))
+
+
+def parse_size(text):
+    """Bytes in e.g. '512 MB' or '1048576'"""
+    match = SIZE_RE.match(text)
+    if match is None:
+        return None
+    return float(match.group(1)) * UNIT_BYTES[(match.group(2) or '').lower()]
+
+
+def parse_window(text):
+    """
+    :return window: (start, end) minutes after midnight, None for any time
+    """
+    if text == "any":
+        return None
+    start, end = text.split('-')
+    minutes = []
+    for clock in (start, end):
+        hours, mins = clock.split(':')
+        minutes.append(int(hours) * 60 + int(mins))
+    return tuple(minutes)
+
+
+def in_window(window, when):
+    """True if when, seconds since the epoch, falls in the daily window"""
+    if window is None:
+        return True
+    local = time.localtime(when)
+    minute = local.tm_hour * 60 + local.tm_min
+    start, end = window
+    if start <= end:
+        return start <= minute < end
+    # A window over midnight, e.g. 23:00-01:00
+    return minute >= start or minute < end
+
+
+class Metrics(object):
+    """
+    Router health read through digidevice.cli
+    """
+    def __init__(self, cli_module=cli, monotonic=time.monotonic):
+        self.cli = cli_module
+        self.monotonic = monotonic
+        self.last_bytes = None  # (monotonic time, rx + tx bytes)
+
+    def system(self):
+        """
+        :return uptime, memory_free: seconds, percent or None
+        """
+        values = key_values(self.cli.execute(CMD_SYSTEM))
+        uptime = parse_duration(values.get('uptime', ''))
+        total = parse_size(values.get('total memory', ''))
+        free = parse_size(values.get('available memory', '') or values.get('free memory', ''))
+        memory_free = None
+        if total and free is not None:
+            memory_free = 100.0 * free / total
+        return uptime, memory_free
+
+    def traffic(self):
+        """
+        :return rate: float, WAN bytes/s since the last call, None on the first
+        """
+        values = key_values(self.cli.execute(CMD_INTERFACE.format(WAN_INTERFACE)))
+        total = (parse_size(values.get('rx bytes', '0')) or 0) + (parse_size(values.get('tx bytes', '0')) or 0)
+        now = self.monotonic()
+        rate = None
+        if self.last_bytes is not None and now > self.last_bytes[0]:
+            # A counter reset, e.g. the interface restarting, counts as quiet
+            rate = max(0.0, (total - self.last_bytes[1]) / (now - self.last_bytes[0]))
+        self.last_bytes = (now, total)
+        return rate
+
+    def sessions(self):
+        """
+        :return sessions: int, Lines of 'show users' after its header
+        """
+        lines = [line for line in self.cli.execute(CMD_USERS).splitlines() if line.strip()]
+        return len([line for line in lines[1:] if not line.lstrip().startswith('-')])
+
+    def read(self):
+        uptime, memory_free = self.system()
+        return {
+            'uptime': uptime,
+            'memory_free': memory_free,
+            'traffic': self.traffic(),
+            'sessions': self.sessions(),
+        }
+
+
+class Capture(object):
+    """
+    'show tech-support' on a background thread, with rotation of old captures
+    """
+    def __init__(self, cli_module=cli, directory=CAPTURE_DIR, keep=CAPTURE_KEEP, max_bytes=CAPTURE_MAX_BYTES,
+                 clock=time.time):
+        self.cli = cli_module
+        self.clock = clock
+        self.directory = directory
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self.thread = None
+        self.path = None
+
+    def start(self):
+        """
+        Start a capture, unless one was already taken for this reboot
+        """
+        if self.thread is not None:
+            return
+        name = "{0}{1}{2}".format(CAPTURE_PREFIX, datetime.fromtimestamp(self.clock()).strftime("%Y%m%d_%H%M%S"), CAPTURE_SUFFIX)
+        self.path = os.path.join(self.directory, name)
+        self.thread = threading.Thread(target=self.run, name='tech-support')
+        self.thread.daemon = True
+        self.thread.start()
+        print("Capturing tech support to {0}".format(self.path))
+
+    def run(self):
+        try:
+            self.cli.execute(CMD_TECH_SUPPORT.format(self.path))
+        except Exception as err:
+            print("Tech support capture failed: {0}".format(err))
+        self.rotate()
+
+    def wait(self, timeout=CAPTURE_TIMEOUT):
+        """
+        :return done: bool, False if the capture is still running
+        """
+        if self.thread is None:
+            return True
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def clear(self):
+        """
+        Take a new capture next time, once the current one has finished
+        """
+        if self.thread is not None and not self.thread.is_alive():
+            self.thread = None
+
+    def captures(self):
+        directory = self.directory or '.'
+        names = sorted(name for name in os.listdir(directory)
+                       if name.startswith(CAPTURE_PREFIX) and name.endswith(CAPTURE_SUFFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def rotate(self):
+        """
+        Remove the oldest captures, keeping at most keep files and max_bytes
+        """
+        paths = self.captures()
+        sizes = [os.path.getsize(path) for path in paths]
+        while paths and (len(paths) > self.keep or sum(sizes) > self.max_bytes):
+            if len(paths) == 1 and paths[0] == self.path:
+                # Keep the newest capture, even when it alone is too big
+                break
+            os.remove(paths.pop(0))
+            sizes.pop(0)
+
+
+class RebootScheduler(object):
+    """
+    Decides, every check, whether to wait, defer or reboot
+    """
+    def __init__(self, window, metrics, capture=None, cli_module=cli, clock=time.time):
+        self.window = window
+        self.metrics = metrics
+        self.capture = capture
+        self.cli = cli_module
+        self.clock = clock
+        self.busy_since = None
+        self.window_open = False
+        self.window_quiet = False
+        self.skipped_windows = 0
+
+    def busy(self, metrics):
+        """
+        :return reason: str, Why a reboot should wait, None when quiet
+        """
+        if metrics['traffic'] is None:
+            return "no traffic rate yet"
+        if metrics['traffic'] > TRAFFIC_LIMIT:
+            return "traffic {0:.0f} B/s".format(metrics['traffic'])
+        if metrics['sessions'] > SESSION_LIMIT:
+            return "{0} user sessions".format(metrics['sessions'])
+        return None
+
+    def due(self, metrics, now):
+        """
+        :return reason, forced: str for a reboot that is due or None, and
+            True if it must not wait for a quiet moment
+        """
+        if self.window is None:
+            if metrics['uptime'] >= REBOOT_TIME:
+                return "up {0} s".format(metrics['uptime']), False
+        elif in_window(self.window, now):
+            self.window_open = True
+            if metrics['uptime'] >= MIN_UPTIME:
+                if self.skipped_windows >= MAX_SKIPPED_WINDOWS:
+                    # Reboot at the start of the window, busy or not, rather
+                    # than outside it
+                    return "busy throughout {0} maintenance windows".format(self.skipped_windows), True
+                return "maintenance window", False
+        elif self.window_open:
+            # The window just closed, without a quiet moment to reboot
+            self.window_open = False
+            if metrics['uptime'] >= MIN_UPTIME:
+                self.skipped_windows += 1
+                print("Maintenance window busy throughout, {0} skipped in a row".format(self.skipped_windows))
+        if metrics['uptime'] >= MAX_UPTIME:
+            return "up {0} s".format(metrics['uptime']), False
+        if metrics['memory_free'] is not None and metrics['memory_free'] < MEMORY_FREE_MIN:
+            return "{0:.1f}% memory free".format(metrics['memory_free']), False
+        return None, False
+
+    def check(self):
+        """
+        Read the metrics once and act on them
+        :return action: str, 'wait', 'defer' or 'reboot'
+        """
+        now = self.clock()
+        metrics = self.metrics.read()
+        reason, forced = self.due(metrics, now)
+        if reason is None:
+            self.busy_since = None
+            if self.capture is not None:
+                self.capture.clear()
+            return 'wait'
+        if self.capture is not None:
+            self.capture.start()
+        busy = not forced and self.busy(metrics)
+        if busy:
+            if self.busy_since is None:
+                self.busy_since = now
+                print("Reboot due ({0}), deferred: {1}".format(reason, busy))
+            # An early reboot waits for a quiet moment for so long, a
+            # scheduled one for as long as the window is open
+            in_schedule = self.window is not None and in_window(self.window, now)
+            if in_schedule or now - self.busy_since < BUSY_MAX_DEFER:
+                return 'defer'
+            reason += ", busy for {0:.0f} s".format(now - self.busy_since)
+        self.reboot(reason)
+        return 'reboot'
+
+    def reboot(self, reason):
+        print("Rebooting: {0}".format(reason))
+        if self.capture is not None:
+            if not self.capture.wait():
+                print("Tech support capture still running after {0} s, rebooting anyway".format(CAPTURE_TIMEOUT))
+            self.capture.clear()
+        self.busy_since = None
+        self.skipped_windows = 0
+        self.cli.execute(CMD_REBOOT)
+
+    def run(self, sleep=time.sleep, monotonic=time.monotonic):
+        # Check on absolute monotonic deadlines, so the time the checks
+        # take does not stretch the interval
+        deadline = monotonic()
+        while True:
+            try:
+                self.check()
+            except Exception as err:
+                # A failed command or unexpected output must not end the
+                # script, or the router is never rebooted again
+                print("Reboot check failed: {0}".format(err))
+            deadline += CHECK_INTERVAL
+            delay = deadline - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                deadline = monotonic()
+
 
-""".format(sys.argv[0], REBOOT_TIME))
+def arg_value(name):
+    loc = sys.argv.index(name)
+    try:
+        return sys.argv[loc + 1]
+    except IndexError:
+        return None
 
 
 if __name__ == "__main__":
@@ -47,18 +391,19 @@ if __name__ == "__main__":
         exit()
     if "--debug" in sys.argv:
         DEBUG = True
-        print("Debug option to output Tech Support before reboot enabled.")
+        print("Debug option to capture Tech Support before reboot enabled.")
     if "--time" in sys.argv:
-        loc = sys.argv.index("--time")
         try:
-            REBOOT_TIME = int(sys.argv[loc + 1])
-        except:
+            REBOOT_TIME = int(arg_value("--time"))
+        except (TypeError, ValueError):
             pass
+    if "--window" in sys.argv:
+        MAINTENANCE_WINDOW = arg_value("--window") or MAINTENANCE_WINDOW
 
-    print("Running reboot script, timeout {0} seconds".format(REBOOT_TIME))
-    while True:
-        sleep(REBOOT_TIME)
-        if DEBUG:
-            log_name = "tech_support_{}.log".format(datetime.now().strftime("%Y%m%d_%H%M%S"))
-            cli.execute("show tech-support {}".format(log_name))
-        cli.execute("reboot")
+    window = parse_window(MAINTENANCE_WINDOW)
+    if window is None:
+        print("Running reboot script, every {0} seconds when quiet".format(REBOOT_TIME))
+    else:
+        print("Running reboot script, maintenance window {0}".format(MAINTENANCE_WINDOW))
+    scheduler = RebootScheduler(window, Metrics(), DEBUG and Capture() or None)
+    scheduler.run()
@@ -0,0 +1,3 @@
+"""
+Off-device stand-in for the LR54 'digidevice' package, see cli.py.
+"""
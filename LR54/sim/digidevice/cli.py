@@ -0,0 +1,108 @@
+#############################################################################
+# Copyright 2018, Digi International Inc.                                   #
+#                                                                           #
+# This Source Code Form is subject to the terms of the Mozilla Public       #
+# License, v. 2.0. If a copy of the MPL was not distributed with this       #
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.                  #
+#############################################################################
+
+"""
+Off-device stand-in for 'digidevice.cli' on the LR54.
+
+Put LR54/sim first on the path to run lr54_reboot.py on a PC:
+    > PYTHONPATH=sim python3 lr54_reboot.py --window any --time 120
+
+The router is simulated from the 'state' dict: the clock, the boot time,
+memory, WAN traffic in bytes/s and the user sessions, each a value or a
+callable of the current time. 'reboot' restarts the uptime and counters,
+and 'show tech-support <file>' writes a file of tech_support_bytes.
+Every command run is recorded in 'commands', and every reboot, with its
+time, in 'reboots'.
+"""
+
+import time
+
+state = {
+    'clock': time.time,  # callable returning the current time
+    'boot': time.time(),
+    'memory_total': 512 * 1024,  # kB
+    'memory_free': 256 * 1024,  # kB, or callable(now)
+    'traffic': 0,  # WAN bytes/s, or callable(now)
+    'sessions': 0,  # or callable(now)
+    'tech_support_bytes': 1024 * 1024,
+}
+
+commands = []
+reboots = []
+_counters = {'bytes': 0.0, 'updated': None}
+
+
+def value(name, now):
+    item = state[name]
+    if callable(item):
+        return item(now)
+    return item
+
+
+def reset(clock=time.time):
+    state['clock'] = clock
+    state['boot'] = clock()
+    _counters['bytes'] = 0.0
+    _counters['updated'] = None
+    del commands[:]
+    del reboots[:]
+
+
+def duration(seconds):
+    seconds = int(seconds)
+    return "{0} Days, {1} Hours, {2} Minutes, {3} Seconds".format(
+        seconds // 86400, seconds // 3600 % 24, seconds // 60 % 60, seconds % 60)
+
+
+def wan_bytes(now):
+    if _counters['updated'] is not None:
+        _counters['bytes'] += value('traffic', now) * (now - _counters['updated'])
+    _counters['updated'] = now
+    return int(_counters['bytes'])
+
+
+def execute(command, timeout=30):
+    now = state['clock']()
+    commands.append(command)
+    if command == "show system":
+        return "\n".join([
+            " Model            : Digi LR54",
+            " Firmware Version : 19.11.12.0",
+            " Uptime           : {0}".format(duration(now - state['boot'])),
+            " Total Memory     : {0} kB".format(state['memory_total']),
+            " Available Memory : {0} kB".format(int(value('memory_free', now))),
+            "",
+        ])
+    if command.startswith("show network interface"):
+        total = wan_bytes(now)
+        return "\n".join([
+            " Interface : {0}".format(command.split()[-1]),
+            " Status    : up",
+            " Rx Bytes  : {0}".format(total * 3 // 4),
+            " Tx Bytes  : {0}".format(total - total * 3 // 4),
+            "",
+        ])
+    if command == "show users":
+        lines = [" Username  Type  From           Idle"]
+        for index in range(value('sessions', now)):
+            lines.append(" admin     ssh   192.168.1.{0}    0".format(index + 10))
+        return "\n".join(lines) + "\n"
+    if command.startswith("show tech-support"):
+        out = open(command.split(None, 2)[2], 'w')
+        try:
+            out.write('x' * state['tech_support_bytes'])
+        finally:
+            out.close()
+        return ""
+    if command == "reboot":
+        reboots.append(now)
+        state['boot'] = now
+        _counters['bytes'] = 0.0
+        _counters['updated'] = None
+        return ""
+    return "Error: unknown command\n"
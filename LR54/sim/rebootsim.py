@@ -0,0 +1,102 @@
+#############################################################################
+# Copyright 2018, Digi International Inc.                                   #
+#                                                                           #
+# This Source Code Form is subject to the terms of the Mozilla Public       #
+# License, v. 2.0. If a copy of the MPL was not distributed with this       #
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.                  #
+#############################################################################
+
+"""
+Run lr54_reboot.RebootScheduler against the fake digidevice.cli through a
+simulated week, one check a minute, with the 02:00-04:00 window:
+busy working days, WAN backups filling the window on nights 2 to 4, an
+SSH session over the window on night 5 and a memory leak on day 5, after
+which night 6 waits in the window for MIN_UPTIME.
+Print when and why it deferred and rebooted, and the captures kept.
+
+Usage:      From the LR54 directory
+            > PYTHONPATH=sim:. python3 sim/rebootsim.py
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from digidevice import cli
+
+import lr54_reboot
+
+DAYS = 7
+START = time.mktime((2018, 6, 4, 0, 0, 0, 0, 0, -1))  # local midnight
+MB = 1024  # kB
+LEAK_START = 5 * 86400 + 8 * 3600  # day 5 08:00
+LEAK_RATE = 34 * MB / 3600.0  # kB/s
+
+
+class Clock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def day_time(seconds):
+    seconds = int(seconds)
+    return seconds // 86400, seconds // 3600 % 24, seconds // 60 % 60
+
+
+def traffic(now):
+    day, hour, minute = day_time(now - START)
+    if 2 <= day <= 4 and 1 <= hour < 5:
+        return 250000  # nightly backup over the WAN
+    if 8 <= hour < 18:
+        return 80000
+    return 1500
+
+
+def sessions(now):
+    day, hour, minute = day_time(now - START)
+    if day == 5 and (hour == 1 and minute >= 30 or hour == 2 or hour == 3 and minute < 10):
+        return 1
+    return 0
+
+
+def memory_free(now):
+    # The leak ends with the first reboot after it started
+    if cli.state['boot'] > START + LEAK_START:
+        return 256 * MB
+    return 256 * MB - max(0.0, now - START - LEAK_START) * LEAK_RATE
+
+
+def stamp(now):
+    day, hour, minute = day_time(now - START)
+    return "day {0} {1:02d}:{2:02d}".format(day, hour, minute)
+
+
+if __name__ == '__main__':
+    clock = Clock(START)
+    cli.reset(clock)
+    cli.state.update(traffic=traffic, sessions=sessions, memory_free=memory_free)
+    directory = tempfile.mkdtemp()
+    try:
+        capture = lr54_reboot.Capture(directory=directory, keep=3, max_bytes=3 * 1024 * 1024, clock=clock)
+        scheduler = lr54_reboot.RebootScheduler(lr54_reboot.parse_window("02:00-04:00"),
+                                                lr54_reboot.Metrics(monotonic=clock), capture, clock=clock)
+        previous = 'wait'
+        checks = 0
+        while clock.now < START + DAYS * 86400:
+            action = scheduler.check()
+            checks += 1
+            if action != previous:
+                print("  {0}: {1}".format(stamp(clock.now), action))
+                previous = action
+            clock.now += lr54_reboot.CHECK_INTERVAL
+
+        print("{0} checks, {1} commands, {2} reboots:".format(checks, len(cli.commands), len(cli.reboots)))
+        for when in cli.reboots:
+            print("  {0}".format(stamp(when)))
+        print("Captures kept: {0}".format(", ".join(os.path.basename(path) for path in capture.captures())))
+    finally:
+        shutil.rmtree(directory)
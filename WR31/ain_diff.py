@@ -1,26 +1,89 @@
-import digihw
-import sarcli
-from time import sleep
+"""
+Compare the two ways of reading the WR31 analog input, in-process through
+digihw.wr31_ain_get_value() and through the 'gpio ain' CLI command.
 
-GPIO_CLI = 'gpio ain'
+Each loop reads both paths back to back and prints the values. At the end
+the drift between them (mean, min and max of digihw - CLI), the mean read
+latency of each path and the speedup of digihw over the CLI are reported.
 
+Usage:      > python ain_diff.py [-L<loops>] [-W<wait seconds>] [-A<voltage|current>]
+"""
 
-def cli(cmd):
-    s = sarcli.open()
-    s.write(cmd)
-    resp = s.read()
-    s.close()
-    return resp.strip('\r\n').strip('\r\nOK')
+import sys
+import time
 
+import wr31io
 
-def python_ain():
-    return digihw.wr31_ain_get_value()
+LOOPS = 20
+WAIT = 2  # seconds
+ANALOG_MODE = 'voltage'
+DRIFT_LIMIT = 0.01  # Largest difference, in V or mA, reported as consistent
 
-if __name__ == "__main__":
-    for x in range(20):
-        ain = python_ain()
+
+def timed(read):
+    start = time.time()
+    value = read()
+    return value, time.time() - start
+
+
+def compare(loops=LOOPS, wait=WAIT, mode=ANALOG_MODE):
+    """
+    Read both paths loops times
+    :return: (diffs, digihw latencies, cli latencies)
+    """
+    digihw_reader = wr31io.DigihwAnalogReader()
+    cli_reader = wr31io.CliAnalogReader()
+    cli_reader.set_mode(mode)
+    digihw_reader.mode = mode
+    diffs = []
+    digihw_times = []
+    cli_times = []
+    for x in range(loops):
+        ain, digihw_time = timed(digihw_reader.read_ain)
+        resp, cli_time = timed(cli_reader.read_ain)
         print "Loop %s" % x
         print "DIGIHW Value: %s" % (ain,)
-        resp = cli(GPIO_CLI)
-        print "CLI Value: %s" % (resp,)
-        sleep(2)
+        print "CLI Value: %s %s" % (resp, cli_reader.unit)
+        diffs.append(ain - resp)
+        digihw_times.append(digihw_time)
+        cli_times.append(cli_time)
+        if wait and x < loops - 1:
+            time.sleep(wait)
+    if digihw_reader.fallbacks:
+        print "digihw failed %s times, the CLI was read instead" % digihw_reader.fallbacks
+    return diffs, digihw_times, cli_times
+
+
+def report(diffs, digihw_times, cli_times, unit):
+    digihw_mean = sum(digihw_times) / len(digihw_times)
+    cli_mean = sum(cli_times) / len(cli_times)
+    drift = max([abs(d) for d in diffs])
+    print "======================"
+    print "Drift (digihw - CLI): mean %.4f, min %.4f, max %.4f %s" % (
+        sum(diffs) / len(diffs), min(diffs), max(diffs), unit)
+    print "Read latency: digihw %.3f ms, CLI %.3f ms" % (1000 * digihw_mean, 1000 * cli_mean)
+    if digihw_mean:
+        print "Speedup: %.1fx" % (cli_mean / digihw_mean)
+    if drift > DRIFT_LIMIT:
+        print "INCONSISTENT: paths differ by up to %.4f %s" % (drift, unit)
+    else:
+        print "Consistent within %s %s" % (DRIFT_LIMIT, unit)
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:]:
+        if arg.startswith('-L'):
+            LOOPS = int(arg[2:])
+        elif arg.startswith('-W'):
+            WAIT = float(arg[2:])
+        elif arg.startswith('-A'):
+            ANALOG_MODE = arg[2:]
+
+    if not wr31io.has_digihw(wr31io.DIGIHW_AIN):
+        print "digihw.%s is not available" % wr31io.DIGIHW_AIN
+        sys.exit(1)
+    if ANALOG_MODE not in wr31io.ANALOG_UNITS or LOOPS < 1:
+        print __doc__
+        sys.exit(1)
+    diffs, digihw_times, cli_times = compare(LOOPS, WAIT, ANALOG_MODE)
+    report(diffs, digihw_times, cli_times, wr31io.ANALOG_UNITS[ANALOG_MODE])
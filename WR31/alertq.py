@@ -0,0 +1,238 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Non-blocking alert dispatch for the WR31 example applications.
+
+Each alert sink (anything with a send_alert(message) method, like
+doormon.SmsAlert) gets its own bounded queue and worker thread, so a slow
+or failing uplink never holds up the caller or the other sinks.
+
+- A failed send is retried with exponential backoff, up to RETRIES times.
+- Alerts with the same key are coalesced: only the latest pending alert
+  for a key is sent, and none if it matches the last one delivered, so a
+  door that flaps open and closed while the uplink is busy sends nothing.
+- When a queue is full the oldest pending alert is dropped, preferring
+  alerts without a key.
+
+Usage:
+    dispatcher = alertq.AlertDispatcher([doormon.SmsAlert('+15555555555', 'Door')])
+    dispatcher.dispatch('OPEN', key='door')
+"""
+
+import threading
+import time
+
+import clisess
+
+QUEUE_SIZE = 16  # Pending alerts per sink
+RETRIES = 3  # Retries after the first failed attempt
+BACKOFF = 1.0  # seconds before the first retry, doubled for each retry
+BACKOFF_MAX = 30.0  # seconds
+
+
+def alert_failed(response):
+    """
+    Check the response of a send_alert() call for failure
+    :param response: CLI response str, or (success, error, errmsg) tuple
+        from idigidata.send_to_idigi()
+    :return: bool, True if the alert was not sent
+    """
+    if isinstance(response, tuple):
+        return not response or not response[0]
+    if isinstance(response, str):
+        return clisess.last_line(response) == 'ERROR'
+    return False
+
+
+class SinkWorker(object):
+    """
+    Queue and worker thread for one alert sink
+    """
+    def __init__(self, sink, queue_size=QUEUE_SIZE, retries=RETRIES, backoff=BACKOFF):
+        self.sink = sink
+        self.name = sink.__class__.__name__
+        self.queue_size = queue_size
+        self.retries = retries
+        self.backoff = backoff
+        self.pending = []  # [key, message] in arrival order
+        self.delivered = {}  # key -> last message delivered
+        self.busy = False
+        self.running = True
+        self.cond = threading.Condition()
+        self.counters = {
+            'queued': 0,
+            'sent': 0,
+            'retries': 0,
+            'failed': 0,
+            'coalesced': 0,
+            'dropped': 0,
+        }
+        self.thread = threading.Thread(target=self.run, name='alert-' + self.name)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def put(self, message, key):
+        self.cond.acquire()
+        try:
+            self.counters['queued'] += 1
+            if key is not None:
+                for item in self.pending:
+                    if item[0] == key:
+                        item[1] = message
+                        self.counters['coalesced'] += 1
+                        return
+            if len(self.pending) >= self.queue_size:
+                self.pending.pop(self.drop_index())
+                self.counters['dropped'] += 1
+            self.pending.append([key, message])
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def drop_index(self):
+        # Keyed alerts carry a status, so drop the oldest unkeyed one first
+        for index, item in enumerate(self.pending):
+            if item[0] is None:
+                return index
+        return 0
+
+    def next_alert(self):
+        self.cond.acquire()
+        try:
+            while self.running and not self.pending:
+                self.busy = False
+                self.cond.notifyAll()
+                self.cond.wait()
+            if not self.running:
+                return None
+            self.busy = True
+            key, message = self.pending.pop(0)
+            if key is not None and self.delivered.get(key) == message:
+                # The status went and came back while this alert was queued
+                self.counters['coalesced'] += 1
+                return False
+            return key, message
+        finally:
+            self.cond.release()
+
+    def superseded(self, key):
+        self.cond.acquire()
+        try:
+            for item in self.pending:
+                if key is not None and item[0] == key:
+                    return True
+            return False
+        finally:
+            self.cond.release()
+
+    def wait_retry(self, delay):
+        self.cond.acquire()
+        try:
+            if self.running:
+                self.cond.wait(delay)
+        finally:
+            self.cond.release()
+
+    def send(self, key, message):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.wait_retry(delay)
+                delay = min(delay * 2, BACKOFF_MAX)
+                if not self.running:
+                    return
+                if self.superseded(key):
+                    self.counters['coalesced'] += 1
+                    return
+                self.counters['retries'] += 1
+            try:
+                failed = alert_failed(self.sink.send_alert(message))
+            except Exception:
+                failed = True
+            if not failed:
+                self.counters['sent'] += 1
+                if key is not None:
+                    self.delivered[key] = message
+                return
+        self.counters['failed'] += 1
+
+    def run(self):
+        while True:
+            alert = self.next_alert()
+            if alert is None:
+                break
+            if alert:
+                self.send(*alert)
+
+    def wait_idle(self, timeout):
+        end = time.time() + timeout
+        self.cond.acquire()
+        try:
+            while self.running and (self.pending or self.busy) and time.time() < end:
+                self.cond.wait(max(0.0, min(end - time.time(), 0.1)))
+            return not (self.pending or self.busy)
+        finally:
+            self.cond.release()
+
+    def stop(self, timeout=1.0):
+        self.cond.acquire()
+        try:
+            self.running = False
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+        if threading.currentThread() is not self.thread:
+            self.thread.join(timeout)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['depth'] = len(self.pending)
+        return stats
+
+
+class AlertDispatcher(object):
+    """
+    Hands alerts to a SinkWorker per sink, without blocking the caller
+    """
+    def __init__(self, sinks, queue_size=QUEUE_SIZE, retries=RETRIES, backoff=BACKOFF):
+        self.workers = [SinkWorker(sink, queue_size, retries, backoff) for sink in sinks]
+
+    def dispatch(self, message, key=None):
+        """
+        Queue an alert for every sink
+        :param message: str, Alert content
+        :param key: str, Alerts with the same key are coalesced, None for never
+        """
+        for worker in self.workers:
+            worker.put(message, key)
+
+    def wait_idle(self, timeout=10.0):
+        """
+        Wait until every queue is empty
+        :return: bool, True if all alerts were handled within timeout
+        """
+        end = time.time() + timeout
+        idle = True
+        for worker in self.workers:
+            idle = worker.wait_idle(max(0.0, end - time.time())) and idle
+        return idle
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def stats(self):
+        """
+        :return stats: dict, Counters and queue depth keyed by sink class name
+        """
+        stats = {}
+        for index, worker in enumerate(self.workers):
+            name = worker.name
+            if name in stats:
+                name = '{0}-{1}'.format(name, index)
+            stats[name] = worker.stats()
+        return stats
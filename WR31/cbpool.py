@@ -0,0 +1,245 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Bounded worker pool for idigidata device request callbacks.
+
+Callbacks registered here run on a fixed number of worker threads instead
+of one thread per request. The device request waits for its callback up
+to TIMEOUT seconds, and:
+
+- A request arriving while QUEUE_SIZE requests are waiting is answered
+  with BUSY_RESPONSE at once.
+- A request for a target that already has one waiting or running shares
+  its response instead of running the callback again.
+
+Per-target counters, latency and queue depth are kept for stats().
+
+Usage:
+    import cbpool
+    cbpool.register_callback('reportgps', report)
+"""
+
+import threading
+import time
+
+import idigidata
+
+WORKERS = 2  # Worker threads, the most callbacks running at once
+QUEUE_SIZE = 8  # Requests waiting for a worker
+TIMEOUT = 20  # seconds a device request waits for its callback
+BUSY_RESPONSE = 'busy'
+TIMEOUT_RESPONSE = 'timeout'
+ERROR_RESPONSE = 'error'
+
+
+class CallbackRequest(object):
+    """
+    One callback run, shared by coalesced device requests
+    """
+    def __init__(self, target, data):
+        self.target = target
+        self.data = data
+        self.queued = time.time()
+        self.started = None
+        self.response = None
+        self.done = threading.Event()
+
+
+class CallbackPool(object):
+    """
+    Runs registered callbacks on a fixed set of worker threads
+    """
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, timeout=TIMEOUT):
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.callbacks = {}  # target -> (callback, coalesce)
+        self.pending = []  # CallbackRequest waiting for a worker
+        self.active = {}  # target -> CallbackRequest waiting or running
+        self.counters = {}  # target -> dict
+        self.running = True
+        self.cond = threading.Condition()
+        self.threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self.run, name='callback-{0}'.format(index))
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def register(self, target, callback, coalesce=True):
+        """
+        Register a callback with idigidata, to run on the pool
+        :param target: str, Device request target
+        :param callback: callable(target, data) returning the response str
+        :param coalesce: bool, False to run the callback for every request
+        :return: result of idigidata.register_callback()
+        """
+        self.cond.acquire()
+        try:
+            self.callbacks[target] = (callback, coalesce)
+            self.counters.setdefault(target, {
+                'requests': 0,
+                'completed': 0,
+                'coalesced': 0,
+                'rejected': 0,
+                'timeouts': 0,
+                'errors': 0,
+                'latency_total': 0.0,
+                'latency_max': 0.0,
+                'run_total': 0.0,
+                'depth_max': 0,
+            })
+        finally:
+            self.cond.release()
+        return idigidata.register_callback(target, self.handle)
+
+    def unregister(self, target):
+        self.cond.acquire()
+        try:
+            self.callbacks.pop(target, None)
+        finally:
+            self.cond.release()
+        return idigidata.unregister_callback(target)
+
+    def submit(self, target, data):
+        """
+        Queue a request, or join the one already active for the target
+        :return request: CallbackRequest, None if the queue is full
+        """
+        self.cond.acquire()
+        try:
+            counters = self.counters[target]
+            counters['requests'] += 1
+            callback, coalesce = self.callbacks[target]
+            request = self.active.get(target)
+            if coalesce and request is not None:
+                counters['coalesced'] += 1
+                return request
+            if len(self.pending) >= self.queue_size:
+                counters['rejected'] += 1
+                return None
+            request = CallbackRequest(target, data)
+            self.pending.append(request)
+            if coalesce:
+                self.active[target] = request
+            counters['depth_max'] = max(counters['depth_max'], len(self.pending))
+            self.cond.notify()
+            return request
+        finally:
+            self.cond.release()
+
+    def handle(self, target, data):
+        """
+        The callback registered with idigidata
+        """
+        request = self.submit(target, data)
+        if request is None:
+            return BUSY_RESPONSE
+        request.done.wait(self.timeout)
+        if not request.done.isSet():
+            self.cond.acquire()
+            self.counters[target]['timeouts'] += 1
+            self.cond.release()
+            return TIMEOUT_RESPONSE
+        return request.response
+
+    def next_request(self):
+        self.cond.acquire()
+        try:
+            while self.running and not self.pending:
+                self.cond.wait()
+            if not self.running:
+                return None
+            request = self.pending.pop(0)
+            request.started = time.time()
+            return request
+        finally:
+            self.cond.release()
+
+    def run(self):
+        while True:
+            request = self.next_request()
+            if request is None:
+                break
+            callback, coalesce = self.callbacks.get(request.target, (None, False))
+            error = False
+            try:
+                request.response = callback(request.target, request.data)
+            except Exception as err:
+                print('Callback {0} failed: {1}'.format(request.target, err))
+                request.response = ERROR_RESPONSE
+                error = True
+            finished = time.time()
+            self.cond.acquire()
+            try:
+                if self.active.get(request.target) is request:
+                    del self.active[request.target]
+                counters = self.counters[request.target]
+                counters['completed'] += 1
+                counters['errors'] += error
+                latency = finished - request.queued
+                counters['latency_total'] += latency
+                counters['latency_max'] = max(counters['latency_max'], latency)
+                counters['run_total'] += finished - request.started
+            finally:
+                self.cond.release()
+            request.done.set()
+
+    def stats(self):
+        """
+        :return stats: dict, Counters per target, with mean latency and run
+            time in seconds, and the current queue depth
+        """
+        self.cond.acquire()
+        try:
+            stats = {'depth': len(self.pending), 'workers': len(self.threads), 'targets': {}}
+            for target, counters in self.counters.items():
+                target_stats = dict(counters)
+                completed = counters['completed'] or 1
+                target_stats['latency_mean'] = counters['latency_total'] / completed
+                target_stats['run_mean'] = counters['run_total'] / completed
+                stats['targets'][target] = target_stats
+            return stats
+        finally:
+            self.cond.release()
+
+    def stop(self, timeout=1.0):
+        self.cond.acquire()
+        try:
+            self.running = False
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+        for thread in self.threads:
+            thread.join(timeout)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the shared pool, creating it on first use
+    :return pool: CallbackPool
+    """
+    global _pool
+    if _pool is None:
+        _pool_lock.acquire()
+        try:
+            if _pool is None:
+                _pool = CallbackPool()
+        finally:
+            _pool_lock.release()
+    return _pool
+
+
+def register_callback(target, callback, coalesce=True):
+    """
+    Register a callback to run on the shared pool, in place of
+    idigidata.register_callback()
+    """
+    return get_pool().register(target, callback, coalesce)
@@ -0,0 +1,167 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Cellular health telemetry, from 'modemstat ?'.
+
+Every SAMPLE_INTERVAL seconds the modem status is read on the shared
+clisess session and parsed in one pass into a read_sim.ModemStatus.
+
+Each numeric metric in METRICS goes through a rptfilt.Thresholds filter,
+and is uploaded to cellular/<metric> when it has moved by its deadband,
+crossed one of its levels by its hysteresis, or has not been sent for
+MAX_SILENCE seconds. A level crossing also uploads a message to ALERT_STREAM, e.g.
+'rssi fell below -95 dBm', since falling signal is the early warning of a
+lost link. TEXT_FIELDS, such as the network registration and the ICCID,
+are uploaded when they change.
+
+Usage:      > python cellmon.py [sample interval in seconds]
+            Upload read_sim.py, clisess.py, dpupload.py, rptfilt.py and
+            ticker.py with it. Off-device:
+            > PYTHONPATH=sim:.:.. python cellmon.py 5
+"""
+
+import sys
+import time
+
+import clisess
+import dpupload
+import read_sim
+import rptfilt
+import ticker
+
+SAMPLE_INTERVAL = 60  # seconds between modem status reads
+MAX_SILENCE = 3600  # seconds, longest time a metric is not uploaded
+STREAM_PREFIX = 'cellular/'
+ALERT_STREAM = 'cellular/alert'
+
+# ModemStatus field, deadband, levels reported when crossed, hysteresis,
+# units
+METRICS = [
+    ('rssi', 3, [-105, -95, -85], 2, 'dBm'),
+    ('rsrp', 3, [-115, -105, -95], 2, 'dBm'),
+    ('rsrq', 2, [-15, -10], 1, 'dB'),
+    ('sinr', 2, [0, 10, 20], 1, 'dB'),
+    ('temperature', 2, [70, 80], 1, 'C'),
+]
+TEXT_FIELDS = ['network', 'technology', 'operator', 'iccid']
+
+
+class CellMonitor(object):
+    """
+    Samples the modem status and uploads what changed
+    """
+    def __init__(self, uploader=None, metrics=METRICS, text_fields=TEXT_FIELDS, max_silence=MAX_SILENCE):
+        self.uploader = uploader or dpupload.get_uploader()
+        self.metrics = metrics
+        self.text_fields = text_fields
+        self.filters = {}
+        for field, deadband, levels, hysteresis, units in metrics:
+            self.filters[field] = rptfilt.Thresholds(deadband, levels, max_silence, hysteresis)
+        for field in text_fields:
+            self.filters[field] = rptfilt.OnChange(max_silence)
+        self.latest = None
+        self.counters = {
+            'samples': 0,
+            'errors': 0,
+            'uploads': 0,
+            'alerts': 0,
+            'read_total': 0.0,
+            'parse_total': 0.0,
+        }
+
+    def read(self):
+        """
+        :return status: read_sim.ModemStatus
+        """
+        start = time.time()
+        response = clisess.execute(read_sim.MODEM_STAT)
+        parsed = time.time()
+        status = read_sim.parse_modem_status(response)
+        self.counters['read_total'] += parsed - start
+        self.counters['parse_total'] += time.time() - parsed
+        return status
+
+    def sample(self, now=None):
+        """
+        Read the modem status once and queue the DataPoints due
+        :return status: read_sim.ModemStatus, None if the read failed
+        """
+        if now is None:
+            now = time.time()
+        self.counters['samples'] += 1
+        try:
+            status = self.read()
+        except clisess.CliError as err:
+            print('Modem status read failed: {0}'.format(err))
+            self.counters['errors'] += 1
+            return None
+        self.latest = status
+        self.offer(status, now)
+        return status
+
+    def offer(self, status, when):
+        """
+        Pass a status through the filters and queue what they report
+        """
+        for field, deadband, levels, hysteresis, units in self.metrics:
+            value = getattr(status, field)
+            if value is None:
+                continue
+            report_filter = self.filters[field]
+            crossings = report_filter.crossings
+            points = report_filter.offer(value, when)
+            if report_filter.crossings != crossings:
+                self.alert(field, value, units, when)
+            for point_when, point_value in points:
+                self.add(field, point_value, isinstance(point_value, float) and 'float' or 'integer',
+                         units, point_when)
+        for field in self.text_fields:
+            value = getattr(status, field)
+            if value is None:
+                continue
+            for point_when, point_value in self.filters[field].offer(value, when):
+                self.add(field, point_value, 'string', None, point_when)
+
+    def alert(self, field, value, units, when):
+        report_filter = self.filters[field]
+        previous, band = report_filter.last_crossing
+        if band < previous:
+            message = '{0} fell below {1} {2}: {3}'.format(field, report_filter.levels[band], units, value)
+        else:
+            message = '{0} rose above {1} {2}: {3}'.format(field, report_filter.levels[band - 1], units, value)
+        print(message)
+        self.counters['alerts'] += 1
+        self.uploader.add(ALERT_STREAM, message, data_type='string', timestamp=int(when * 1000))
+
+    def add(self, field, value, data_type, units, when):
+        self.counters['uploads'] += 1
+        self.uploader.add(STREAM_PREFIX + field, value, data_type=data_type, units=units,
+                          timestamp=int(when * 1000))
+
+    def run(self, interval=SAMPLE_INTERVAL):
+        timer = ticker.Ticker(interval)
+        while True:
+            self.sample()
+            self.uploader.poll()
+            timer.wait()
+
+    def stats(self):
+        """
+        :return stats: dict, Samples, read errors, DataPoints and alerts
+            queued, and the mean read and parse time in seconds
+        """
+        stats = dict(self.counters)
+        samples = max(1, self.counters['samples'] - self.counters['errors'])
+        stats['read_mean'] = self.counters['read_total'] / samples
+        stats['parse_mean'] = self.counters['parse_total'] / samples
+        return stats
+
+
+if __name__ == '__main__':
+    interval = len(sys.argv) > 1 and float(sys.argv[1]) or SAMPLE_INTERVAL
+    print('Reporting cellular health every {0} s'.format(interval))
+    CellMonitor().run(interval)
@@ -0,0 +1,226 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Persistent, shared sarcli sessions for the WR31 example applications.
+
+Opening a sarcli session costs more than most of the commands the examples
+run, so instead of open/write/read/close per command this module keeps a
+small pool of long-lived sessions. A response is framed on the final 'OK' or
+'ERROR' line, a failed session is re-opened and the command retried, and a
+session is checked out by only one thread at a time.
+
+Usage:
+    import clisess
+    response = clisess.execute('gpio dio')
+
+    # or, to run several commands back to back on one session
+    with clisess.get_pool().session() as cli:
+        dio = cli.execute('gpio dio')
+        ain = cli.execute('gpio ain')
+"""
+
+import threading
+import Queue
+from contextlib import contextmanager
+
+import sarcli
+
+try:
+    import instr
+except ImportError:
+    # Call statistics are optional, upload instr.py to have them
+    instr = None
+
+POOL_SIZE = 1  # Number of sessions in the shared pool
+CHECKOUT_TIMEOUT = 30  # seconds to wait for a free session
+RETRIES = 1  # Re-open and retry this many times when a session fails
+TERMINATORS = ('OK', 'ERROR')
+
+
+class CliError(Exception):
+    """
+    Raised when a command can not be run on a CLI session
+    """
+    pass
+
+
+def last_line(response):
+    """
+    Return the last non-blank line of a CLI response
+    :param response: str, CLI response
+    :return line: str, Last line, stripped
+    """
+    end = len(response.rstrip())
+    start = response.rfind('\n', 0, end) + 1
+    return response[start:end].strip()
+
+
+def is_complete(response):
+    """
+    Check whether a CLI response ends with an 'OK' or 'ERROR' line
+    :param response: str, CLI response
+    :return: bool, True if the response is complete
+    """
+    return last_line(response) in TERMINATORS
+
+
+class CliSession(object):
+    """
+    A single long-lived sarcli session
+    """
+    def __init__(self, opener=None):
+        self.opener = opener or sarcli.open
+        self.cli = None
+        self.opens = 0
+        self.commands = 0
+
+    def open(self):
+        if self.cli is None:
+            self.cli = self.opener()
+            self.opens += 1
+
+    def close(self):
+        if self.cli is not None:
+            try:
+                self.cli.close()
+            except Exception:
+                pass
+            self.cli = None
+
+    def is_open(self):
+        return self.cli is not None
+
+    def _read_response(self):
+        response = ''
+        empty_reads = 0
+        while True:
+            chunk = self.cli.read(-1)
+            if not chunk:
+                # An empty read marks the end of a response. One left over
+                # from the previous command is skipped.
+                empty_reads += 1
+                if response or empty_reads > 1:
+                    break
+                continue
+            response += chunk
+            if is_complete(response):
+                break
+        return response
+
+    def execute(self, command):
+        """
+        Run a command, re-opening the session if it has failed
+        :param command: str, Command to run
+        :return response: str, Response to command, including terminator
+        """
+        if instr is None:
+            return self._execute(command)
+        with instr.timer('cli', command):
+            return self._execute(command)
+
+    def _execute(self, command):
+        error = None
+        for attempt in range(RETRIES + 1):
+            try:
+                self.open()
+                self.cli.write(command)
+                response = self._read_response()
+                if response:
+                    self.commands += 1
+                    return response
+                error = 'no response'
+            except Exception as err:
+                error = err
+            self.close()
+        raise CliError('{0}: {1}'.format(command, error))
+
+
+class CliPool(object):
+    """
+    A fixed-size pool of CLI sessions, safe to share between threads
+    """
+    def __init__(self, size=POOL_SIZE, opener=None):
+        self.size = size
+        self.sessions = []
+        self.idle = Queue.Queue(size)
+        for x in range(size):
+            session = CliSession(opener)
+            self.sessions.append(session)
+            self.idle.put(session)
+
+    def checkout(self, timeout=CHECKOUT_TIMEOUT):
+        try:
+            return self.idle.get(True, timeout)
+        except Queue.Empty:
+            raise CliError('No CLI session free after {0} seconds'.format(timeout))
+
+    def checkin(self, session):
+        self.idle.put(session)
+
+    @contextmanager
+    def session(self, timeout=CHECKOUT_TIMEOUT):
+        session = self.checkout(timeout)
+        try:
+            yield session
+        finally:
+            self.checkin(session)
+
+    def execute(self, command):
+        """
+        Run a command on the next free session
+        :param command: str, Command to run
+        :return response: str, Response to command
+        """
+        session = self.checkout()
+        try:
+            return session.execute(command)
+        finally:
+            self.checkin(session)
+
+    def open_sessions(self):
+        return len([s for s in self.sessions if s.is_open()])
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'open': self.open_sessions(),
+            'opens': sum([s.opens for s in self.sessions]),
+            'commands': sum([s.commands for s in self.sessions]),
+        }
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the shared pool, creating it on first use
+    :return pool: CliPool
+    """
+    global _pool
+    if _pool is None:
+        _pool_lock.acquire()
+        try:
+            if _pool is None:
+                _pool = CliPool()
+        finally:
+            _pool_lock.release()
+    return _pool
+
+
+def execute(command):
+    """
+    Run a command on the shared pool
+    :param command: str, Command to run
+    :return response: str, Response to command
+    """
+    return get_pool().execute(command)
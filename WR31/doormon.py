@@ -6,21 +6,31 @@
 
 """
 Monitor the WR31 door enclosure
+
+The door switch on D1 is read through digihw when available, otherwise
+through the 'gpio dio' CLI command. The door reads OPEN while the D0 or D1
+output is ON on either path; digihw can not read outputs, so they are read
+through the CLI every DOUT_REFRESH seconds. Polling runs at the shortest interval
+of the read path while the input is changing and backs off to its longest
+interval while it is steady. A new status must hold for DEBOUNCE seconds
+before it is reported. Alerts are sent from a queue per alert type, so a
+slow uplink does not delay detection. While the status is steady, it is
+sent again to the Datapoint alerts every HEARTBEAT seconds, so a silent
+stream means the monitor is down rather than the door unchanged.
 """
 
 import time
 import sys
-import sarcli
-import idigidata
-
+import alertq
+import clisess
+import dpupload
+import rptfilt
+import tsstore
+import wr31io
 
-def millisecond_timestamp():
-    """
-    Return a timestamp, in milliseconds
-    :return ms_timestamp: int, Timestamp in milliseconds
-    """
-    ms_timestamp = int(time.time() * 1000)
-    return ms_timestamp
+DEBOUNCE = 0.05  # seconds a new door status must hold before it is reported
+DOUT_REFRESH = 60  # seconds between CLI reads of the outputs on the digihw path
+HEARTBEAT = 3600  # seconds between reports of a steady status, None for never
 
 
 def cli_command(cmd):
@@ -29,11 +39,7 @@ def cli_command(cmd):
     :param cmd: str, Command to run
     :return response: str, Response to cmd
     """
-    cli = sarcli.open()
-    cli.write(cmd)
-    response = cli.read()
-    cli.close()
-    return response
+    return clisess.execute(cmd)
 
 
 class SmsAlert(object):
@@ -60,58 +66,139 @@ class DatapointAlert(object):
     """
     Send a Datapoint alert
     """
-    def __init__(self, destination):
+    def __init__(self, destination, uploader=None):
         self.destination = destination
+        self.uploader = uploader or dpupload.get_uploader()
 
     def send_alert(self, message):
         """
-        Send a Datapoint alert
+        Send a Datapoint alert, along with any other queued Datapoints
         :param message: str, Datapoint content
         :return response: tuple, Result code of datapoint upload attempt
         """
-        timestamp = millisecond_timestamp()
-        dpoint = """\
-        <DataPoint>
-            <dataType>STRING</dataType>
-            <data>{0}</data>
-            <timestamp>{1}</timestamp>
-            <streamId>{2}</streamId>
-        </DataPoint>""".format(message, timestamp, self.destination)
-        response = idigidata.send_to_idigi(dpoint, "DataPoint/stream.xml")
-        return response
+        self.uploader.add(self.destination, message, data_type='STRING')
+        if self.uploader.flush():
+            return (True, 0, '')
+        # The uploader keeps the Datapoint and sends it when the uplink is
+        # back, so the alert must not be retried
+        return (True, 0, 'spooled')
 
 
 class DoorMonitor(object):
     """
     Provides methods to monitor the enclosure door status
     """
-    def __init__(self, alert_list):
+    def __init__(self, alert_list, reader=None, debounce=DEBOUNCE, heartbeat=HEARTBEAT, store=None):
         self.d1_status = ""
         self.alert_list = alert_list
-
-    @classmethod
-    def switch_status(cls):
+        self.dispatcher = alertq.AlertDispatcher(alert_list)
+        heartbeat_list = [alert for alert in alert_list if isinstance(alert, DatapointAlert)]
+        self.heartbeats = None
+        if heartbeat and heartbeat_list:
+            self.heartbeats = alertq.AlertDispatcher(heartbeat_list)
+        self.report_filter = rptfilt.OnChange(max_silence=heartbeat)
+        self.store = store  # tsstore.TimeSeriesStore for the door history, 1.0 when open
+        self.reader = reader or wr31io.digital_reader()
+        self.debounce = debounce
+        self.min_interval = self.reader.min_interval
+        self.max_interval = self.reader.max_interval
+        self.interval = self.min_interval
+        self.candidate = None
+        self.candidate_since = 0.0
+        self.last_steady = None
+        self.polls = 0
+        self.changes = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.douts = None
+        self.douts_read = 0.0
+
+    def switch_status(self):
         """
-        Reads line status and sends an alert if the status is different
+        Reads line status
         :return status: str, Door status, "OPEN" or "CLOSED"
         """
-        response = cli_command("gpio dio")
-        if "D1: DOUT=OFF, DIN=LOW" in response:
-            if not "D0: DOUT=ON" in response:
+        if self.reader.name == 'cli':
+            response = self.reader.read_dio()
+            if "D1: DOUT=OFF, DIN=LOW" in response and "D0: DOUT=ON" not in response:
                 # Door is closed
-                status = "CLOSED"
-        else:
+                return "CLOSED"
             # Door is open
-            status = "OPEN"
+            return "OPEN"
+        # digihw only reads inputs, so the outputs the CLI path checks are
+        # read through the CLI every DOUT_REFRESH seconds
+        now = time.time()
+        if self.douts is None or now - self.douts_read >= DOUT_REFRESH:
+            self.douts = self.reader.read_douts()
+            self.douts_read = now
+        if self.douts['D1'] or self.douts['D0'] or self.reader.read_din('D1'):
+            return "OPEN"
+        return "CLOSED"
+
+    def poll(self):
+        """
+        Reads line status once and sends an alert if the status has changed
+        and held for the debounce time
+        :return status: str, New door status, or None if unchanged
+        """
+        status = self.switch_status()
+        now = time.time()
+        self.polls += 1
+        if status == self.d1_status:
+            self.candidate = None
+            self.last_steady = now
+            self.interval = min(self.interval * 2, self.max_interval)
+            if self.report_filter.offer(status, now) and self.heartbeats is not None:
+                self.heartbeats.dispatch(status)
+            return None
+        if status != self.candidate:
+            self.candidate = status
+            self.candidate_since = now
+        self.interval = self.min_interval
+        if self.d1_status and now - self.candidate_since < self.debounce:
+            return None
+        if self.last_steady is not None:
+            # The change happened after the last poll that saw the old
+            # status, so this is an upper bound of the detection latency
+            latency = now - self.last_steady
+            self.changes += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+        self.d1_status = status
+        self.candidate = None
+        self.last_steady = now
+        print "WR31 door is: {0}".format(status)
+        if self.store is not None:
+            self.store.append(status == "OPEN" and 1.0 or 0.0, now)
+        self.report_filter.offer(status, now)
+        self.send_alert(status)
         return status
 
+    def stats(self):
+        """
+        :return stats: dict, Poll count, read path and detection latency
+        """
+        mean = 0.0
+        if self.changes:
+            mean = self.latency_total / self.changes
+        return {
+            'reader': self.reader.name,
+            'polls': self.polls,
+            'changes': self.changes,
+            'latency_mean': mean,
+            'latency_max': self.latency_max,
+            'interval': self.interval,
+            'alerts': self.dispatcher.stats(),
+            'heartbeats': self.report_filter.heartbeats,
+        }
+
     def send_alert(self, text):
         """
+        Queue an alert, without waiting for it to be sent
         :param text: str, Alert content
         :return:
         """
-        for alert in self.alert_list:
-            alert.send_alert(text)
+        self.dispatcher.dispatch(text, key="door")
 
     def monitor_switch(self):
         """
@@ -119,12 +206,8 @@ class DoorMonitor(object):
         :return:
         """
         while True:
-            status = self.switch_status()
-            if status != self.d1_status:
-                print "WR31 door is: {0}".format(status)
-                self.send_alert(status)
-                self.d1_status = status
-            time.sleep(.5)
+            self.poll()
+            time.sleep(self.interval)
 
 
 if __name__ == '__main__':
@@ -135,5 +218,7 @@ if __name__ == '__main__':
         CUSTOM_TEXT = "WR31 Door"
     if len(sys.argv) >= 2:
         ALERT_FUNCTIONS.append(SmsAlert(sys.argv[1], CUSTOM_TEXT))
-    MONITOR = DoorMonitor(ALERT_FUNCTIONS)
+    tsstore.register_requests()
+    MONITOR = DoorMonitor(ALERT_FUNCTIONS, store=tsstore.get_store('d1'))
+    print "Reading door switch through {0}".format(MONITOR.reader.name)
     MONITOR.monitor_switch()
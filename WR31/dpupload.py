@@ -0,0 +1,284 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Batched, store-and-forward DataPoint uploads to Remote Manager.
+
+DataPoints from any number of streams are collected and sent as one <list>
+document once MAX_POINTS are queued or the oldest is MAX_AGE seconds old.
+A batch that can not be sent is written to a spool file on flash, up to
+SPOOL_MAX files, and spooled batches are replayed, oldest first, before the
+next batch is sent. The queue is not locked while a batch is sent, and with
+send_on_add off add() only queues, leaving the sending to poll() on a
+thread of its own.
+
+Usage:
+    import dpupload
+    uploader = dpupload.get_uploader()
+    uploader.add('wr31vin', 12.034, data_type='float', units='V')
+    uploader.poll()  # call regularly, sends the batch when it is due
+"""
+
+import os
+import threading
+import time
+
+import idigidata
+
+try:
+    import instr
+except ImportError:
+    # Call statistics are optional, upload instr.py to have them
+    instr = None
+
+PATH = 'DataPoint/upload.xml'
+MAX_POINTS = 50  # Send when this many DataPoints are queued
+MAX_AGE = 60  # seconds, send when the oldest queued DataPoint is this old
+SPOOL_DIR = ''  # Directory for unsent batches, '' for the current directory
+SPOOL_PREFIX = 'dps'
+SPOOL_SUFFIX = '.xml'
+SPOOL_MAX = 20  # Spool files kept, the oldest is dropped when full
+RETRY_INTERVAL = 30  # seconds between replay attempts while the uplink is down
+
+
+def millisecond_timestamp():
+    """
+    Return a timestamp, in milliseconds
+    :return ms_timestamp: int, Timestamp in milliseconds
+    """
+    return int(time.time() * 1000)
+
+
+def escape(text):
+    return str(text).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def datapoint_xml(stream, data, data_type=None, units=None, description=None, timestamp=None):
+    """
+    Build one <DataPoint> element
+    :param stream: str, Data stream ID
+    :param data: DataPoint value
+    :param timestamp: int, Milliseconds since the epoch, defaults to now
+    :return xml: str
+    """
+    if timestamp is None:
+        timestamp = millisecond_timestamp()
+    xml = ['<DataPoint>', '<data>{0}</data>'.format(escape(data))]
+    if data_type:
+        xml.append('<dataType>{0}</dataType>'.format(data_type))
+    if units:
+        xml.append('<units>{0}</units>'.format(escape(units)))
+    if description:
+        xml.append('<description>{0}</description>'.format(escape(description)))
+    xml.append('<timestamp>{0}</timestamp>'.format(timestamp))
+    xml.append('<streamId>{0}</streamId>'.format(escape(stream)))
+    xml.append('</DataPoint>')
+    return ''.join(xml)
+
+
+class DataPointUploader(object):
+    """
+    Collects DataPoints into batches and uploads or spools them
+    """
+    def __init__(self, path=PATH, max_points=MAX_POINTS, max_age=MAX_AGE,
+                 spool_dir=SPOOL_DIR, spool_max=SPOOL_MAX, send_on_add=True):
+        """
+        :param send_on_add: bool, False when a thread of its own calls
+            poll(), so add() never sends on the caller's thread
+        """
+        self.path = path
+        self.max_points = max_points
+        self.send_on_add = send_on_add
+        self.max_age = max_age
+        self.spool_dir = spool_dir
+        self.spool_max = spool_max
+        self.points = []
+        self.oldest = None
+        self.next_replay = 0.0
+        self.lock = threading.RLock()  # guards the queued DataPoints
+        self.send_lock = threading.Lock()  # one sender at a time, held while sending
+        self.counters = {
+            'points': 0,
+            'batches': 0,
+            'bytes_sent': 0,
+            'failures': 0,
+            'spooled': 0,
+            'replayed': 0,
+            'dropped': 0,
+            'last_batch_size': 0,
+        }
+        files = self.spool_files()
+        self.spool_seq = files and int(os.path.basename(files[-1])[len(SPOOL_PREFIX):-len(SPOOL_SUFFIX)]) or 0
+
+    def add(self, stream, data, data_type=None, units=None, description=None, timestamp=None, send=True):
+        """
+        Queue a DataPoint, sending the batch if it is full and send_on_add
+        is set
+        :param send: bool, False to only queue it, e.g. from a device
+            request callback, where an upload waits for the request to end
+        """
+        point = datapoint_xml(stream, data, data_type, units, description, timestamp)
+        self.lock.acquire()
+        try:
+            if not self.points:
+                self.oldest = time.time()
+            self.points.append(point)
+            self.counters['points'] += 1
+            full = len(self.points) >= self.max_points
+        finally:
+            self.lock.release()
+        if full and send and self.send_on_add:
+            self.flush()
+
+    def due(self):
+        return bool(self.points) and time.time() - self.oldest >= self.max_age
+
+    def poll(self):
+        """
+        Send the batch if its oldest DataPoint has reached MAX_AGE, and retry
+        spooled batches while the uplink is down
+        """
+        self.lock.acquire()
+        try:
+            due = self.due() or len(self.points) >= self.max_points
+        finally:
+            self.lock.release()
+        if due:
+            self.flush()
+        elif time.time() >= self.next_replay and self.spool_depth():
+            self.send_lock.acquire()
+            try:
+                self.replay()
+            finally:
+                self.send_lock.release()
+
+    def take(self):
+        """
+        :return batch: str, The queued DataPoints as one document, None if
+            there are none, leaving the queue empty
+        """
+        self.lock.acquire()
+        try:
+            if not self.points:
+                return None
+            batch = '<list>' + ''.join(self.points) + '</list>'
+            self.counters['last_batch_size'] = len(self.points)
+            self.points = []
+            self.oldest = None
+            return batch
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        """
+        Send the queued DataPoints now, after any spooled batches. The
+        queue is not locked while sending, so add() does not wait for it.
+        :return: bool, True if the batch was sent, False if it was spooled
+        """
+        batch = self.take()
+        self.send_lock.acquire()
+        try:
+            if batch is None:
+                return self.replay()
+            if self.replay() and self.send(batch):
+                return True
+            self.spool(batch)
+            return False
+        finally:
+            self.send_lock.release()
+
+    def send(self, batch):
+        start = time.time()
+        try:
+            response = idigidata.send_to_idigi(batch, self.path)
+            sent = bool(response and response[0])
+        except Exception:
+            sent = False
+        if instr is not None:
+            instr.record('send_to_idigi', time.time() - start, not sent, self.path)
+        if sent:
+            self.counters['batches'] += 1
+            self.counters['bytes_sent'] += len(batch)
+        else:
+            self.counters['failures'] += 1
+            self.next_replay = time.time() + RETRY_INTERVAL
+        return sent
+
+    def spool_files(self):
+        directory = self.spool_dir or '.'
+        names = [name for name in os.listdir(directory)
+                 if name.startswith(SPOOL_PREFIX) and name.endswith(SPOOL_SUFFIX)]
+        names.sort()
+        return [os.path.join(self.spool_dir, name) for name in names]
+
+    def spool_depth(self):
+        return len(self.spool_files())
+
+    def spool(self, batch):
+        files = self.spool_files()
+        while files and len(files) >= self.spool_max:
+            os.remove(files.pop(0))
+            self.counters['dropped'] += 1
+        self.spool_seq += 1
+        # 8.3 file names for the TransPort file system
+        name = os.path.join(self.spool_dir, '{0}{1:05d}{2}'.format(SPOOL_PREFIX, self.spool_seq % 100000,
+                                                                 SPOOL_SUFFIX))
+        spool_file = open(name, 'w')
+        try:
+            spool_file.write(batch)
+        finally:
+            spool_file.close()
+        self.counters['spooled'] += 1
+
+    def replay(self):
+        """
+        Send spooled batches, oldest first, stopping at the first failure
+        :return: bool, True if the spool is empty
+        """
+        for name in self.spool_files():
+            spool_file = open(name, 'r')
+            try:
+                batch = spool_file.read()
+            finally:
+                spool_file.close()
+            if not self.send(batch):
+                return False
+            os.remove(name)
+            self.counters['replayed'] += 1
+        return True
+
+    def stats(self):
+        """
+        :return stats: dict, Upload counters, queued DataPoints and spool depth
+        """
+        self.lock.acquire()
+        try:
+            stats = dict(self.counters)
+            stats['queued'] = len(self.points)
+            stats['spool_depth'] = self.spool_depth()
+            return stats
+        finally:
+            self.lock.release()
+
+
+_uploader = None
+_uploader_lock = threading.Lock()
+
+
+def get_uploader():
+    """
+    Return the shared uploader, creating it on first use
+    :return uploader: DataPointUploader
+    """
+    global _uploader
+    if _uploader is None:
+        _uploader_lock.acquire()
+        try:
+            if _uploader is None:
+                _uploader = DataPointUploader()
+        finally:
+            _uploader_lock.release()
+    return _uploader
@@ -5,8 +5,9 @@
 # Copyright (c) 2016 Digi International Inc. All Rights Reserved.
 
 import sys
-import sarcli
-from time import sleep
+import clisess
+import ticker
+import wr31io
 
 
 # Number of display loops
@@ -23,30 +24,12 @@ DIGITAL_CHANNELS = ['D0', 'D1']
 DIGITAL_IO_OPTIONS = ['on', 'off']
 ANALOG_CHANNEL = 'voltage'
 
+# Reads the analog input through digihw when available, otherwise the CLI
+analog = wr31io.analog_reader()
+
 
 def cli(command="gpio"):
-    clidata = ""
-    cli = sarcli.open()
-    cli.write(command)
-    while True:
-        tmpdata = cli.read(-1)
-        if not tmpdata:
-            break
-        clidata += tmpdata
-    cli.close()
-    return clidata
-
-
-def parse_gpio_response(response_str):
-    lines = response_str.strip().splitlines()
-    lines.remove('OK')
-    i = 0
-    for line in lines:
-        newline = line.split(": ")
-        del lines[i]
-        lines.insert(i, newline)
-        i += 1
-    return lines
+    return clisess.execute(command)
 
 
 # Validate the requested analong control is a valid analong control for
@@ -76,7 +59,7 @@ def get_digital_io():
     # OK
     print "Get All Digital Channels"
     command = "gpio dio"
-    return parse_gpio_response(cli(command))
+    return wr31io.parse_gpio_response(cli(command))
 
 
 # Turn the requested digital channel on or off
@@ -96,8 +79,9 @@ def get_analog_io(io_type):
     out = ''
     if check_analog_control(io_type):
         print "Get Analog: " + str(io_type)
-        command = "gpio ain " + io_type
-        out = parse_gpio_response(cli(command))
+        # Runs "gpio ain <io_type>" only when the type changes
+        analog.set_mode(io_type)
+        out = [analog.read_record()]
     return out
 
 
@@ -119,10 +103,10 @@ def reset_analog_calibration():
     return cli(command)
 
 
-def string_to_cli_out(lines):
-    if len(lines):
-        for line in lines:
-            print line
+def string_to_cli_out(records):
+    if len(records):
+        for record in records:
+            print wr31io.format_record(record)
     else:
         print ''
 
@@ -151,6 +135,7 @@ Args (optional):
     print "Number of loops: " + str(LOOPS)
     print "Wait time (secs): " + str(WAIT)
 
+    timer = ticker.Ticker(WAIT)
     for loop in range(LOOPS):
         print "======================"
         print "Loop: " + str(loop)
@@ -158,6 +143,6 @@ Args (optional):
         string_to_cli_out(get_analog_io(ANALOG_CHANNEL))
         print "----------------------"
         string_to_cli_out(get_digital_io())
-        sleep(WAIT)
+        timer.wait()
 
     sys.exit(0)
@@ -25,35 +25,121 @@
 USAGE = """
 Usage:
 Launch application using format
-    python get_gps.py {time interval in seconds (must be an integer)}
-    python get_gps.py 300
-Above example launches and sets a 5-minute (300-second) collection and upload interval
+    python gps2drm.py {upload interval in seconds (must be an integer)}
+    python gps2drm.py 300
+Above example launches and sets a 5-minute (300-second) upload interval
 If no interval is specified, the script will automatically use a 180-second upload interval
+The GPS is read every SAMPLE_INTERVAL seconds. A position is kept when the vehicle has moved
+GPS_DEADBAND meters and turned HEADING_CHANGE degrees, or gone MAX_STRAIGHT meters, since the
+last one kept, and the positions kept are uploaded once per upload interval as a GeoJSON
+LineString DataPoint. While stationary nothing is uploaded, apart from a position every
+GPS_MAX_SILENCE seconds. A 'reportgps' device request is answered with the last fix, as JSON.
 """
 # ============================================================================================
 
+import cbpool
 import idigidata
+import json
+import math
+import rptfilt
 import time
-import thread
-import sarcli
+import threading
+import clisess
+import dpupload
 import sys
+import ticker
 
+SAMPLE_INTERVAL = 10  # seconds between GPS reads
+FLUSH_INTERVAL = 180  # seconds between track uploads
+GPS_DEADBAND = 25  # meters moved before a position is kept
+HEADING_CHANGE = 20  # degrees turned before a position is kept
+MAX_STRAIGHT = 1000  # meters, a position is kept after this distance without a turn
+GPS_MAX_SILENCE = 3600  # seconds
+MAX_TRACK_POINTS = 200  # Positions in one track DataPoint
+TRACK_STREAM = 'geotrack'
+EARTH_RADIUS = 6371000  # meters
+GPS_PREFIX = 'gps.0.stats.'
+MIN_SATELLITES = 3  # Fewer satellites in view than this is not a fix
 
-def cli_parse(strData, strName, gps=False):
+
+class GpsError(Exception):
+    """
+    Raised when the GPS statistics do not hold a valid fix
+    """
+    pass
+
+
+def parse_gps_mibs(at_mibs_gps, prefix=GPS_PREFIX):
+    """
+    Collect every 'gps.0.stats.<field> = <value>' line in one pass
+    :param at_mibs_gps: str, Response to 'at\\mibs=gps'
+    :return stats: dict, Field name to value str
+    """
+    stats = {}
+    skip = len(prefix)
+    start = at_mibs_gps.find(prefix)
+    if start < 0:
+        return stats
+    for line in at_mibs_gps[start:].splitlines():
+        if line.startswith(prefix):
+            name, equals, value = line[skip:].partition('=')
+            if equals:
+                stats[name.strip()] = value.strip()
+    return stats
+
+
+def signed_degrees(value):
+    """
+    Convert '44.9123 N' or '93.2012W' to signed decimal degrees, negative
+    for south and west
+    :param value: str, Degrees with an optional hemisphere letter
+    :return degrees: float
+    """
+    value = value.strip()
+    hemisphere = value[-1:].upper()
+    if hemisphere in ('N', 'S', 'E', 'W'):
+        value = value[:-1]
+    degrees = float(value)
+    if hemisphere in ('S', 'W'):
+        degrees = -abs(degrees)
+    return degrees
+
+
+def optional_number(stats, field, convert=float):
     try:
-        pos1 = strData.find(strName)
-        pos2 = strData.find('\n', pos1)
-        if (gps):
-            pos3 = strData.find('=', pos1)
-        else:
-            pos3 = strData.find(':', pos1)
-        if pos2 > pos1 and pos2 > 0 and pos2 > pos3 and pos3 > 0:
-            name = strData[pos3 + 2:pos2 - 1]
-        else:
-            name = ""
-        return name
-    except Exception, ex:
-        return ""
+        return convert(stats[field])
+    except (KeyError, ValueError):
+        return None
+
+
+def gps_fix(at_mibs_gps):
+    """
+    Parse and validate the GPS statistics
+    :param at_mibs_gps: str, Response to 'at\\mibs=gps'
+    :return fix: dict, latitude and longitude in signed degrees, and
+        satellites, altitude, course, speedknots (None when not reported)
+        and utctime
+    """
+    stats = parse_gps_mibs(at_mibs_gps)
+    try:
+        lat = signed_degrees(stats['latitude'])
+        lon = signed_degrees(stats['longitude'])
+    except (KeyError, ValueError):
+        raise GpsError('no position in GPS statistics')
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0) or (lat == 0.0 and lon == 0.0):
+        raise GpsError('invalid position {0}, {1}'.format(lat, lon))
+    satellites = optional_number(stats, 'satellites', int)
+    if satellites is not None and satellites < MIN_SATELLITES:
+        raise GpsError('{0} satellites in view'.format(satellites))
+    return {
+        'latitude': lat,
+        'longitude': lon,
+        'satellites': satellites,
+        'altitude': optional_number(stats, 'altitude'),
+        'course': optional_number(stats, 'course'),
+        'speedknots': optional_number(stats, 'speedknots'),
+        'utctime': stats.get('utctime'),
+    }
 
 
 def cli_command(cmd):
@@ -62,48 +148,206 @@ def cli_command(cmd):
     :param cmd: str, Command to run
     :return response: str, Response to cmd
     """
-    cli = sarcli.open()
-    cli.write(cmd)
-    response = cli.read()
-    cli.close()
-    return response
+    return clisess.execute(cmd)
+
+
+def distance_m(a, b):
+    """
+    Great-circle distance between two [lat, lon] positions, in meters
+    """
+    lat1, lon1, lat2, lon2 = [math.radians(x) for x in (a[0], a[1], b[0], b[1])]
+    h = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def bearing_deg(a, b):
+    """
+    Initial bearing from [lat, lon] a to b, in degrees from north
+    """
+    lat1, lon1, lat2, lon2 = [math.radians(x) for x in (a[0], a[1], b[0], b[1])]
+    y = math.sin(lon2 - lon1) * math.cos(lat2)
+    x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(lon2 - lon1)
+    return math.degrees(math.atan2(y, x)) % 360.0
 
 
-def get_gps_lat_long(at_mibs_gps):
-    stats_dict = {}
-    stats_dict["gps_longitude"] = cli_parse(at_mibs_gps, "gps.0.stats.longitude", True)
-    stats_dict["gps_latitude"] = cli_parse(at_mibs_gps, "gps.0.stats.latitude", True)
-    # stats_dict["gps_satellites"] = cli_parse(answer, "gps.0.stats.satellites", True)
-    # stats_dict["gps_course"] = cli_parse(answer, "gps.0.stats.course", True)
-    # stats_dict["gps_utctime"] = cli_parse(answer, "gps.0.stats.utctime", True)
-    # stats_dict["gps_altitude"] = cli_parse(answer, "gps.0.stats.altitude", True)
-    # speedknots = float(cli_parse(answer, "gps.0.stats.speedknots", True))
-    lat = float(stats_dict["gps_latitude"].strip(' NSEW'))
-    lon = float(stats_dict["gps_longitude"].strip(' NSEW'))
-    return [lat, lon]
+def heading_change(a, b):
+    change = abs(a - b) % 360.0
+    return min(change, 360.0 - change)
+
+
+class MotionFilter(rptfilt.Deadband):
+    """
+    Deadband on the meters moved, that also drops a position on the same
+    heading as the last one kept, unless it is straight meters away
+    """
+    def __init__(self, distance, heading, straight, max_silence=None):
+        rptfilt.Deadband.__init__(self, distance, max_silence, distance=distance_m)
+        self.heading = heading
+        self.straight = straight
+        self.last_bearing = None
+
+    def check(self, value, when):
+        if self.last_report is None:
+            return [(when, value)]
+        moved = self.distance(self.last_report[1], value)
+        if moved < self.threshold:
+            return []
+        bearing = bearing_deg(self.last_report[1], value)
+        if (self.last_bearing is not None and moved < self.straight and
+                heading_change(self.last_bearing, bearing) < self.heading):
+            return []
+        self.last_bearing = bearing
+        return [(when, value)]
+
+
+class GpsReporter(object):
+    """
+    Samples the GPS often, keeps the positions where the vehicle moved
+    GPS_DEADBAND meters and turned HEADING_CHANGE degrees (or went
+    MAX_STRAIGHT meters), and uploads them as one GeoJSON LineString per
+    flush interval. Nothing is kept while stationary, apart from a
+    heartbeat position after GPS_MAX_SILENCE seconds.
+    """
+    def __init__(self, flush_interval=FLUSH_INTERVAL, distance=GPS_DEADBAND, heading=HEADING_CHANGE,
+                 straight=MAX_STRAIGHT, max_silence=GPS_MAX_SILENCE, uploader=None):
+        self.flush_interval = flush_interval
+        self.filter = MotionFilter(distance, heading, straight, max_silence)
+        self.uploader = uploader or dpupload.get_uploader()
+        self.lock = threading.Lock()
+        self.latest = None  # (time, fix) of the last valid fix
+        self.track = []  # (time, [lat, lon])
+        self.track_start = None
+        self.requested = False
+        self.counters = {
+            'samples': 0,
+            'no_fix': 0,
+            'kept': 0,
+            'tracks': 0,
+            'requests': 0,
+        }
+
+    def sample(self, now=None):
+        """
+        Read the GPS and keep the position if the vehicle has moved
+        :return fix: dict, or None without a fix
+        """
+        if now is None:
+            now = time.time()
+        self.counters['samples'] += 1
+        try:
+            fix = gps_fix(cli_command("at\\mibs=gps"))
+        except (GpsError, clisess.CliError) as err:
+            self.counters['no_fix'] += 1
+            print('No GPS fix: {0}'.format(err))
+            return None
+        self.lock.acquire()
+        try:
+            self.latest = (now, fix)
+            self.consider(now, [fix['latitude'], fix['longitude']])
+        finally:
+            self.lock.release()
+        return fix
+
+    def consider(self, now, position):
+        if not self.filter.offer(position, now):
+            return False
+        if not self.track:
+            self.track_start = now
+        self.track.append((now, position))
+        self.counters['kept'] += 1
+        return True
+
+    def due(self, now=None):
+        if now is None:
+            now = time.time()
+        return bool(self.track) and (self.requested or now - self.track_start >= self.flush_interval
+                                     or len(self.track) >= MAX_TRACK_POINTS)
+
+    def flush(self, send=True):
+        """
+        Queue the track as a GeoJSON DataPoint
+        :param send: bool, True to send it now, False to leave it to the
+            uploader's own schedule
+        """
+        self.lock.acquire()
+        try:
+            track = self.track
+            self.track = []
+            self.requested = False
+        finally:
+            self.lock.release()
+        if not track:
+            return
+        # GeoJSON positions are [longitude, latitude]
+        coordinates = [[round(lon, 6), round(lat, 6)] for when, (lat, lon) in track]
+        if len(coordinates) > 1:
+            geometry = {'type': 'LineString', 'coordinates': coordinates}
+        else:
+            geometry = {'type': 'Point', 'coordinates': coordinates[0]}
+        feature = {
+            'type': 'Feature',
+            'geometry': geometry,
+            'properties': {'times': [int(when * 1000) for when, position in track]},
+        }
+        self.counters['tracks'] += 1
+        self.uploader.add(TRACK_STREAM, json.dumps(feature, separators=(',', ':')), data_type='GEOJSON',
+                          timestamp=int(track[0][0] * 1000))
+        if send:
+            self.uploader.flush()
+
+    def request(self):
+        """
+        Answer a 'reportgps' request from the cached fix, and have the
+        current track uploaded by the sampling loop
+        :return response: str, JSON fix, or '' without one
+        """
+        self.lock.acquire()
+        try:
+            self.counters['requests'] += 1
+            self.requested = True
+            if self.latest is None:
+                return ''
+            when, fix = self.latest
+            if not self.track or self.track[-1][0] != when:
+                # Report where the vehicle is now, even if it has not moved
+                self.track.append((when, [fix['latitude'], fix['longitude']]))
+                if len(self.track) == 1:
+                    self.track_start = when
+            response = dict(fix)
+            response['age'] = round(time.time() - when, 1)
+            return json.dumps(response)
+        finally:
+            self.lock.release()
+
+    def run(self, sample_interval=SAMPLE_INTERVAL):
+        # Sample on a fixed timeline, so a slow CLI read or upload does not
+        # stretch the track
+        timer = ticker.Ticker(sample_interval)
+        while True:
+            self.sample()
+            if self.due():
+                self.flush()
+            timer.wait()
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['track'] = len(self.track)
+        return stats
+
+
+reporter = GpsReporter()
 
 
 def report(target, data):
     # ignore target and data for this example, but data is the content of the request
     # and can be parse at this point
-    # push up geolocation in a separate thread, since the DataPoint upload gets blocked
-    # by the in-progress device_request if you try to do it in the same thread
-    thread.start_new_thread(send_up_data, ())
+    # Answer from the last fix, the sampling loop uploads the track, since the
+    # DataPoint upload gets blocked by the in-progress device_request if you
+    # try to do it in the same thread
     # return the contents to be returned in the device request. This will show up
-    # as the XML response in SCI. Not needed here so just returning and empty string ''
-    return ''
-
-
-def send_up_data():
-    # Replace 'geolocation' with the data stream you want to upload to
-    path = '/DataPoint/geolocation.xml'
-    # report current location in geojson. Replace the literals ('-100.3046875', etc) with
-    # your lat long and you're good to go
-    xml = '''<DataPoint>
-      <data>{0}</data>
-      <streamId>geolocation</streamId>
-    </DataPoint>'''.format(get_gps_lat_long(cli_command("at\mibs=gps")))
-    idigidata.send_to_idigi(xml, path)
+    # as the XML response in SCI.
+    return reporter.request()
 
 
 def help(excpt):
@@ -115,20 +359,18 @@ if __name__ == "__main__":
         args = sys.argv
         print(args)
         if len(args) > 1:
-            sleep_time = int(args[1])
-        else:
-            sleep_time = 180
+            reporter.flush_interval = int(args[1])
         try:
-            ret = idigidata.register_callback("reportgps", report)
+            # Requests run on the shared callback pool, so a burst of them
+            # can not start a thread each
+            ret = cbpool.register_callback("reportgps", report)
         except Exception as err:
             print('Error registering callback:')
             print(err)
             print('reboot device to fix register callback')
             print('application will now continue without the callback active')
         # now spin forever so the callback stays active
-        while True:
-            send_up_data()
-            time.sleep(sleep_time)
+        reporter.run()
     except Exception as e:
         print('EXCEPTION:')
         print(e)
@@ -6,12 +6,35 @@
 
 """
 The purpose of this application is to show the maximum poll rate that can be
-achieved on the IO ports, using the CLI commands.
+achieved on the IO ports, for each way of reading them:
+
+  percall   open a CLI session, run 'gpio dio', close it, for every sample
+  session   run 'gpio dio' on a persistent clisess session
+  digihw    read the inputs in-process through digihw, when available
+
+Each path is warmed up, then sampled for a fixed time. Per-call latency
+percentiles (p50/p95/p99), samples per second and jitter (the standard
+deviation of the time between samples) are printed, and can be written as
+JSON for comparing runs.
+
+With -W, samples start on a ticker.Ticker every WAIT milliseconds, so the
+target rate is held regardless of the read latency. The achieved rate, the
+ticks missed and a histogram of how late each sample started are recorded
+next to the target, so a rate is measured rather than assumed.
+
+Off-device, run it against the simulated modules in sim/, with the latency
+set by SIM_SARCLI_OPEN_MS, SIM_SARCLI_CMD_MS and SIM_DIGIHW_MS:
+    > SIM_SARCLI_OPEN_MS=20 SIM_SARCLI_CMD_MS=5 PYTHONPATH=sim python hi_poll.py -T5 -Jresults.json
 """
 
+import clisess
+import json
+import math
 import sarcli
 import time
 import sys
+import ticker
+import wr31io
 
 
 CMD_DIO = 'gpio dio'
@@ -19,13 +42,20 @@ CMD_AIN = 'gpio ain'
 ANALOG_CHANNEL_CONTROLS = ['current', 'voltage']
 DIGITAL_CHANNELS = ['D0', 'D1']
 DIGITAL_IO_OPTIONS = ['on', 'off']
+READ_PATHS = ['percall', 'session', 'digihw']
 
 VOLTAGE_DECIMAL = 3  # Change to desired voltage decimal accuracy
 ANALOG_CHANNEL = 'voltage'
-LOOPS = 10
-WAIT = 200  # sleep in milliseconds (ms)
+DURATION = 10.0  # seconds sampled per read path
+WARMUP = 1.0  # seconds of samples discarded before timing each path
+LOOPS = 0  # Maximum samples per read path, 0 for no limit
+WAIT = 0  # period in milliseconds (ms) between sample starts, 0 for the maximum rate
+PERCENTILES = [50, 95, 99]
+JSON_FILE = None  # File for the JSON results, '-' for stdout and the rest on stderr
 DEBUG = False
 
+analog = wr31io.analog_reader()
+
 
 def display_help():
     print """
@@ -33,31 +63,47 @@ Usage: python {0}
 Args (optional):
 -[H|?] prints help, then exits
 -A[voltage|current] # sets analog reading by voltage or current
--L<number of loops>
--W<wait milliseconds between loops>
---Ex. > python {0} -Avoltage -L100 -W250
-""".format(sys.args[0])
+-P<read paths>  # comma separated, from {1}
+-T<seconds sampled per read path>
+-U<warm-up seconds per read path>
+-L<maximum samples per read path, 0 for no limit>
+-W<milliseconds between sample starts, 0 for the maximum rate>
+-J<JSON results file, - for stdout, with the other output on stderr>
+--Ex. > python {0} -Psession,digihw -T30 -Jpoll.json
+""".format(sys.argv[0], ','.join(READ_PATHS))
 
 
 def cli(command="gpio"):
-    clidata = ''
-    cli = sarcli.open()
     if DEBUG:
         print 'CLI> {0}'.format(command)
-    cli.write(command)
-    while True:
-        tmpdata = cli.read(-1)
-        if not tmpdata:
-            break
-        clidata += tmpdata
-    cli.close()
-    return clidata
+    return clisess.execute(command)
+
 
+def cli_per_call(command):
+    """
+    Run a command on a session of its own, the way the examples did before
+    clisess
+    """
+    if DEBUG:
+        print 'CLI> {0}'.format(command)
+    session = sarcli.open()
+    try:
+        session.write(command)
+        response = ''
+        while True:
+            chunk = session.read(-1)
+            if not chunk:
+                break
+            response += chunk
+        return response
+    finally:
+        session.close()
 
-def string_to_cli_out(lines):
-    if len(lines):
-        for line in lines:
-            print line
+
+def string_to_cli_out(records):
+    if len(records):
+        for record in records:
+            print wr31io.format_record(record)
     else:
         print ''
 
@@ -85,18 +131,6 @@ def check_digital_channel(channel):
     return True
 
 
-def parse_gpio_response(response_str):
-    lines = response_str.strip().splitlines()
-    lines.remove('OK')
-    i = 0
-    for line in lines:
-        newline = line.split(": ")
-        del lines[i]
-        lines.insert(i, newline)
-        i += 1
-    return lines
-
-
 def get_digital_io():
     """
     Get Digital Channel Response
@@ -105,13 +139,12 @@ def get_digital_io():
     D1: DOUT=OFF, DIN=HIGH (Inactive)
     OK
     """
-    return parse_gpio_response(cli(CMD_DIO))
+    return wr31io.parse_gpio_response(cli(CMD_DIO))
 
 
 def set_analog_io_type(io_type):
-    command = '{0} {1}'.format(CMD_AIN, io_type)
     if check_analog_control(io_type):
-        print parse_gpio_response(cli(command))
+        analog.set_mode(io_type)
         print 'Analog set to {0}'.format(io_type)
         return True
     return False
@@ -127,48 +160,223 @@ def get_analog_io(io_type):
     A0: voltage=0.0075 V
     OK
     """
-    return parse_gpio_response(cli(CMD_AIN))
+    if not check_analog_control(io_type):
+        return []
+    # Runs "gpio ain <io_type>" only when the type changes
+    analog.set_mode(io_type)
+    return [analog.read_record()]
+
+
+def sampler(path):
+    """
+    Return a function reading every digital input once through a read path
+    :param path: str, One of READ_PATHS
+    :return sample: callable returning a list of DIN levels, None if the
+        path is not available
+    """
+    if path == 'percall':
+        return lambda: [r.din for r in wr31io.parse_gpio_response(cli_per_call(CMD_DIO))]
+    if path == 'session':
+        return lambda: [r.din for r in get_digital_io()]
+    if path == 'digihw' and wr31io.has_digihw(wr31io.DIGIHW_DIN):
+        reader = wr31io.DigihwDigitalReader()
+        return lambda: [reader.read_din(channel) for channel in DIGITAL_CHANNELS]
+    return None
+
+
+def percentile(ordered, pct):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+    if not ordered:
+        return 0.0
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[max(0, min(rank, len(ordered)) - 1)]
+
+
+def stddev(values):
+    if len(values) < 2:
+        return 0.0
+    mean = sum(values) / len(values)
+    return math.sqrt(sum([(v - mean) ** 2 for v in values]) / (len(values) - 1))
+
+
+def run_path(sample, duration=DURATION, warmup=WARMUP, loops=LOOPS, wait=WAIT):
+    """
+    Warm up, then time samples for duration seconds
+    :param sample: callable, Takes one sample
+    :param wait: int, Milliseconds between sample starts, 0 for back to back
+    :return result: dict, Latencies in milliseconds, rate in samples/s
+    """
+    timer = wait and ticker.Ticker(wait / 1000.0)
+    warmup_errors = 0
+    end = time.time() + warmup
+    while time.time() < end:
+        try:
+            sample()
+        except (clisess.CliError, IOError):
+            # The per-call path raises sarcli's IOError
+            warmup_errors += 1
+        if timer:
+            timer.wait()
+
+    if timer:
+        # Time from a fresh timeline, without the warm-up ticks
+        timer = ticker.Ticker(timer.period)
+    latencies = []
+    starts = []
+    errors = 0
+    begin = time.time()
+    end = begin + duration
+    while True:
+        start = time.time()
+        if start >= end or (loops and len(latencies) >= loops):
+            break
+        try:
+            sample()
+        except (clisess.CliError, IOError):
+            errors += 1
+        starts.append(start)
+        latencies.append(time.time() - start)
+        if timer:
+            timer.wait()
+    elapsed = time.time() - begin
+
+    ordered = sorted(latencies)
+    intervals = [b - a for a, b in zip(starts, starts[1:])]
+    result = {
+        'samples': len(latencies),
+        'errors': errors,
+        'warmup_errors': warmup_errors,
+        'elapsed_s': round(elapsed, 3),
+        'samples_per_s': round(elapsed and len(latencies) / elapsed or 0.0, 1),
+        'mean_ms': round(latencies and 1000 * sum(latencies) / len(latencies) or 0.0, 3),
+        'max_ms': round(1000 * (ordered and ordered[-1] or 0.0), 3),
+        'jitter_ms': round(1000 * stddev(intervals), 3),
+    }
+    for pct in PERCENTILES:
+        result['p{0}_ms'.format(pct)] = round(1000 * percentile(ordered, pct), 3)
+    if timer:
+        stats = timer.stats()
+        result['target_per_s'] = round(1.0 / timer.period, 1)
+        result['missed'] = stats['missed']
+        result['late_mean_ms'] = round(1000 * stats['late_mean'], 3)
+        result['late_max_ms'] = round(1000 * stats['late_max'], 3)
+        result['lateness'] = stats['histogram']
+    return result
+
+
+def run_benchmark(paths, duration=DURATION, warmup=WARMUP, loops=LOOPS, wait=WAIT):
+    """
+    Benchmark each read path in turn
+    :param paths: list of str, Read paths to run
+    :return results: dict, Setup and a result per read path
+    """
+    results = {
+        'platform': sys.platform,
+        'time': int(time.time()),
+        'duration_s': duration,
+        'warmup_s': warmup,
+        'wait_ms': wait,
+        'target_per_s': wait and round(1000.0 / wait, 1) or None,
+        'monotonic': ticker.MONOTONIC,
+        'max_samples': loops,
+        'paths': {},
+    }
+    for path in paths:
+        sample = sampler(path)
+        if sample is None:
+            print '{0}: not available, skipped'.format(path)
+            continue
+        print '{0}: sampling for {1} s'.format(path, duration)
+        results['paths'][path] = run_path(sample, duration, warmup, loops, wait)
+    return results
+
+
+def print_results(results):
+    columns = ['samples_per_s'] + ['p{0}_ms'.format(pct) for pct in PERCENTILES] + \
+              ['max_ms', 'jitter_ms', 'errors']
+    print '{0:<8}'.format('path') + ''.join(['{0:>14}'.format(c) for c in columns])
+    for path in READ_PATHS:
+        result = results['paths'].get(path)
+        if result is not None:
+            print '{0:<8}'.format(path) + ''.join(['{0:>14}'.format(result[c]) for c in columns])
+    if results['target_per_s']:
+        print 'Target {0} samples/s, start lateness:'.format(results['target_per_s'])
+        for path in READ_PATHS:
+            result = results['paths'].get(path)
+            if result is not None:
+                print '{0:<8}missed {1}, mean {2} ms, max {3} ms'.format(
+                    path, result['missed'], result['late_mean_ms'], result['late_max_ms'])
+
+
+def write_json(results, filename):
+    if filename == '-':
+        # stdout itself, as the rest of the output goes to stderr with -J-
+        sys.__stdout__.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+        return
+    out = open(filename, 'w')
+    try:
+        json.dump(results, out, indent=2, sort_keys=True)
+    finally:
+        out.close()
+    print 'Results written to {0}'.format(filename)
 
 
 if __name__ == "__main__":
-    print ''
     args = sys.argv
+    paths = READ_PATHS
+    analog_type = None
     if len(args) > 1:
-        for arg in args:
+        for arg in args[1:]:
             if arg.upper().startswith('-H') or arg.startswith('-?'):
                 display_help()
                 sys.exit(0)
             elif arg.upper().startswith('-A'):
                 analog_type = arg[2:]
-                if check_analog_control(analog_type):
-                    set_analog_io_type(analog_type)
+            elif arg.upper().startswith('-P'):
+                paths = arg[2:].split(',')
+                for path in paths:
+                    if path not in READ_PATHS:
+                        print 'Invalid read path, {0}'.format(path)
+                        sys.exit(1)
+            elif arg.upper().startswith('-T'):
+                DURATION = float(arg[2:])
+            elif arg.upper().startswith('-U'):
+                WARMUP = float(arg[2:])
             elif arg.upper().startswith('-L'):
                 LOOPS = int(arg[2:])
-                if LOOPS > 10000:
-                    print 'Too many loops, {0}'.format(LOOPS)
-                    sys.exit(1)
             elif arg.upper().startswith('-W'):
                 WAIT = int(arg[2:])
-                if WAIT < 100:
-                    print 'Poll rate too fast, {0}'.format(WAIT)
-                    sys.exit(1)
+            elif arg.upper().startswith('-J'):
+                JSON_FILE = arg[2:]
             elif arg.upper().startswith('-D'):
                 DEBUG = True
 
+    if JSON_FILE == '-':
+        # Keep stdout for the JSON results alone
+        sys.stdout = sys.stderr
+    print ''
+    if analog_type is not None and set_analog_io_type(analog_type):
+        ANALOG_CHANNEL = analog_type
     print '======================'
     print 'Setup:'
-    print 'Number of loops: {0}'.format(LOOPS)
-    print 'Wait time (ms):  {0}'.format(WAIT)
-
-    for x in range(LOOPS):
-        print '======================'
-        print 'Loop: %d' % (x+1)
-        print '----------------------'
-        string_to_cli_out(get_analog_io(ANALOG_CHANNEL))
-        print '----------------------'
-        string_to_cli_out(get_digital_io())
-        time.sleep(WAIT/1000.0)
+    print 'Read paths:         {0}'.format(', '.join(paths))
+    print 'Duration (s):       {0}'.format(DURATION)
+    print 'Warm-up (s):        {0}'.format(WARMUP)
+    print 'Max samples:        {0}'.format(LOOPS or 'no limit')
+    print 'Sample period (ms): {0}'.format(WAIT or 'none')
+    print '----------------------'
+    string_to_cli_out(get_analog_io(ANALOG_CHANNEL))
+    string_to_cli_out(get_digital_io())
+    print '======================'
 
+    results = run_benchmark(paths, DURATION, WARMUP, LOOPS, WAIT)
+
+    print '======================'
+    print_results(results)
+    if JSON_FILE:
+        write_json(results, JSON_FILE)
     print '======================'
     print 'Polling Complete'
     sys.exit(0)
@@ -0,0 +1,318 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Call counts, latency histograms and error counts for the hot paths of the
+example applications: CLI commands, DataPoint uploads and SSH commands.
+
+Each call is recorded under a name, e.g. 'cli gpio dio', with its count,
+errors, total and maximum time, and a histogram over BUCKETS from which
+percentiles are estimated. A command's arguments are cut down by
+command_key() so a phone number or message does not make a name of its
+own, and past MAX_NAMES names further calls are counted as '<name> other'.
+
+Recording is off until enable() is called. While off, timed() functions
+and timer() blocks cost one flag test.
+
+The summary can be printed on SIGUSR1 (install_signal()) and uploaded
+every UPLOAD_INTERVAL seconds as a JSON DataPoint to STREAM
+(start_upload()), on the router.
+
+Usage:
+    import instr
+    instr.enable()
+
+    @instr.timed('drm page')
+    def fetch_page(conn, start):
+        ...
+
+    with instr.timer('cli', command):
+        response = session.execute(command)
+
+    print(instr.format_summary())
+"""
+
+import bisect
+import json
+import threading
+import time
+
+BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0]  # seconds, upper bounds
+MAX_NAMES = 64  # names recorded, later ones are counted under '<name> other'
+UPLOAD_INTERVAL = 3600  # seconds between summary DataPoints
+UPLOAD_TOP = 20  # names in a summary DataPoint, by total time
+STREAM = 'instr/summary'
+
+enabled = False
+_stats = {}
+_lock = threading.Lock()
+
+
+class CallStats(object):
+    """
+    Counts, errors and latency histogram of the calls under one name
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.histogram = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed, error=False):
+        self.count += 1
+        self.errors += error
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.histogram[bisect.bisect_left(self.buckets, elapsed)] += 1
+
+    def percentile(self, fraction):
+        """
+        :return seconds: float, Estimated by interpolating in the bucket
+            holding the fraction of calls
+        """
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            if count and seen + count >= rank:
+                lower = index and self.buckets[index - 1] or 0.0
+                upper = index < len(self.buckets) and self.buckets[index] or self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total': self.total,
+            'mean': self.count and self.total / self.count or 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+def command_key(command):
+    """
+    Cut a command down to its name, e.g. 'gpio ain voltage' to 'gpio ain',
+    'cloud 0 server my.devicecloud.com' to 'cloud server' and
+    'sendsms +15555555555 "Door"' to 'sendsms'
+    :param command: str, Command
+    :return key: str, The first word, and the next one after any instance
+        numbers if it has no digits or quotes
+    """
+    words = command.split()
+    if not words:
+        return ''
+    for word in words[1:]:
+        if word.isdigit():
+            continue
+        if not [c for c in word if c.isdigit() or c in '"\'']:
+            return words[0] + ' ' + word
+        break
+    return words[0]
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    _lock.acquire()
+    try:
+        _stats.clear()
+    finally:
+        _lock.release()
+
+
+def record(name, elapsed, error=False, command=None):
+    """
+    Record one call, when enabled
+    :param name: str, Call name
+    :param elapsed: float, seconds the call took
+    :param error: bool, True if it failed
+    :param command: str, Command run, its command_key() is added to name
+    """
+    if not enabled:
+        return
+    if command is not None:
+        name = name + ' ' + command_key(command)
+    _lock.acquire()
+    try:
+        stats = _stats.get(name)
+        if stats is None:
+            if len(_stats) >= MAX_NAMES:
+                name = name.split(' ', 1)[0] + ' other'
+                stats = _stats.get(name)
+            if stats is None:
+                stats = _stats[name] = CallStats()
+        stats.add(elapsed, error)
+    finally:
+        _lock.release()
+
+
+class Timer(object):
+    """
+    Context manager recording the time of its block, as an error if the
+    block raises
+    """
+    def __init__(self, name, command=None):
+        self.name = name
+        self.command = command
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.name, time.time() - self.start, exc_type is not None, self.command)
+        return False
+
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_timer = NullTimer()
+
+
+def timer(name, command=None):
+    """
+    :return timer: context manager timing its block under name, and
+        command_key(command) if given
+    """
+    if not enabled:
+        return _null_timer
+    return Timer(name, command)
+
+
+def timed(name, command_arg=None):
+    """
+    Decorator timing each call of a function under name
+    :param command_arg: int, Position of an argument holding a command,
+        whose command_key() is added to name
+    """
+    def decorate(func):
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            command = None
+            if command_arg is not None and len(args) > command_arg:
+                command = args[command_arg]
+            start = time.time()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                record(name, time.time() - start, True, command)
+                raise
+            record(name, time.time() - start, False, command)
+            return result
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorate
+
+
+def summary():
+    """
+    :return summary: dict, CallStats.summary() by name, times in seconds
+    """
+    _lock.acquire()
+    try:
+        return dict((name, stats.summary()) for name, stats in _stats.items())
+    finally:
+        _lock.release()
+
+
+def format_summary():
+    """
+    :return text: str, One line per name, by total time
+    """
+    lines = ['{0:<36}{1:>8}{2:>7}{3:>10}{4:>9}{5:>9}{6:>9}{7:>10}'.format(
+        'call', 'count', 'errors', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')]
+    items = sorted(summary().items(), key=lambda item: -item[1]['total'])
+    for name, stats in items:
+        lines.append('{0:<36}{1:>8}{2:>7}{3:>10.1f}{4:>9.1f}{5:>9.1f}{6:>9.1f}{7:>10.1f}'.format(
+            name[:35], stats['count'], stats['errors'], 1000 * stats['mean'], 1000 * stats['p50'],
+            1000 * stats['p90'], 1000 * stats['p99'], 1000 * stats['max']))
+    return '\n'.join(lines)
+
+
+def summary_json(top=UPLOAD_TOP):
+    """
+    :return text: str, JSON of the top names by total time, each
+        [count, errors, mean ms, p90 ms, max ms]
+    """
+    items = sorted(summary().items(), key=lambda item: -item[1]['total'])[:top]
+    compact = {}
+    for name, stats in items:
+        compact[name] = [stats['count'], stats['errors'], round(1000 * stats['mean'], 1),
+                         round(1000 * stats['p90'], 1), round(1000 * stats['max'], 1)]
+    return json.dumps(compact, separators=(',', ':'), sort_keys=True)
+
+
+def install_signal():
+    """
+    Print the summary on SIGUSR1, where Python has it. Call from the main
+    thread.
+    :return installed: bool
+    """
+    try:
+        import signal
+        signal.signal(signal.SIGUSR1, lambda signum, frame: print_summary())
+    except (ImportError, AttributeError, ValueError):
+        return False
+    return True
+
+
+def print_summary():
+    print(format_summary())
+
+
+def upload(uploader=None):
+    """
+    Queue the summary as a DataPoint to STREAM
+    """
+    if uploader is None:
+        import dpupload
+        uploader = dpupload.get_uploader()
+    uploader.add(STREAM, summary_json(), data_type='JSON')
+
+
+def start_upload(interval=UPLOAD_INTERVAL, uploader=None):
+    """
+    Upload the summary every interval seconds on a thread of its own
+    :return thread: threading.Thread
+    """
+    def run():
+        import ticker
+        timer = ticker.Ticker(interval)
+        while True:
+            timer.wait()
+            try:
+                upload(uploader)
+            except Exception as err:
+                print('Instrumentation upload failed: {0}'.format(err))
+
+    thread = threading.Thread(target=run, name='instr')
+    thread.setDaemon(True)
+    thread.start()
+    return thread
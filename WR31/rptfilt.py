@@ -0,0 +1,333 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Report filters, deciding which readings are worth uploading.
+
+- OnChange reports a reading that differs from the last one reported.
+- Deadband reports a reading at least threshold away from the last one
+  reported, by abs() or a given distance function.
+- Thresholds is a Deadband that also reports a reading that crossed any
+  of a list of levels, however small the change. With hysteresis, a level
+  only counts as crossed once the reading is that far past it, so noise
+  around a level is not reported as a crossing every time.
+- SwingingDoor reports the points of a piecewise-linear line that stays
+  within deviation of every reading, so slow drift costs one point per
+  change of slope instead of one per threshold step.
+
+Every filter also reports the latest reading after max_silence seconds
+without a report, as a heartbeat.
+
+offer() returns the (time, value) points to upload, which for SwingingDoor
+are earlier readings, so upload them with their own timestamps.
+
+Usage:
+    import rptfilt
+    vin_filter = rptfilt.SwingingDoor(0.05, max_silence=3600)
+    for when, value in vin_filter.offer(12.03):
+        uploader.add('wr31vin', value, timestamp=int(when * 1000))
+
+Replay a recorded file of 'time,value' or 'value' lines through each
+filter, to compare upload reduction with reconstruction error:
+    > python rptfilt.py samples.csv [threshold] [max_silence]
+"""
+
+import bisect
+import math
+import sys
+import time
+
+FILTERS = ['deadband', 'swingingdoor']
+
+
+class ReportFilter(object):
+    """
+    Base filter, reporting every reading
+    """
+    interpolate = False  # True if the value between reports is a straight line
+
+    def __init__(self, max_silence=None):
+        self.max_silence = max_silence
+        self.last_report = None  # (time, value)
+        self.offered = 0
+        self.reported = 0
+        self.heartbeats = 0
+
+    def check(self, value, when):
+        return [(when, value)]
+
+    def heartbeat(self, value, when):
+        return [(when, value)]
+
+    def offer(self, value, when=None):
+        """
+        Offer a reading
+        :param value: Reading
+        :param when: float, Time of the reading, defaults to now
+        :return points: list of (time, value) to report, oldest first
+        """
+        if when is None:
+            when = time.time()
+        self.offered += 1
+        points = self.check(value, when)
+        if (not points and self.max_silence and self.last_report is not None and
+                when - self.last_report[0] >= self.max_silence):
+            points = self.heartbeat(value, when)
+            self.heartbeats += 1
+        if points:
+            self.reported += len(points)
+            self.last_report = points[-1]
+        return points
+
+    def flush(self):
+        """
+        :return points: list of (time, value) held back by the filter
+        """
+        return []
+
+    def stats(self):
+        reduction = 0.0
+        if self.offered:
+            reduction = 1.0 - float(self.reported) / self.offered
+        return {
+            'offered': self.offered,
+            'reported': self.reported,
+            'heartbeats': self.heartbeats,
+            'reduction': reduction,
+        }
+
+
+class OnChange(ReportFilter):
+    """
+    Reports a reading that differs from the last one reported
+    """
+    def check(self, value, when):
+        if self.last_report is None or value != self.last_report[1]:
+            return [(when, value)]
+        return []
+
+
+class Deadband(ReportFilter):
+    """
+    Reports a reading at least threshold away from the last one reported
+    """
+    def __init__(self, threshold, max_silence=None, distance=None):
+        """
+        :param threshold: Smallest change reported
+        :param distance: callable(a, b) returning the change from a to b,
+            defaults to abs(b - a)
+        """
+        ReportFilter.__init__(self, max_silence)
+        self.threshold = threshold
+        self.distance = distance or (lambda a, b: abs(b - a))
+
+    def check(self, value, when):
+        if self.last_report is None or self.distance(self.last_report[1], value) >= self.threshold:
+            return [(when, value)]
+        return []
+
+
+class Thresholds(Deadband):
+    """
+    Deadband that also reports every crossing of a level
+    """
+    def __init__(self, threshold, levels, max_silence=None, hysteresis=0):
+        """
+        :param levels: list, Levels in ascending order, e.g. [-105, -95, -85]
+        :param hysteresis: Distance past a level for it to count as crossed
+        """
+        Deadband.__init__(self, threshold, max_silence)
+        self.levels = levels
+        self.hysteresis = hysteresis
+        self.current = None  # band of the readings, None until the first
+        self.last_crossing = None  # (from band, to band)
+        self.crossings = 0
+
+    def band(self, value):
+        """
+        :return band: int, Number of levels at or below value
+        """
+        return bisect.bisect_right(self.levels, value)
+
+    def next_band(self, value):
+        rising = bisect.bisect_right(self.levels, value - self.hysteresis)
+        if rising > self.current:
+            return rising
+        falling = bisect.bisect_right(self.levels, value + self.hysteresis)
+        if falling < self.current:
+            return falling
+        return self.current
+
+    def check(self, value, when):
+        if self.current is None:
+            self.current = self.band(value)
+        band = self.next_band(value)
+        if band != self.current:
+            self.last_crossing = (self.current, band)
+            self.current = band
+            self.crossings += 1
+            return [(when, value)]
+        return Deadband.check(self, value, when)
+
+
+class SwingingDoor(ReportFilter):
+    """
+    Swinging door compression of a numeric series
+    """
+    interpolate = True
+
+    def __init__(self, deviation, max_silence=None):
+        """
+        :param deviation: Largest error between a reading and the line
+            through the reported points
+        """
+        ReportFilter.__init__(self, max_silence)
+        self.deviation = deviation
+        self.archive = None  # (time, value) the doors hinge on
+        self.held = None  # Last reading, not yet reported
+        self.min_slope = None  # Slope of the lower door
+        self.max_slope = None  # Slope of the upper door
+
+    def open_doors(self, point, when, value):
+        self.archive = point
+        self.held = (when, value)
+        self.min_slope = self.max_slope = None
+        if when > point[0]:
+            self.swing(when, value)
+
+    def swing(self, when, value):
+        dt = when - self.archive[0]
+        low = (value - self.archive[1] - self.deviation) / dt
+        high = (value - self.archive[1] + self.deviation) / dt
+        if self.min_slope is None or low > self.min_slope:
+            self.min_slope = low
+        if self.max_slope is None or high < self.max_slope:
+            self.max_slope = high
+
+    def check(self, value, when):
+        if self.archive is None:
+            self.archive = self.held = (when, value)
+            return [(when, value)]
+        if when <= self.archive[0]:
+            return []
+        slope = (value - self.archive[1]) / (when - self.archive[0])
+        if self.min_slope is not None and not self.min_slope <= slope <= self.max_slope:
+            # A line ending at this reading would miss an earlier one, so
+            # the line has to bend at the previous reading
+            point = self.held
+            self.open_doors(point, when, value)
+            return [point]
+        self.swing(when, value)
+        self.held = (when, value)
+        return []
+
+    def heartbeat(self, value, when):
+        self.archive = self.held = (when, value)
+        self.min_slope = self.max_slope = None
+        return [(when, value)]
+
+    def flush(self):
+        if self.held is None or self.held == self.archive:
+            return []
+        point = self.held
+        self.archive = point
+        self.min_slope = self.max_slope = None
+        self.reported += 1
+        self.last_report = point
+        return [point]
+
+
+def make_filter(name, threshold, max_silence=None):
+    """
+    :param name: str, One of FILTERS
+    :return report_filter: ReportFilter
+    """
+    if name == 'deadband':
+        return Deadband(threshold, max_silence)
+    if name == 'swingingdoor':
+        return SwingingDoor(threshold, max_silence)
+    raise ValueError('Unknown report filter: {0}'.format(name))
+
+
+def reconstruct(points, when, interpolate):
+    """
+    Value of the reported series at a time, from sorted (time, value) points
+    """
+    last = None
+    for point in points:
+        if point[0] > when:
+            if interpolate and last is not None:
+                return last[1] + (point[1] - last[1]) * (when - last[0]) / (point[0] - last[0])
+            break
+        last = point
+    if last is None:
+        return points[0][1]
+    return last[1]
+
+
+def replay(samples, report_filter):
+    """
+    Run samples through a filter
+    :param samples: list of (time, value)
+    :return: (reported points, max error, rms error)
+    """
+    points = []
+    for when, value in samples:
+        points.extend(report_filter.offer(value, when))
+    points.extend(report_filter.flush())
+    errors = []
+    index = 0
+    for when, value in samples:
+        # Only the points around each sample are needed for its error
+        while index + 1 < len(points) and points[index + 1][0] <= when:
+            index += 1
+        errors.append(abs(value - reconstruct(points[index:index + 2], when, report_filter.interpolate)))
+    rms = math.sqrt(sum([e * e for e in errors]) / len(errors))
+    return points, max(errors), rms
+
+
+def read_samples(filename):
+    """
+    Read 'time,value' or 'value' lines, numbering the lines when there is
+    no time
+    :return samples: list of (time, value)
+    """
+    samples = []
+    sample_file = open(filename, 'r')
+    try:
+        for line in sample_file:
+            fields = line.strip().split(',')
+            try:
+                if len(fields) > 1:
+                    samples.append((float(fields[0]), float(fields[1])))
+                elif fields[0]:
+                    samples.append((float(len(samples)), float(fields[0])))
+            except ValueError:
+                pass  # header or comment
+    finally:
+        sample_file.close()
+    return samples
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    samples = read_samples(sys.argv[1])
+    if not samples:
+        print 'No samples in {0}'.format(sys.argv[1])
+        sys.exit(1)
+    values = [value for when, value in samples]
+    threshold = len(sys.argv) > 2 and float(sys.argv[2]) or (max(values) - min(values)) / 100.0
+    max_silence = len(sys.argv) > 3 and float(sys.argv[3]) or None
+    print '{0} samples, threshold {1}, max silence {2}'.format(len(samples), threshold, max_silence)
+    print '{0:<14}{1:>10}{2:>12}{3:>12}{4:>12}'.format('filter', 'reported', 'reduction', 'max error',
+                                                      'rms error')
+    for name in FILTERS:
+        report_filter = make_filter(name, threshold, max_silence)
+        points, max_error, rms = replay(samples, report_filter)
+        print '{0:<14}{1:>10}{2:>11.1f}%{3:>12.4f}{4:>12.4f}'.format(
+            name, len(points), 100.0 * (1.0 - float(len(points)) / len(samples)), max_error, rms)
@@ -0,0 +1,76 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Exercise alertq.AlertDispatcher with fake alert sinks that add latency and
+fail, while a door flaps open and closed faster than the sinks can keep up.
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:. python sim/alertsim.py
+"""
+
+import random
+import time
+
+import alertq
+
+
+class FakeSink(object):
+    """
+    Alert sink taking latency seconds per send and failing with the given
+    probability, alternately by raising and by returning a failed upload
+    """
+    def __init__(self, name, latency, failure_rate, seed=1):
+        self.name = name
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rand = random.Random(seed)
+        self.calls = 0
+        self.sent = []
+
+    def send_alert(self, message):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.rand.random() < self.failure_rate:
+            if self.calls % 2:
+                raise IOError('simulated uplink failure')
+            return (False, 1, 'simulated upload failure')
+        self.sent.append(message)
+        return (True, 0, '')
+
+
+class SmsSink(FakeSink):
+    pass
+
+
+class DatapointSink(FakeSink):
+    pass
+
+
+if __name__ == '__main__':
+    sms = SmsSink('sms', latency=1.5, failure_rate=0.3)
+    datapoint = DatapointSink('datapoint', latency=0.05, failure_rate=0.1)
+    dispatcher = alertq.AlertDispatcher([sms, datapoint], queue_size=4, backoff=0.1)
+
+    slowest = 0.0
+    statuses = ['OPEN', 'CLOSED'] * 10 + ['OPEN']
+    for status in statuses:
+        start = time.time()
+        dispatcher.dispatch(status, key='door')
+        dispatcher.dispatch('heartbeat')
+        slowest = max(slowest, time.time() - start)
+        time.sleep(0.2)
+    idle = dispatcher.wait_idle(30)
+    dispatcher.stop()
+
+    print 'Slowest dispatch() call: {0:.2f} ms'.format(slowest * 1000)
+    print 'All queues drained: {0}'.format(idle)
+    for sink in (sms, datapoint):
+        stats = dispatcher.stats()[sink.__class__.__name__]
+        door = [message for message in sink.sent if message != 'heartbeat']
+        print '{0}: {1} calls, last door status sent {2}'.format(
+            sink.name, sink.calls, door and door[-1] or None)
+        print '  {0}'.format(', '.join(['{0}={1}'.format(k, stats[k]) for k in sorted(stats)]))
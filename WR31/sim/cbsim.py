@@ -0,0 +1,63 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Fire bursts of device requests at callbacks running on cbpool.CallbackPool
+and report the responses and per-target metrics.
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:. python sim/cbsim.py [burst size]
+"""
+
+import sys
+import time
+
+import cbpool
+import clisess
+import idigidata
+import sarcli
+
+BURST = 40
+
+
+def slow_report(target, data):
+    # A callback that reads the CLI, like gps2drm's reportgps used to
+    return clisess.execute('at\\mibs=gps')[:20]
+
+
+def echo(target, data):
+    time.sleep(0.02)
+    return 'echo ' + data
+
+
+def summary(responses):
+    counts = {}
+    for response in responses:
+        key = response in (cbpool.BUSY_RESPONSE, cbpool.TIMEOUT_RESPONSE, cbpool.ERROR_RESPONSE) \
+            and response or 'answered'
+        counts[key] = counts.get(key, 0) + 1
+    return ', '.join(['{0} {1}'.format(count, key) for key, count in sorted(counts.items())])
+
+
+if __name__ == '__main__':
+    burst = len(sys.argv) > 1 and int(sys.argv[1]) or BURST
+    sarcli.set_latency(command_ms=50)
+    pool = cbpool.CallbackPool(workers=2, queue_size=8)
+    pool.register('reportgps', slow_report)
+    pool.register('echo', echo, coalesce=False)
+
+    for target in ('reportgps', 'echo'):
+        start = time.time()
+        responses = idigidata.fire(target, 'x', burst)
+        print '{0}: {1} requests in {2:.2f} s on {3} workers: {4}'.format(
+            target, burst, time.time() - start, len(pool.threads), summary(responses))
+
+    for target, stats in sorted(pool.stats()['targets'].items()):
+        print '{0}: completed {1}, coalesced {2}, rejected {3}, max depth {4}, ' \
+              'latency mean {5:.0f} ms max {6:.0f} ms, run {7:.0f} ms'.format(
+                  target, stats['completed'], stats['coalesced'], stats['rejected'], stats['depth_max'],
+                  1000 * stats['latency_mean'], 1000 * stats['latency_max'], 1000 * stats['run_mean'])
+    pool.stop()
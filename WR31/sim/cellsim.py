@@ -0,0 +1,64 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Drive cellmon.CellMonitor through a simulated day of modem status sampled
+every minute: a steady signal, a slow fade towards a lost link, recovery,
+and a SIM swap. Report the DataPoints queued against one per field per
+sample, the level-crossing alerts, and the read and parse cost.
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:.:.. python sim/cellsim.py
+"""
+
+import random
+
+import cellmon
+import dpupload
+import sarcli
+
+SAMPLE_INTERVAL = 60  # seconds
+START = 1500000000.0
+
+# (samples, rssi at the end of the phase)
+PHASES = [
+    (480, -71),  # steady
+    (240, -108),  # fading
+    (120, -108),  # near loss
+    (120, -75),  # recovering
+    (480, -73),  # steady
+]
+
+
+def rssi_series(seed=1):
+    rand = random.Random(seed)
+    rssi = -71.0
+    for samples, target in PHASES:
+        step = (target - rssi) / samples
+        for x in range(samples):
+            rssi += step
+            yield int(round(rssi + rand.gauss(0, 1)))
+
+
+if __name__ == '__main__':
+    uploader = dpupload.DataPointUploader()
+    monitor = cellmon.CellMonitor(uploader)
+    now = START
+    fields = len(cellmon.METRICS) + len(cellmon.TEXT_FIELDS)
+    for index, rssi in enumerate(rssi_series()):
+        sarcli.set_modem(rssi=rssi, rsrp=rssi - 27, sinr=round(12.5 + (rssi + 71) / 3.0, 1),
+                         network=rssi < -105 and 'Searching' or 'Registered (Home network)')
+        if index == 1000:
+            sarcli.set_modem(iccid='89014103211118599999')
+        monitor.sample(now)
+        now += SAMPLE_INTERVAL
+
+    stats = monitor.stats()
+    print('{0} samples, {1} DataPoints queued instead of {2}, {3:.1f}% fewer, {4} alerts'.format(
+        stats['samples'], stats['uploads'], stats['samples'] * fields,
+        100.0 * (1 - float(stats['uploads']) / (stats['samples'] * fields)), stats['alerts']))
+    print('read {0:.3f} ms, parse {1:.3f} ms per sample'.format(
+        1000 * stats['read_mean'], 1000 * stats['parse_mean']))
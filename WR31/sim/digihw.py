@@ -0,0 +1,132 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Off-device stand-in for the TransPort 'digihw' module.
+
+Simulates the WR31 digital inputs and analog input, which the simulated
+'gpio dio' and 'gpio ain' CLI commands in sim/sarcli.py report as well. A
+pin can be set directly or play back a timed sequence of levels, e.g. a
+door opening with contact bounce:
+    digihw.play(1, [(0.0, 1), (0.002, 0), (0.004, 1)])
+
+set_output() drives an output, which only 'gpio dio' reports, as
+digihw on the router reads inputs only.
+
+set_ain_offset() makes wr31_ain_get_value() disagree with 'gpio ain', to
+exercise drift checks.
+
+The SIM_DIGIHW_MS environment variable sets the latency of each call in
+milliseconds.
+"""
+
+import os
+import time
+
+LATENCY = float(os.environ.get('SIM_DIGIHW_MS', 0)) / 1000.0
+
+# Pin -> level, D0 inactive (HIGH) and D1 active (LOW, door closed)
+LEVELS = {0: 1, 1: 0}
+# Analog input mode -> value, in V or mA
+AIN = {'voltage': 3.252, 'current': 0.0173}
+
+stats = {
+    'reads': 0,
+    'ain_reads': 0,
+}
+
+_levels = dict(LEVELS)
+_outputs = {}  # Pin -> True if the output is ON
+_signals = {}
+_ain = dict(AIN)
+_ain_state = {'mode': 'voltage', 'offset': 0.0}
+
+
+def reset():
+    _levels.clear()
+    _levels.update(LEVELS)
+    _outputs.clear()
+    _signals.clear()
+    _ain.clear()
+    _ain.update(AIN)
+    _ain_state.update({'mode': 'voltage', 'offset': 0.0})
+    for key in stats:
+        stats[key] = 0
+
+
+def set_level(pin, level):
+    _signals.pop(pin, None)
+    _levels[pin] = level
+
+
+def set_output(pin, on):
+    _outputs[pin] = on
+
+
+def output(pin):
+    """
+    Return True if the output of a pin is ON
+    """
+    return _outputs.get(pin, False)
+
+
+def play(pin, events):
+    """
+    Play back a sequence of levels on a pin
+    :param pin: int, Pin number, 0 for D0 and 1 for D1
+    :param events: list of (seconds from now, level), in time order
+    """
+    start = time.time()
+    _signals[pin] = [(start + offset, level) for offset, level in events]
+
+
+def level(pin):
+    """
+    Return the level of a pin now, without counting it as a read
+    """
+    signal = _signals.get(pin)
+    if signal:
+        now = time.time()
+        while signal and signal[0][0] <= now:
+            _levels[pin] = signal.pop(0)[1]
+    return _levels.get(pin, 1)
+
+
+def gpio_get_value(pin):
+    if LATENCY:
+        time.sleep(LATENCY)
+    stats['reads'] += 1
+    return level(pin)
+
+
+def set_ain(value, mode='voltage'):
+    _ain[mode] = value
+
+
+def set_ain_mode(mode):
+    _ain_state['mode'] = mode
+
+
+def set_ain_offset(offset):
+    """
+    Add offset to wr31_ain_get_value(), but not to 'gpio ain'
+    """
+    _ain_state['offset'] = offset
+
+
+def ain():
+    """
+    Return the mode and value of the analog input, without counting a read
+    """
+    mode = _ain_state['mode']
+    return mode, _ain[mode]
+
+
+def wr31_ain_get_value():
+    if LATENCY:
+        time.sleep(LATENCY)
+    stats['ain_reads'] += 1
+    return ain()[1] + _ain_state['offset']
@@ -0,0 +1,109 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Drive doormon.DoorMonitor with simulated door activity: a clean open and
+close, contact bounce, and a burst of short open/close flaps, once through
+the digihw fast path and once through the CLI. Then check that both paths
+report the door open while an output is ON.
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:. python sim/doorsim.py
+"""
+
+import time
+
+import digihw
+import sarcli
+import doormon
+import wr31io
+
+DOOR_PIN = 1
+OPEN = 1
+CLOSED = 0
+
+# (seconds from start, level) for the D1 door switch
+SCENARIO = [
+    (0.5, OPEN),  # clean open
+    (1.5, CLOSED),  # clean close
+    (2.5, OPEN), (2.502, CLOSED), (2.504, OPEN), (2.507, CLOSED), (2.510, OPEN),  # bouncy open
+    (3.5, CLOSED), (3.503, OPEN), (3.505, CLOSED),  # bouncy close
+    (4.5, OPEN), (4.8, CLOSED), (5.1, OPEN), (5.4, CLOSED),  # flaps
+]
+EXPECTED = ['OPEN', 'CLOSED', 'OPEN', 'CLOSED', 'OPEN', 'CLOSED', 'OPEN', 'CLOSED']
+DURATION = 6.5  # seconds
+
+
+class RecordingAlert(object):
+    def __init__(self):
+        self.alerts = []
+
+    def send_alert(self, message):
+        self.alerts.append((time.time(), message))
+
+
+def run(reader):
+    digihw.reset()
+    sarcli.reset()
+    alert = RecordingAlert()
+    monitor = doormon.DoorMonitor([alert], reader)
+    monitor.poll()  # report the initial status
+    monitor.dispatcher.wait_idle()
+    del alert.alerts[:]
+    digihw.play(DOOR_PIN, SCENARIO)
+    start = time.time()
+    while time.time() - start < DURATION:
+        monitor.poll()
+        time.sleep(monitor.interval)
+    monitor.dispatcher.wait_idle()
+    monitor.dispatcher.stop()
+    return monitor, alert.alerts, start
+
+
+def settle_times(start):
+    """
+    Time each expected status was last entered, after any bounce
+    """
+    times = []
+    for offset, level in SCENARIO:
+        status = level == OPEN and 'OPEN' or 'CLOSED'
+        if times and times[-1][1] == status:
+            continue
+        if times and offset - times[-1][0] < doormon.DEBOUNCE:
+            times[-1] = (offset, status)
+        else:
+            times.append((offset, status))
+    return [start + offset for offset, status in times]
+
+
+def report(name, monitor, alerts, start):
+    statuses = [status for when, status in alerts]
+    stats = monitor.stats()
+    print '{0}: {1} polls, {2} alerts, {3}'.format(
+        name, stats['polls'], len(alerts), statuses == EXPECTED and 'as expected' or 'UNEXPECTED')
+    if statuses != EXPECTED:
+        print '  got      {0}'.format(statuses)
+        print '  expected {0}'.format(EXPECTED)
+    latencies = [when - settled for (when, status), settled in zip(alerts, settle_times(start))]
+    if latencies:
+        print '  latency after settling: mean {0:.0f} ms, max {1:.0f} ms'.format(
+            1000 * sum(latencies) / len(latencies), 1000 * max(latencies))
+    print '  reported latency bound: mean {0:.0f} ms, max {1:.0f} ms'.format(
+        1000 * stats['latency_mean'], 1000 * stats['latency_max'])
+
+
+if __name__ == '__main__':
+    sarcli.set_latency(command_ms=40)
+    for reader in (wr31io.DigihwDigitalReader(), wr31io.CliDigitalReader()):
+        monitor, alerts, start = run(reader)
+        report(reader.name, monitor, alerts, start)
+    for pin in (0, 1):
+        statuses = []
+        for reader in (wr31io.DigihwDigitalReader(), wr31io.CliDigitalReader()):
+            digihw.reset()
+            digihw.set_output(pin, True)
+            statuses.append(doormon.DoorMonitor([], reader, heartbeat=None).switch_status())
+        print 'D{0} DOUT=ON, door closed: digihw {1}, cli {2}'.format(pin, statuses[0], statuses[1])
@@ -0,0 +1,66 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Micro-benchmark of wr31io.parse_gpio_response() against the list-rewriting
+parse_gpio_response() that hi_poll.py and ex_gpio.py used before.
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:. python sim/gpiobench.py [iterations]
+"""
+
+import sys
+import timeit
+
+import wr31io
+
+ITERATIONS = 100000
+
+RESPONSES = [
+    ('dio', '\r\nD0: DOUT=OFF, DIN=HIGH (Inactive)\r\nD1: DOUT=OFF, DIN=LOW (Active)\r\nOK\r\n'),
+    ('ain', '\r\nA0: voltage=3.2520 V\r\nOK\r\n'),
+    ('no OK', '\r\nD0: DOUT=OFF, DIN=HIGH (Inactive)\r\nD1: DOUT=OFF, DIN=LOW (Active)\r\n'),
+    ('ERROR', '\r\nERROR\r\n'),
+    # A long capture, where rewriting the list in place costs O(n^2)
+    ('dio x500', '\r\n' + 500 * 'D0: DOUT=OFF, DIN=HIGH (Inactive)\r\n' + 'OK\r\n'),
+]
+
+
+def old_parse_gpio_response(response_str):
+    lines = response_str.strip().splitlines()
+    lines.remove('OK')
+    i = 0
+    for line in lines:
+        newline = line.split(": ")
+        del lines[i]
+        lines.insert(i, newline)
+        i += 1
+    return lines
+
+
+def per_call(function, response, iterations):
+    """
+    :return: float, microseconds per call, None if the call raises
+    """
+    try:
+        function(response)
+    except ValueError:
+        return None
+    iterations = max(1, iterations // response.count('\n'))
+    timer = timeit.Timer(lambda: function(response))
+    return min(timer.repeat(3, iterations)) * 1e6 / iterations
+
+
+if __name__ == '__main__':
+    iterations = len(sys.argv) > 1 and int(sys.argv[1]) or ITERATIONS
+    print '{0:<8} {1:>10} {2:>10}'.format('response', 'old us', 'new us')
+    for name, response in RESPONSES:
+        old = per_call(old_parse_gpio_response, response, iterations)
+        new = per_call(wr31io.parse_gpio_response, response, iterations)
+        records = wr31io.parse_gpio_response(response)
+        print '{0:<8} {1:>10} {2:>10.2f}   {3} records {4}'.format(
+            name, old is None and 'raises' or '{0:.2f}'.format(old), new, len(records),
+            [wr31io.format_record(record) for record in records[:2]])
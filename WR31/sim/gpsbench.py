@@ -0,0 +1,78 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Benchmark of gps2drm.gps_fix() against the cli_parse() per-field parsing
+gps2drm.py used before, over MIB dumps in the 'at\\mibs=gps' format, with
+all seven fields the old code had (partly commented out).
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:. python sim/gpsbench.py [iterations]
+"""
+
+import sys
+import timeit
+
+import gps2drm
+import sarcli
+
+ITERATIONS = 20000
+FIELDS = ['longitude', 'latitude', 'satellites', 'course', 'utctime', 'altitude', 'speedknots']
+
+DUMPS = [
+    ('fix NW', sarcli.GPS_MIBS),
+    ('fix SE', sarcli.GPS_MIBS.replace('44.923456 N', '33.868820 S').replace('93.412345 W', '151.209296 E')),
+    ('no fix', sarcli.GPS_MIBS.replace('satellites = 8', 'satellites = 0')
+                              .replace('44.923456 N', '0.000000 N').replace('93.412345 W', '0.000000 E')),
+    # Full MIB dump, with the GPS statistics among the other groups
+    ('full', '\r\n'.join(['mib.{0}.value = {1}'.format(x, x * 7) for x in range(200)]) + sarcli.GPS_MIBS),
+]
+
+
+def cli_parse(strData, strName, gps=False):
+    try:
+        pos1 = strData.find(strName)
+        pos2 = strData.find('\n', pos1)
+        if (gps):
+            pos3 = strData.find('=', pos1)
+        else:
+            pos3 = strData.find(':', pos1)
+        if pos2 > pos1 and pos2 > 0 and pos2 > pos3 and pos3 > 0:
+            name = strData[pos3 + 2:pos2 - 1]
+        else:
+            name = ""
+        return name
+    except Exception, ex:
+        return ""
+
+
+def old_gps_fix(at_mibs_gps):
+    stats = {}
+    for field in FIELDS:
+        stats[field] = cli_parse(at_mibs_gps, gps2drm.GPS_PREFIX + field, True)
+    return [float(stats['latitude'].strip(' NSEW')), float(stats['longitude'].strip(' NSEW'))]
+
+
+def new_gps_fix(at_mibs_gps):
+    try:
+        fix = gps2drm.gps_fix(at_mibs_gps)
+    except gps2drm.GpsError:
+        return None
+    return [fix['latitude'], fix['longitude']]
+
+
+def per_call(function, dump, iterations):
+    timer = timeit.Timer(lambda: function(dump))
+    return min(timer.repeat(3, iterations)) * 1e6 / iterations
+
+
+if __name__ == '__main__':
+    iterations = len(sys.argv) > 1 and int(sys.argv[1]) or ITERATIONS
+    print '{0:<8} {1:>8} {2:>8}   {3:<24} {4}'.format('dump', 'old us', 'new us', 'old result', 'new result')
+    for name, dump in DUMPS:
+        print '{0:<8} {1:>8.2f} {2:>8.2f}   {3:<24} {4}'.format(
+            name, per_call(old_gps_fix, dump, iterations), per_call(new_gps_fix, dump, iterations),
+            old_gps_fix(dump), new_gps_fix(dump))
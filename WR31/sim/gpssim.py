@@ -0,0 +1,77 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Drive gps2drm.GpsReporter over a simulated two-hour route (parked, a
+straight road, a few turns, parked again) sampled every 10 seconds, and
+compare what it uploads with one DataPoint per sample.
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:. python sim/gpssim.py
+"""
+
+import math
+import random
+
+import dpupload
+import gps2drm
+import idigidata
+import sarcli
+
+START = (44.9778, -93.2650)
+SAMPLE_INTERVAL = 10  # seconds
+METERS_PER_DEGREE = 111320.0
+
+# (samples, speed m/s, heading degrees)
+ROUTE = [
+    (120, 0, 0),  # parked
+    (90, 25, 90),  # highway east
+    (30, 12, 0),  # north
+    (20, 12, 45),
+    (40, 15, 90),
+    (60, 10, 180),  # south through town
+    (360, 0, 0),  # parked
+]
+
+
+def route_positions(seed=1):
+    rand = random.Random(seed)
+    lat, lon = START
+    for samples, speed, heading in ROUTE:
+        for x in range(samples):
+            step = speed * SAMPLE_INTERVAL
+            lat += step * math.cos(math.radians(heading)) / METERS_PER_DEGREE
+            lon += step * math.sin(math.radians(heading)) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+            # a few meters of GPS noise
+            yield (lat + rand.gauss(0, 3) / METERS_PER_DEGREE, lon + rand.gauss(0, 3) / METERS_PER_DEGREE)
+
+
+def mibs(lat, lon):
+    return sarcli.GPS_MIBS.replace('44.923456 N', '%.6f %s' % (abs(lat), lat < 0 and 'S' or 'N')) \
+                          .replace('93.412345 W', '%.6f %s' % (abs(lon), lon < 0 and 'W' or 'E'))
+
+
+if __name__ == '__main__':
+    reporter = gps2drm.GpsReporter(uploader=dpupload.DataPointUploader())
+    now = 1500000000.0
+    per_sample_bytes = 0
+    samples = 0
+    for lat, lon in route_positions():
+        sarcli.set_response('at\\mibs=gps', mibs(lat, lon))
+        reporter.sample(now)
+        if reporter.due(now):
+            reporter.flush()
+        per_sample_bytes += len(dpupload.datapoint_xml('geolocation', [lat, lon]))
+        samples += 1
+        now += SAMPLE_INTERVAL
+    reporter.flush()
+
+    stats = reporter.stats()
+    sent = sum([len(data) for path, data in idigidata.uploads])
+    print '{0} samples, {1} positions kept, {2} track DataPoints'.format(
+        samples, stats['kept'], stats['tracks'])
+    print 'Uploaded {0} bytes, against {1} bytes for one DataPoint per sample ({2:.0f}% less)'.format(
+        sent, per_sample_bytes, 100.0 * (1 - float(sent) / per_sample_bytes))
@@ -0,0 +1,102 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Off-device stand-in for the TransPort 'idigidata' module.
+
+Uploads are recorded in 'uploads' instead of being sent to Remote Manager.
+set_online(False) makes uploads fail, as when the cellular link is down.
+fire() delivers device requests to registered callbacks, one at a time or
+as a burst of concurrent requests, like SCI requests from Remote Manager.
+The SIM_IDIGIDATA_MS environment variable sets the latency of each upload
+in milliseconds.
+"""
+
+import os
+import threading
+import time
+
+LATENCY = float(os.environ.get('SIM_IDIGIDATA_MS', 0)) / 1000.0
+
+uploads = []  # (filename, data) for every successful upload
+callbacks = {}  # target -> callback registered with register_callback()
+stats = {
+    'uploads': 0,
+    'failures': 0,
+    'bytes': 0,
+}
+
+_online = [True]
+_lock = threading.Lock()
+
+
+def reset():
+    del uploads[:]
+    callbacks.clear()
+    _online[0] = True
+    for key in stats:
+        stats[key] = 0
+
+
+def set_online(online):
+    _online[0] = online
+
+
+def send_to_idigi(data, filename, collection=None, content_type='text/xml', archive=False,
+                  append=False, timeout=None):
+    """
+    Record an upload
+    :return (success, error, errmsg): tuple, like idigidata.send_to_idigi()
+    """
+    if LATENCY:
+        time.sleep(LATENCY)
+    _lock.acquire()
+    try:
+        if not _online[0]:
+            stats['failures'] += 1
+            return (False, 1, 'simulated: not connected')
+        uploads.append((filename, data))
+        stats['uploads'] += 1
+        stats['bytes'] += len(data)
+    finally:
+        _lock.release()
+    return (True, 0, '')
+
+
+def register_callback(target, callback):
+    callbacks[target] = callback
+    return True
+
+
+def unregister_callback(target):
+    callbacks.pop(target, None)
+    return True
+
+
+def fire(target, data='', count=1, concurrent=True):
+    """
+    Deliver device requests to the callback registered for target
+    :param count: int, Number of requests
+    :param concurrent: bool, True to deliver them all at once, each on its
+        own thread
+    :return responses: list, Callback responses, in request order
+    """
+    callback = callbacks[target]
+    responses = [None] * count
+    if not concurrent:
+        for index in range(count):
+            responses[index] = callback(target, data)
+        return responses
+
+    def request(index):
+        responses[index] = callback(target, data)
+
+    threads = [threading.Thread(target=request, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
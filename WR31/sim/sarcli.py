@@ -0,0 +1,230 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Off-device stand-in for the TransPort 'sarcli' module.
+
+Put this directory first on the path to run the WR31 examples on a PC:
+    > PYTHONPATH=sim python hi_poll.py
+
+Responses are canned per command prefix and can be replaced with
+set_response(). 'gpio dio' and 'gpio ain' report the inputs simulated by
+sim/digihw.py, and 'modemstat ?' the modem state in MODEM, changed with
+set_modem(). Latency is configurable in milliseconds, either here or with
+the SIM_SARCLI_OPEN_MS and SIM_SARCLI_CMD_MS environment variables, and
+fail_next() makes the next writes raise, to exercise reconnect handling.
+"""
+
+import os
+import threading
+import time
+
+import digihw
+
+OPEN_LATENCY = float(os.environ.get('SIM_SARCLI_OPEN_MS', 0)) / 1000.0
+COMMAND_LATENCY = float(os.environ.get('SIM_SARCLI_CMD_MS', 0)) / 1000.0
+CHUNK_SIZE = 64  # Responses are returned by read() in chunks of this size
+
+
+def gpio_dio(command):
+    lines = []
+    for pin, channel in enumerate(('D0', 'D1')):
+        dout = digihw.output(pin) and 'ON' or 'OFF'
+        if digihw.level(pin):
+            lines.append('{0}: DOUT={1}, DIN=HIGH (Inactive)'.format(channel, dout))
+        else:
+            lines.append('{0}: DOUT={1}, DIN=LOW (Active)'.format(channel, dout))
+    return '\r\n' + '\r\n'.join(lines) + '\r\nOK\r\n'
+
+
+def gpio_ain(command):
+    args = command.split()[2:]
+    if args:
+        if args[0] not in ('voltage', 'current'):
+            return '\r\nERROR\r\n'
+        digihw.set_ain_mode(args[0])
+    mode, value = digihw.ain()
+    return '\r\nA0: {0}={1:.4f} {2}\r\nOK\r\n'.format(mode, value, mode == 'voltage' and 'V' or 'mA')
+
+
+GPS_MIBS = '\r\n'.join([
+    '',
+    'gps.0.stats.utctime = 183512',
+    'gps.0.stats.date = 180618',
+    'gps.0.stats.latitude = 44.923456 N',
+    'gps.0.stats.longitude = 93.412345 W',
+    'gps.0.stats.altitude = 276.4',
+    'gps.0.stats.satellites = 8',
+    'gps.0.stats.speedknots = 0.0',
+    'gps.0.stats.course = 87.2',
+    'OK',
+    ''])
+
+
+MODEM = {
+    'manufacturer': 'Telit',
+    'model': 'LE910-NA1',
+    'firmware': '20.00.526',
+    'imei': '353238060012345',
+    'imsi': '310410123456789',
+    'iccid': '89014103211118510720',
+    'operator': 'AT&T',
+    'network': 'Registered (Home network)',
+    'technology': '4G',
+    'rssi': -71,
+    'rsrp': -98,
+    'rsrq': -9,
+    'sinr': 12.5,
+    'temperature': 41,
+}
+
+
+def set_modem(**values):
+    """
+    Change the modem state reported by 'modemstat ?', e.g. set_modem(rssi=-97)
+    """
+    MODEM.update(values)
+
+
+def modemstat(command):
+    lines = [
+        '',
+        'Modem Status:',
+        'Manufacturer: {manufacturer}',
+        'Model: {model}',
+        'Revision: {firmware}',
+        'IMEI: {imei}',
+        'IMSI: {imsi}',
+        'ICCID: {iccid}',
+        'Network Operator: {operator}',
+        'Network Status: {network}',
+        'Connection Type: {technology}',
+        'Signal Strength: {rssi} dBm',
+        'RSRP: {rsrp} dBm',
+        'RSRQ: {rsrq} dB',
+        'SINR: {sinr} dB',
+        'Temperature: {temperature} C',
+        'OK',
+        '',
+    ]
+    return '\r\n'.join(lines).format(**MODEM)
+
+
+RESPONSES = {
+    'gpio dio': gpio_dio,
+    'gpio ain': gpio_ain,
+    'at\\mibs=gps': GPS_MIBS,
+    'modemstat ?': modemstat,
+    'sendsms': '\r\nOK\r\n',
+}
+
+stats = {
+    'opened': 0,
+    'closed': 0,
+    'commands': 0,
+}
+
+_responses = dict(RESPONSES)
+_failures = [0]
+_lock = threading.Lock()
+
+
+def set_response(prefix, response):
+    """
+    Set the response for all commands starting with prefix
+    :param prefix: str, Command prefix
+    :param response: str or callable(command) returning str
+    """
+    _responses[prefix] = response
+
+
+def set_latency(open_ms=None, command_ms=None):
+    global OPEN_LATENCY, COMMAND_LATENCY
+    if open_ms is not None:
+        OPEN_LATENCY = open_ms / 1000.0
+    if command_ms is not None:
+        COMMAND_LATENCY = command_ms / 1000.0
+
+
+def fail_next(count=1):
+    """
+    Make the next count writes, on any session, raise IOError
+    """
+    _failures[0] = count
+
+
+def reset():
+    _responses.clear()
+    _responses.update(RESPONSES)
+    _failures[0] = 0
+    for key in stats:
+        stats[key] = 0
+
+
+def open_sessions():
+    return stats['opened'] - stats['closed']
+
+
+def response_for(command):
+    best = None
+    for prefix in _responses:
+        if command.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    if best is None:
+        return '\r\nERROR\r\n'
+    response = _responses[best]
+    if callable(response):
+        response = response(command)
+    return response
+
+
+class _Session(object):
+    def __init__(self):
+        self.pending = ''
+        self.closed = False
+
+    def write(self, command):
+        if self.closed:
+            raise IOError('session closed')
+        _lock.acquire()
+        try:
+            failing = _failures[0] > 0
+            if failing:
+                _failures[0] -= 1
+            stats['commands'] += 1
+        finally:
+            _lock.release()
+        if failing:
+            raise IOError('simulated CLI failure')
+        if COMMAND_LATENCY:
+            time.sleep(COMMAND_LATENCY)
+        self.pending = response_for(command)
+
+    def read(self, timeout=-1):
+        if self.closed:
+            raise IOError('session closed')
+        if not self.pending:
+            # Like sarcli, an empty string marks the end of a response
+            return ''
+        chunk = self.pending[:CHUNK_SIZE]
+        self.pending = self.pending[CHUNK_SIZE:]
+        return chunk
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            _lock.acquire()
+            stats['closed'] += 1
+            _lock.release()
+
+
+def open():
+    if OPEN_LATENCY:
+        time.sleep(OPEN_LATENCY)
+    _lock.acquire()
+    stats['opened'] += 1
+    _lock.release()
+    return _Session()
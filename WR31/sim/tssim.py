@@ -0,0 +1,88 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Store days of 1 Hz Vin readings in tsstore, then report the bytes used per
+reading and the time taken by range and aggregate queries, local and
+through a device request.
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:. python sim/tssim.py [days]
+"""
+
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import dpupload
+import idigidata
+import tsstore
+
+DAYS = 3
+START = 1500000000.0
+
+
+def vin(when):
+    # 12 V with a daily swing and a charging ripple
+    return 12.0 + 0.4 * math.sin(2 * math.pi * when / 86400) + 0.02 * math.sin(when / 7.0)
+
+
+def timed(label, function, *args):
+    start = time.time()
+    result = function(*args)
+    print '{0:<44}{1:>9.1f} ms'.format(label, 1000 * (time.time() - start))
+    return result
+
+
+if __name__ == '__main__':
+    days = len(sys.argv) > 1 and float(sys.argv[1]) or DAYS
+    directory = tempfile.mkdtemp()
+    try:
+        store = tsstore.get_store('vin', directory)
+        count = int(days * 86400)
+        start = time.time()
+        for second in xrange(count):
+            store.append(vin(START + second), START + second)
+        store.flush()
+        elapsed = time.time() - start
+        stats = store.stats()
+        print '{0} readings in {1} segments, {2} bytes, {3:.2f} bytes/reading, {4:.0f} appends/s'.format(
+            stats['readings'], stats['segments'], stats['bytes'],
+            float(stats['bytes']) / stats['readings'], count / elapsed)
+
+        end = START + count
+        timed('reopen, rebuilding the index', tsstore.TimeSeriesStore, 'vin', directory)
+        readings = timed('last minute of readings', store.query, end - 60, end)
+        assert len(readings) == 60
+        timed('hourly aggregates, last day', store.aggregate, end - 86400, end, 3600)
+        daily = timed('daily aggregates, all days', store.aggregate, None, None, 86400)
+        for row in daily:
+            print '  {0:.0f}: {1} readings, min {2:.3f} max {3:.3f} mean {4:.3f}'.format(
+                row['start'], row['count'], row['min'], row['max'], row['mean'])
+
+        tsstore.register_requests()
+        request = json.dumps({'series': 'vin', 'start': end - 3600, 'end': end, 'bucket': 600})
+        response = timed('device request, 10 minute aggregates', idigidata.fire,
+                         tsstore.REQUEST_TARGET, request)[0]
+        print '  response {0} bytes'.format(len(response))
+        # More readings than a batch, none of which may be sent while the
+        # request is pending
+        request = json.dumps({'series': 'vin', 'start': end - tsstore.QUERY_LIMIT, 'stream': 'wr31vin/history'})
+        idigidata.reset()
+        tsstore.register_requests()
+        response = json.loads(timed('device request, upload {0} readings'.format(tsstore.QUERY_LIMIT),
+                                    idigidata.fire, tsstore.REQUEST_TARGET, request)[0])
+        print '  {0} readings returned, {1} uploads during the request'.format(
+            response['count'], idigidata.stats['uploads'])
+        timed('upload them from the poll loop', dpupload.get_uploader().poll)
+        print '  {0} uploads, {1} bytes'.format(idigidata.stats['uploads'], idigidata.stats['bytes'])
+        print '  {0} bytes of raw history kept on flash'.format(stats['bytes'])
+    finally:
+        shutil.rmtree(directory)
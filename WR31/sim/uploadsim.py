@@ -0,0 +1,45 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Run dpupload.DataPointUploader through an uplink outage: DataPoints from two
+streams are batched, spooled while the simulated uplink is down and
+replayed in order once it is back.
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:. python sim/uploadsim.py
+"""
+
+import shutil
+import tempfile
+
+import dpupload
+import idigidata
+
+if __name__ == '__main__':
+    spool_dir = tempfile.mkdtemp()
+    try:
+        uploader = dpupload.DataPointUploader(max_points=10, spool_dir=spool_dir, spool_max=3)
+        for sample in range(100):
+            if sample == 20:
+                print 'Uplink down'
+                idigidata.set_online(False)
+            if sample == 70:
+                print 'Uplink back'
+                idigidata.set_online(True)
+                uploader.next_replay = 0
+            uploader.add('wr31vin', 12.0 + sample / 100.0, data_type='float', units='V')
+            if sample % 2:
+                uploader.add('door', sample % 4 and 'OPEN' or 'CLOSED', data_type='STRING')
+            uploader.poll()
+        uploader.flush()
+        stats = uploader.stats()
+        print ', '.join(['{0}={1}'.format(k, stats[k]) for k in sorted(stats)])
+        sent = sum([data.count('<DataPoint>') for path, data in idigidata.uploads])
+        print '{0} uploads, {1} bytes, {2} DataPoints delivered of {3}'.format(
+            idigidata.stats['uploads'], idigidata.stats['bytes'], sent, stats['points'])
+    finally:
+        shutil.rmtree(spool_dir)
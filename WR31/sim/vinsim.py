@@ -0,0 +1,61 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Run wr31Vin.py high-rate sampling through a simulated 200 ms brown-out and
+show the aggregates and the raw snapshot that are uploaded, with the
+history kept in a temporary directory.
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:. python sim/vinsim.py
+"""
+
+import shutil
+import tempfile
+import threading
+
+import digihw
+import idigidata
+import tsstore
+import wr31Vin
+
+NOMINAL = 3.252  # Analog input for about 10.9 V in
+BROWNOUT = 2.2  # Analog input for about 7.4 V in
+INTERVALS = 3
+
+if __name__ == '__main__':
+    wr31Vin.sampleRate = 50
+    wr31Vin.readInterval = 1
+    wr31Vin.bufferSize = 20
+    uploader = wr31Vin.dpupload.get_uploader()
+    uploader.max_points = 1000
+    # Keep the history in a directory of its own, not the checkout
+    wr31Vin.keepHistory = True
+    directory = tempfile.mkdtemp()
+    store = tsstore.get_store('vin', directory)
+
+    digihw.set_ain(NOMINAL)
+    threading.Timer(1.5, digihw.set_ain, (BROWNOUT,)).start()
+    threading.Timer(1.7, digihw.set_ain, (NOMINAL,)).start()
+
+    buf = wr31Vin.VinBuffer(wr31Vin.bufferSize)
+    reference = None
+    try:
+        for interval in range(INTERVALS):
+            end = wr31Vin.sample_interval(buf, reference)
+            wr31Vin.send_up_stats(buf, when=end)
+            reference = wr31Vin.lastReading
+        uploader.flush()
+        store.flush()
+        print '\n{0} readings stored in the history'.format(store.stats()['readings'])
+    finally:
+        shutil.rmtree(directory)
+
+    stats = uploader.stats()
+    print '\n{0} DataPoints in {1} uploads, {2} bytes'.format(
+        stats['points'], stats['batches'], stats['bytes_sent'])
+    raw = [upload for upload in idigidata.uploads if 'wr31vin/raw' in upload[1]]
+    print '{0} upload(s) with raw readings'.format(len(raw))
@@ -0,0 +1,189 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Run taskhost.TaskHost with simulated leaking tasks, once without and once
+with the watchdog: a task starting a thread per run that never ends, one
+keeping memory, one opening CLI sessions it never closes, one that starts
+failing every run, and a well-behaved one. Report how the process grew,
+and which tasks the watchdog restarted and why. Then restart each of the
+real make_task() tasks a few times, and check that the threads and
+sessions of the tasks replaced are released.
+
+Usage:      From the WR31 directory
+            > PYTHONPATH=sim:.:.. python sim/wdsim.py [seconds per run]
+            The real cell task needs ../read_sim.py on the path.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+import dpupload
+import sarcli
+import taskhost
+import watchdog
+
+PERIOD = 0.05  # seconds between runs of each task
+CHECK_INTERVAL = 0.5  # seconds between watchdog checks
+CHUNK = 256 * 1024  # bytes kept per run by the memory leak
+
+
+class ThreadLeak(taskhost.Task):
+    """
+    Starts a thread per run that waits for a reply that never comes
+    """
+    name = 'threads'
+    period = PERIOD
+
+    def __init__(self):
+        self.reply = threading.Event()
+        self.runs = 0
+
+    def run(self, now):
+        self.runs += 1
+        if self.runs % 4 == 0:
+            thread = threading.Thread(target=self.reply.wait)
+            thread.setDaemon(True)
+            thread.start()
+
+    def close(self):
+        self.reply.set()
+
+
+class MemoryLeak(taskhost.Task):
+    """
+    Keeps a buffer from every run
+    """
+    name = 'memory'
+    period = PERIOD
+
+    def __init__(self):
+        self.kept = []
+
+    def run(self, now):
+        self.kept.append('x' * CHUNK)
+
+
+class SessionLeak(taskhost.Task):
+    """
+    Opens a CLI session every few runs and loses it on an error path
+    """
+    name = 'sessions'
+    period = PERIOD
+
+    def __init__(self):
+        self.sessions = []
+        self.runs = 0
+
+    def run(self, now):
+        self.runs += 1
+        if self.runs % 10 == 0:
+            self.sessions.append(sarcli.open())
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+
+class Failing(taskhost.Task):
+    """
+    Works for a while, then fails every run
+    """
+    name = 'failing'
+    period = 0.25
+
+    def __init__(self):
+        self.runs = 0
+
+    def run(self, now):
+        self.runs += 1
+        if self.runs > 8:
+            raise IOError('simulated stuck device')
+
+
+class Steady(taskhost.Task):
+    name = 'steady'
+    period = PERIOD
+
+
+TASKS = [ThreadLeak, MemoryLeak, SessionLeak, Failing, Steady]
+REAL_RESTARTS = 5  # restarts of each real task
+
+
+def run(duration, dog=None):
+    sarcli.reset()
+    host = taskhost.TaskHost(dog)
+    for factory in TASKS:
+        host.add(factory(), factory=factory)
+    if dog is not None:
+        host.add(taskhost.WatchdogTask(dog, CHECK_INTERVAL), CHECK_INTERVAL)
+    start = watchdog.usage()
+    host.run(duration)
+    end = watchdog.usage()
+    for task in host.tasks:
+        task.close()
+    return host, start, end
+
+
+def restart_real(restarts=REAL_RESTARTS, duration=1.0):
+    """
+    Run the taskhost tasks, restart each of them restarts times, and
+    :return start, end: usage() before and after the restarts
+    """
+    host = taskhost.TaskHost(watchdog.Watchdog(dpupload.DataPointUploader()))
+    for name in taskhost.TASKS:
+        host.add(taskhost.make_task(name), factory=lambda name=name: taskhost.make_task(name, setup=False))
+    host.run(duration)
+    start = watchdog.usage()
+    for x in range(restarts):
+        for name in taskhost.TASKS:
+            host.restart(name)
+        host.run(duration / restarts)
+    end = watchdog.usage()
+    return start, end
+
+
+def growth(start, end):
+    rss = 'n/a'
+    if start['rss'] is not None:
+        rss = '{0:+d} kB'.format(end['rss'] - start['rss'])
+    return 'RSS {0}, {1} threads, {2} CLI sessions'.format(rss, end['threads'], end['sessions'])
+
+
+if __name__ == '__main__':
+    duration = len(sys.argv) > 1 and float(sys.argv[1]) or 10.0
+    taskhost.HEARTBEAT_MIN = 1.0
+
+    print('Without the watchdog, {0} s'.format(duration))
+    host, start, end = run(duration)
+    print('  ' + growth(start, end))
+
+    print('With the watchdog, {0} s'.format(duration))
+    base = watchdog.usage()
+    dog = watchdog.Watchdog(dpupload.DataPointUploader(), rss_limit=base['rss'] and base['rss'] + 8 * 1024,
+                            thread_limit=base['threads'] + 8, session_limit=3, holdoff=2.0)
+    host, start, end = run(duration, dog)
+    print('  ' + growth(start, end))
+    host.print_stats()
+    stats = dog.stats()
+    print('{0} checks, {1} restarts, {2} alerts, {3} DataPoints queued'.format(
+        stats['checks'], stats['restarts'], stats['alerts'], dog.uploader.stats()['queued']))
+
+    print('Restarting each of the {0} tasks {1} times'.format(', '.join(taskhost.TASKS), REAL_RESTARTS))
+    # The tasks keep their history and spool files in the current directory
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    try:
+        start, end = restart_real()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    print('  threads {0} before, {1} after, CLI sessions {2} before, {3} after'.format(
+        start['threads'], end['threads'], start['sessions'], end['sessions']))
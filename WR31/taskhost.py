@@ -0,0 +1,426 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Run door monitoring, Vin sampling, GPS reporting and cellular health
+sampling in one process.
+
+Each application is a task with its own period, kept on a heap ordered by
+deadline and run in turn on the main thread. The tasks share the clisess
+CLI sessions, the wr31io readers and the dpupload uploader, which sends on
+a thread of its own so a slow uplink never delays a deadline.
+
+For each task the scheduler tracks how late it started (drift), how long
+it ran, how often a run took longer than its period (overrun) and how
+many deadlines were skipped after falling more than a period behind.
+
+With the watchdog on, the resources used by each run are charged to its
+task, each completed run is a heartbeat, and a stuck or leaking task is
+closed and built anew from make_task(), on the same timeline, see
+watchdog.py.
+
+Usage:      > python taskhost.py [door] [vin] [gps] [cell] [-T<seconds to run>] [-N] [-I]
+            -N runs without the watchdog. -I records CLI and upload call
+            statistics, printed on SIGUSR1 and at exit, and uploaded every
+            instr.UPLOAD_INTERVAL seconds, see instr.py.
+            With no task names, all of them run. The cell task needs
+            ../read_sim.py, uploaded with the rest. Off-device:
+            > PYTHONPATH=sim:.:.. python taskhost.py -T10
+"""
+
+import heapq
+import sys
+import threading
+import time
+
+import dpupload
+import ticker
+import watchdog
+
+try:
+    import instr
+except ImportError:
+    # Call statistics are optional, upload instr.py to have them
+    instr = None
+
+STATS_INTERVAL = 300  # seconds between stats printouts
+UPLINK_INTERVAL = 1.0  # seconds between uploader polls
+TASKS = ['door', 'vin', 'gps', 'cell']
+HEARTBEAT_PERIODS = 5  # periods without a completed run before a task is stuck
+HEARTBEAT_MIN = 120  # seconds, shortest heartbeat timeout
+CLOSE_TIMEOUT = 1.0  # seconds a closing task waits for its queued alerts
+
+
+class Task(object):
+    """
+    Base task, run every period seconds
+    """
+    name = 'task'
+    period = 1.0
+
+    def run(self, now):
+        pass
+
+    def close(self):
+        """
+        Release what the task holds, before the watchdog replaces it
+        """
+        pass
+
+
+class DoorTask(Task):
+    """
+    doormon.DoorMonitor, polled at its adaptive interval
+    """
+    name = 'door'
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+    @property
+    def period(self):
+        return self.monitor.interval
+
+    def run(self, now):
+        self.monitor.poll()
+
+    def close(self):
+        # Deliver what is queued, then end the alert worker threads, which
+        # the new monitor replaces with its own
+        for dispatcher in (self.monitor.dispatcher, self.monitor.heartbeats):
+            if dispatcher is not None:
+                dispatcher.wait_idle(CLOSE_TIMEOUT)
+                dispatcher.stop()
+
+
+class VinTask(Task):
+    """
+    wr31Vin readings, one per readInterval, or sampleRate readings a second
+    with the aggregates sent every readInterval
+    """
+    name = 'vin'
+
+    def __init__(self):
+        import wr31Vin
+        self.vin = wr31Vin
+        self.buf = None
+        self.reference = None
+        self.interval_end = None
+        if wr31Vin.sampleRate:
+            self.buf = wr31Vin.VinBuffer(wr31Vin.bufferSize)
+
+    @property
+    def period(self):
+        if self.buf is not None:
+            return 1.0 / self.vin.sampleRate
+        return self.vin.readInterval
+
+    def run(self, now):
+        if self.buf is None:
+            self.vin.send_up_data(poll=False)
+            return
+        if self.interval_end is None:
+            self.interval_end = now + self.vin.readInterval
+        self.vin.take_reading(self.buf, self.reference)
+        if now >= self.interval_end:
+            self.vin.send_up_stats(self.buf, poll=False)
+            self.reference = self.vin.lastReading
+            self.interval_end += self.vin.readInterval
+
+
+class GpsTask(Task):
+    """
+    gps2drm.GpsReporter sampling, queueing a track when one is due
+    """
+    name = 'gps'
+
+    def __init__(self, reporter, period):
+        self.reporter = reporter
+        self.period = period
+
+    def run(self, now):
+        self.reporter.sample()
+        if self.reporter.due():
+            self.reporter.flush(send=False)
+
+    def close(self):
+        # Queue the track so far, the new reporter starts an empty one
+        self.reporter.flush(send=False)
+
+
+class CellTask(Task):
+    """
+    cellmon.CellMonitor, reading the modem status every period
+    """
+    name = 'cell'
+
+    def __init__(self, monitor, period):
+        self.monitor = monitor
+        self.period = period
+
+    def run(self, now):
+        self.monitor.sample()
+
+
+class WatchdogTask(Task):
+    """
+    watchdog.Watchdog checks, on the host thread between task runs
+    """
+    name = 'watchdog'
+
+    def __init__(self, dog, period):
+        self.dog = dog
+        self.period = period
+
+    def run(self, now):
+        self.dog.check()
+
+
+class TaskHost(object):
+    """
+    Runs tasks on one thread in deadline order
+    """
+    def __init__(self, dog=None):
+        self.heap = []  # (deadline, sequence, task)
+        self.sequence = 0
+        self.tasks = []
+        self.factories = {}
+        self.counters = {}
+        self.running = True
+        self.dog = dog
+
+    def add(self, task, delay=0.0, factory=None):
+        """
+        :param factory: callable() returning a new task to replace this one
+            when the watchdog restarts it, None to never restart it
+        """
+        self.tasks.append(task)
+        self.counters[task.name] = {
+            'runs': 0,
+            'errors': 0,
+            'overruns': 0,
+            'skipped': 0,
+            'restarts': 0,
+            'late_total': 0.0,
+            'late_max': 0.0,
+            'run_total': 0.0,
+            'run_max': 0.0,
+        }
+        if factory is not None and self.dog is not None:
+            self.factories[task.name] = factory
+            timeout = max(HEARTBEAT_MIN, HEARTBEAT_PERIODS * task.period)
+            self.dog.watch(task.name, timeout, lambda name=task.name: self.restart(name))
+        self.schedule(task, ticker.monotonic() + delay)
+
+    def restart(self, name):
+        """
+        Close a task and put a new one from its factory in its place, on the
+        same timeline. Called between runs, by the watchdog task.
+        """
+        old = [task for task in self.tasks if task.name == name][0]
+        try:
+            old.close()
+        except Exception as err:
+            print('{0} task failed to close: {1}'.format(name, err))
+        task = self.factories[name]()
+        self.tasks[self.tasks.index(old)] = task
+        # (deadline, sequence) is unique, so swapping the task keeps the heap
+        self.heap = [(deadline, sequence, entry is old and task or entry)
+                     for deadline, sequence, entry in self.heap]
+        self.counters[name]['restarts'] += 1
+
+    def schedule(self, task, deadline):
+        self.sequence += 1
+        heapq.heappush(self.heap, (deadline, self.sequence, task))
+
+    def run_next(self):
+        """
+        Wait for the earliest deadline and run its task
+        """
+        deadline, sequence, task = heapq.heappop(self.heap)
+        delay = deadline - ticker.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        dog = self.dog
+        if dog is not None:
+            before = watchdog.usage()
+        start = ticker.monotonic()
+        try:
+            task.run(start)
+            error = False
+        except Exception as err:
+            print('{0} task failed: {1}'.format(task.name, err))
+            error = True
+        finished = ticker.monotonic()
+        if dog is not None:
+            dog.charge(task.name, before, watchdog.usage())
+            if not error:
+                dog.beat(task.name)
+        period = task.period
+
+        counters = self.counters[task.name]
+        late = start - deadline
+        elapsed = finished - start
+        counters['runs'] += 1
+        counters['errors'] += error
+        counters['late_total'] += late
+        counters['late_max'] = max(counters['late_max'], late)
+        counters['run_total'] += elapsed
+        counters['run_max'] = max(counters['run_max'], elapsed)
+        if elapsed > period:
+            counters['overruns'] += 1
+
+        # Keep to the original timeline, unless a whole period was missed
+        deadline += period
+        if deadline < finished:
+            missed = int((finished - deadline) / period) + 1
+            counters['skipped'] += missed
+            deadline += missed * period
+        self.schedule(task, deadline)
+
+    def run(self, duration=None):
+        """
+        Run tasks until stop(), or for duration seconds
+        """
+        end = duration and ticker.monotonic() + duration
+        next_stats = ticker.monotonic() + STATS_INTERVAL
+        while self.running and self.heap and not (end and self.heap[0][0] > end):
+            self.run_next()
+            if ticker.monotonic() >= next_stats:
+                self.print_stats()
+                next_stats += STATS_INTERVAL
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        """
+        :return stats: dict, Per task runs, errors, overruns, skipped
+            deadlines, and mean and max lateness and run time in seconds
+        """
+        stats = {}
+        for name, counters in self.counters.items():
+            task_stats = dict(counters)
+            runs = counters['runs'] or 1
+            task_stats['late_mean'] = counters['late_total'] / runs
+            task_stats['run_mean'] = counters['run_total'] / runs
+            stats[name] = task_stats
+        return stats
+
+    def print_stats(self):
+        print('{0:<9}{1:>8}{2:>10}{3:>10}{4:>10}{5:>10}{6:>10}{7:>9}{8:>10}'.format(
+            'task', 'runs', 'late ms', 'max ms', 'run ms', 'max ms', 'overruns', 'skipped', 'restarts'))
+        for name, task_stats in sorted(self.stats().items()):
+            print('{0:<9}{1:>8}{2:>10.1f}{3:>10.1f}{4:>10.1f}{5:>10.1f}{6:>10}{7:>9}{8:>10}'.format(
+                name, task_stats['runs'], 1000 * task_stats['late_mean'], 1000 * task_stats['late_max'],
+                1000 * task_stats['run_mean'], 1000 * task_stats['run_max'], task_stats['overruns'],
+                task_stats['skipped'], task_stats['restarts']))
+
+
+class Uplink(object):
+    """
+    Polls the shared uploader on its own thread
+    """
+    def __init__(self, interval=UPLINK_INTERVAL):
+        self.interval = interval
+        self.running = True
+        # Tasks only queue DataPoints, every send happens on this thread
+        dpupload.get_uploader().send_on_add = False
+        self.thread = threading.Thread(target=self.run, name='uplink')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def run(self):
+        uploader = dpupload.get_uploader()
+        while self.running:
+            try:
+                uploader.poll()
+            except Exception as err:
+                print('Upload failed: {0}'.format(err))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join(2 * self.interval)
+        dpupload.get_uploader().flush()
+
+
+def make_task(name, setup=True):
+    """
+    :param setup: bool, False when replacing a task, so device requests
+        are not registered again
+    """
+    if name == 'door':
+        import doormon
+        import tsstore
+        if setup:
+            tsstore.register_requests()
+        return DoorTask(doormon.DoorMonitor([doormon.DatapointAlert("WR31_door")],
+                                            store=tsstore.get_store('d1')))
+    if name == 'vin':
+        import tsstore
+        import wr31Vin
+        if setup:
+            wr31Vin.analog.set_mode('voltage')
+            if wr31Vin.keepHistory:
+                tsstore.register_requests()
+            dpupload.get_uploader().max_age = wr31Vin.uploadInterval
+        return VinTask()
+    if name == 'gps':
+        import cbpool
+        import gps2drm
+        if setup:
+            cbpool.register_callback("reportgps", gps2drm.report)
+        else:
+            # reportgps requests are answered from the new reporter
+            gps2drm.reporter = gps2drm.GpsReporter()
+        return GpsTask(gps2drm.reporter, gps2drm.SAMPLE_INTERVAL)
+    if name == 'cell':
+        import cellmon
+        return CellTask(cellmon.CellMonitor(), cellmon.SAMPLE_INTERVAL)
+    raise ValueError('Unknown task: {0}'.format(name))
+
+
+if __name__ == '__main__':
+    names = []
+    duration = None
+    use_watchdog = True
+    for arg in sys.argv[1:]:
+        if arg.upper().startswith('-T'):
+            duration = float(arg[2:])
+        elif arg.upper() == '-N':
+            use_watchdog = False
+        elif arg.upper() == '-I':
+            if instr is None:
+                print('-I needs instr.py, running without call statistics')
+            else:
+                instr.enable()
+        elif arg in TASKS:
+            names.append(arg)
+        else:
+            print(__doc__)
+            sys.exit(1)
+
+    dog = use_watchdog and watchdog.Watchdog() or None
+    host = TaskHost(dog)
+    for name in names or TASKS:
+        host.add(make_task(name), factory=lambda name=name: make_task(name, setup=False))
+        print('Started {0} task'.format(name))
+    if dog is not None:
+        host.add(WatchdogTask(dog, watchdog.CHECK_INTERVAL), watchdog.CHECK_INTERVAL)
+    if instr is not None and instr.enabled:
+        instr.install_signal()
+        instr.start_upload()
+    uplink = Uplink()
+    try:
+        host.run(duration)
+    finally:
+        uplink.stop()
+        host.print_stats()
+        if instr is not None and instr.enabled:
+            instr.print_summary()
+        if 'tsstore' in sys.modules:
+            sys.modules['tsstore'].flush_all()
@@ -0,0 +1,137 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Periodic timer for loops that must keep a fixed rate.
+
+Sleeping a fixed interval after the work makes the real period the
+interval plus however long the work took. A Ticker sleeps until absolute
+deadlines instead, start + n * period, so the work time does not add up.
+
+When a tick is missed because the work ran longer than a period, the
+SKIP policy drops the missed ticks and waits for the next deadline on the
+timeline, while CATCH_UP returns at once for each missed tick until the
+loop is back on time. How late each wake-up was is kept in a histogram.
+
+The clock is time.monotonic() where Python has it. Otherwise time.time()
+is used, and a step of the wall clock (NTP or cellular network time) is
+detected as a jump of more than CLOCK_STEP seconds past the deadline, or
+backwards, and the timeline restarted from it.
+
+Usage:
+    import ticker
+    timer = ticker.Ticker(60)
+    while True:
+        send_up_data()
+        timer.wait()
+"""
+
+import time
+
+SKIP = 'skip'
+CATCH_UP = 'catchup'
+LATENESS_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0]  # seconds, upper bounds
+CLOCK_STEP = 60.0  # seconds, lateness beyond this plus a period is a clock step
+
+try:
+    monotonic = time.monotonic
+    MONOTONIC = True
+except AttributeError:
+    monotonic = time.time
+    MONOTONIC = False
+
+
+class Ticker(object):
+    """
+    Sleeps until deadlines period seconds apart
+    """
+    def __init__(self, period, policy=SKIP, buckets=LATENESS_BUCKETS):
+        if policy not in (SKIP, CATCH_UP):
+            raise ValueError('Unknown policy: {0}'.format(policy))
+        self.period = float(period)
+        self.policy = policy
+        self.buckets = buckets
+        self.deadline = monotonic() + self.period
+        self.histogram = [0] * (len(buckets) + 1)
+        self.ticks = 0
+        self.missed = 0
+        self.resyncs = 0
+        self.late_total = 0.0
+        self.late_max = 0.0
+
+    def restart(self):
+        """
+        Start a new timeline, with the next deadline a period from now
+        """
+        self.deadline = monotonic() + self.period
+
+    def wait(self):
+        """
+        Sleep until the next deadline
+        :return behind: int, Whole periods behind the timeline, 0 when on
+            time. With SKIP these ticks were dropped, with CATCH_UP they
+            are still to come, each without sleeping.
+        """
+        now = monotonic()
+        if not MONOTONIC and (now < self.deadline - self.period or
+                              now > self.deadline + self.period + CLOCK_STEP):
+            # The wall clock was stepped, so the timeline means nothing
+            self.resyncs += 1
+            self.deadline = now + self.period
+        behind = 0
+        if now >= self.deadline + self.period:
+            behind = int((now - self.deadline) / self.period)
+            if self.policy == SKIP:
+                self.missed += behind
+                self.deadline += behind * self.period
+        delay = self.deadline - now
+        if delay > 0:
+            time.sleep(delay)
+        self.record(monotonic() - self.deadline)
+        self.deadline += self.period
+        return behind
+
+    def record(self, late):
+        late = max(0.0, late)
+        self.ticks += 1
+        self.late_total += late
+        self.late_max = max(self.late_max, late)
+        for index, bound in enumerate(self.buckets):
+            if late <= bound:
+                self.histogram[index] += 1
+                return
+        self.histogram[-1] += 1
+
+    def histogram_labels(self):
+        labels = ['<={0:g}ms'.format(1000 * bound) for bound in self.buckets]
+        labels.append('>{0:g}ms'.format(1000 * self.buckets[-1]))
+        return labels
+
+    def stats(self):
+        """
+        :return stats: dict, Ticks, ticks skipped, clock resyncs, mean and max
+            lateness in seconds, and the lateness histogram by bucket label
+        """
+        return {
+            'period': self.period,
+            'policy': self.policy,
+            'ticks': self.ticks,
+            'missed': self.missed,
+            'resyncs': self.resyncs,
+            'late_mean': self.ticks and self.late_total / self.ticks or 0.0,
+            'late_max': self.late_max,
+            'histogram': dict(zip(self.histogram_labels(), self.histogram)),
+        }
+
+    def format_histogram(self):
+        """
+        :return text: str, One line per bucket that has ticks
+        """
+        lines = []
+        for label, count in zip(self.histogram_labels(), self.histogram):
+            if count:
+                lines.append('{0:>10} {1:>7} {2}'.format(label, count, '#' * max(1, 40 * count // self.ticks)))
+        return '\n'.join(lines)
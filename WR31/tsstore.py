@@ -0,0 +1,455 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+Append-only time-series store on flash, for GPIO and Vin samples.
+
+Each series is kept in segment files of fixed-width binary records, so days
+of high-resolution readings fit on the router and only what is asked for
+has to be uploaded. A segment starts with a HEADER holding the base time,
+followed by RECORD entries, a millisecond offset from the base time and a
+float value, 8 bytes per reading. Segment names are 8.3, a series prefix of
+up to three characters and a sequence number, e.g. vin00012.ts.
+
+Readings are buffered and written FLUSH_RECORDS at a time, or every
+FLUSH_INTERVAL seconds, to spare the flash. A segment is closed after
+SEGMENT_RECORDS readings, and the oldest is removed when there are more
+than MAX_SEGMENTS.
+
+The first and last time of every segment are kept in memory as the index,
+rebuilt from the segment files on start. A range query opens only the
+segments that overlap it, and finds its first record with a binary search,
+since the records are in time order and of fixed width.
+
+A device request to REQUEST_TARGET answers queries with JSON, e.g.
+    {"series": "vin", "start": 1500000000, "end": 1500086400, "bucket": 3600}
+returns count, min, max and mean per hour. Without "bucket" the readings
+themselves are returned, up to "limit", and with "stream" they are also
+queued for upload, with their own timestamps, to that data stream. They
+are sent by the next dpupload poll(), after the response, as an upload
+from within a device request waits for the request to end.
+
+Usage:
+    import tsstore
+    store = tsstore.get_store('vin')
+    store.append(12.034)
+    store.aggregate(time.time() - 86400, time.time(), 3600)
+Or, on the router, to print hourly aggregates for the last day:
+    > python tsstore.py vin 86400 3600
+"""
+
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+HEADER = struct.Struct('<4sd')  # magic, base time in seconds
+RECORD = struct.Struct('<If')  # milliseconds from the base time, value
+MAGIC = 'TSS1'
+STORE_DIR = ''  # Directory for segment files, '' for the current directory
+SEGMENT_SUFFIX = '.ts'
+SEGMENT_RECORDS = 16384  # Readings per segment, 128 KB
+MAX_SEGMENTS = 40  # Segments kept per series, the oldest is removed when full
+MAX_OFFSET = 0xFFFFFFFF  # milliseconds, a segment spans at most 49 days
+FLUSH_RECORDS = 64  # Buffered readings written together
+FLUSH_INTERVAL = 60  # seconds, longest a reading stays buffered
+READ_CHUNK = 1024  # Records read at a time by queries
+QUERY_LIMIT = 1000  # Readings returned by a device request without a bucket
+REQUEST_TARGET = 'tsquery'
+
+
+class StoreError(Exception):
+    pass
+
+
+class Segment(object):
+    """
+    Index entry for one segment file
+    """
+    def __init__(self, path, sequence, base, count=0, first=None, last=None):
+        self.path = path
+        self.sequence = sequence
+        self.base = base
+        self.count = count
+        self.first = first
+        self.last = last
+
+    def offset(self, index):
+        return HEADER.size + index * RECORD.size
+
+    def read(self, handle, index, count=1):
+        """
+        :return records: list of (time, value)
+        """
+        handle.seek(self.offset(index))
+        data = handle.read(count * RECORD.size)
+        count = len(data) // RECORD.size
+        values = struct.unpack('<' + 'If' * count, data[:count * RECORD.size])
+        base = self.base
+        return [(base + values[i] / 1000.0, values[i + 1]) for i in range(0, 2 * count, 2)]
+
+    def bisect(self, handle, when):
+        """
+        :return index: int, First record at or after when
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.read(handle, middle)[0][0] < when:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class TimeSeriesStore(object):
+    """
+    One series of (time, value) readings, in segment files
+    """
+    def __init__(self, series, directory=STORE_DIR, segment_records=SEGMENT_RECORDS,
+                 max_segments=MAX_SEGMENTS, flush_records=FLUSH_RECORDS,
+                 flush_interval=FLUSH_INTERVAL):
+        if not series or len(series) > 3 or not series.isalnum():
+            raise StoreError('Series name must be 1 to 3 letters or digits: {0}'.format(series))
+        self.series = series
+        self.directory = directory
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.segments = []  # Segment, oldest first
+        self.pending = []  # (time, value) not yet written
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+        self.counters = {
+            'appended': 0,
+            'written': 0,
+            'flushes': 0,
+            'rotations': 0,
+            'removed': 0,
+            'queries': 0,
+        }
+        self.load()
+
+    def segment_path(self, sequence):
+        return os.path.join(self.directory, '{0}{1:05d}{2}'.format(
+            self.series, sequence % 100000, SEGMENT_SUFFIX))
+
+    def load(self):
+        """
+        Build the index from the segment files on flash
+        """
+        prefix = self.series
+        names = [name for name in os.listdir(self.directory or '.')
+                 if name.startswith(prefix) and name.endswith(SEGMENT_SUFFIX) and
+                 name[len(prefix):-len(SEGMENT_SUFFIX)].isdigit()]
+        names.sort()
+        for name in names:
+            path = os.path.join(self.directory, name)
+            handle = open(path, 'rb')
+            try:
+                header = handle.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    continue
+                magic, base = HEADER.unpack(header)
+                if magic != MAGIC:
+                    print 'Skipping {0}, not a segment file'.format(path)
+                    continue
+                handle.seek(0, 2)
+                # A partly written last record, from a power cut, is ignored
+                count = (handle.tell() - HEADER.size) // RECORD.size
+                segment = Segment(path, int(name[len(prefix):-len(SEGMENT_SUFFIX)]), base, count)
+                if count:
+                    segment.first = segment.read(handle, 0)[0][0]
+                    segment.last = segment.read(handle, count - 1)[0][0]
+                self.segments.append(segment)
+            finally:
+                handle.close()
+
+    def append(self, value, when=None):
+        """
+        Add a reading, written to flash with the next flush
+        :param value: float
+        :param when: float, Seconds since the epoch, defaults to now
+        """
+        if when is None:
+            when = time.time()
+        self.lock.acquire()
+        try:
+            last = None
+            if self.pending:
+                last = self.pending[-1][0]
+            elif self.segments:
+                last = self.segments[-1].last
+            if last is not None and when < last:
+                # Keep the records in time order, a clock stepped back is
+                # stored as no time passing
+                when = last
+            self.pending.append((when, float(value)))
+            self.counters['appended'] += 1
+            if len(self.pending) >= self.flush_records or \
+                    time.time() - self.last_flush >= self.flush_interval:
+                self.write_pending()
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self.write_pending()
+        finally:
+            self.lock.release()
+
+    def write_pending(self):
+        """
+        Write the buffered readings, starting segments as needed. Called
+        with the lock held.
+        """
+        self.last_flush = time.time()
+        pending = self.pending
+        if not pending:
+            return
+        self.pending = []
+        while pending:
+            segment = self.segments and self.segments[-1]
+            if not segment or segment.count >= self.segment_records or \
+                    (pending[0][0] - segment.base) * 1000 > MAX_OFFSET:
+                segment = self.start_segment(pending[0][0])
+            room = self.segment_records - segment.count
+            batch = []
+            for when, value in pending[:room]:
+                offset = int(round((when - segment.base) * 1000))
+                if offset > MAX_OFFSET:
+                    break
+                batch.append((offset, value))
+            pending = pending[len(batch):]
+            values = []
+            for record in batch:
+                values.extend(record)
+            handle = open(segment.path, 'r+b')
+            try:
+                # Drop any partly written record left by a power cut
+                handle.seek(segment.offset(segment.count))
+                handle.truncate()
+                handle.write(struct.pack('<' + 'If' * len(batch), *values))
+            finally:
+                handle.close()
+            if segment.first is None:
+                segment.first = segment.base + batch[0][0] / 1000.0
+            segment.last = segment.base + batch[-1][0] / 1000.0
+            segment.count += len(batch)
+            self.counters['written'] += len(batch)
+        self.counters['flushes'] += 1
+
+    def start_segment(self, base):
+        sequence = self.segments and self.segments[-1].sequence + 1 or 1
+        segment = Segment(self.segment_path(sequence), sequence, base)
+        handle = open(segment.path, 'wb')
+        try:
+            handle.write(HEADER.pack(MAGIC, base))
+        finally:
+            handle.close()
+        self.segments.append(segment)
+        self.counters['rotations'] += 1
+        while len(self.segments) > self.max_segments:
+            oldest = self.segments.pop(0)
+            try:
+                os.remove(oldest.path)
+            except OSError as err:
+                print 'Could not remove {0}: {1}'.format(oldest.path, err)
+            self.counters['removed'] += 1
+        return segment
+
+    def iterate(self, start=None, end=None):
+        """
+        Readings from start up to, but not including, end, oldest first.
+        Flushes first, so buffered readings are included.
+        """
+        self.flush()
+        self.lock.acquire()
+        try:
+            self.counters['queries'] += 1
+            segments = [segment for segment in self.segments if segment.count and
+                        (start is None or segment.last >= start) and
+                        (end is None or segment.first < end)]
+            # Snapshot the counts, so readings appended while iterating are
+            # left for the next query
+            counts = [segment.count for segment in segments]
+        finally:
+            self.lock.release()
+        for segment, count in zip(segments, counts):
+            try:
+                handle = open(segment.path, 'rb')
+            except IOError:
+                # Removed by a rotation since the snapshot
+                continue
+            try:
+                index = 0
+                if start is not None and segment.first < start:
+                    index = segment.bisect(handle, start)
+                while index < count:
+                    records = segment.read(handle, index, min(READ_CHUNK, count - index))
+                    if not records:
+                        break
+                    index += len(records)
+                    for record in records:
+                        if end is not None and record[0] >= end:
+                            return
+                        yield record
+            finally:
+                handle.close()
+
+    def query(self, start=None, end=None, limit=None):
+        """
+        :return readings: list of (time, value), at most limit
+        """
+        readings = []
+        for record in self.iterate(start, end):
+            readings.append(record)
+            if limit and len(readings) >= limit:
+                break
+        return readings
+
+    def aggregate(self, start=None, end=None, bucket=None):
+        """
+        Count, min, max and mean of the readings in [start, end)
+        :param bucket: float, Seconds per bucket, None for one over the range.
+            Buckets start from start, or from the epoch when start is None.
+        :return aggregates: list of dict, One per bucket that has readings,
+            with 'start', 'count', 'min', 'max' and 'mean'
+        """
+        buckets = {}
+        origin = start or 0.0
+        for when, value in self.iterate(start, end):
+            key = bucket and int((when - origin) // bucket) or 0
+            totals = buckets.get(key)
+            if totals is None:
+                buckets[key] = [1, value, value, value]
+                continue
+            totals[0] += 1
+            totals[1] = min(totals[1], value)
+            totals[2] = max(totals[2], value)
+            totals[3] += value
+        aggregates = []
+        for key in sorted(buckets):
+            count, low, high, total = buckets[key]
+            aggregates.append({
+                'start': bucket and origin + key * bucket or start,
+                'count': count,
+                'min': low,
+                'max': high,
+                'mean': total / count,
+            })
+        return aggregates
+
+    def stats(self):
+        """
+        :return stats: dict, Counters, segments, readings kept and their
+            time range, and bytes on flash
+        """
+        self.lock.acquire()
+        try:
+            stats = dict(self.counters)
+            kept = [segment for segment in self.segments if segment.count]
+            stats['segments'] = len(self.segments)
+            stats['readings'] = sum([segment.count for segment in self.segments]) + len(self.pending)
+            stats['pending'] = len(self.pending)
+            stats['bytes'] = sum([segment.offset(segment.count) for segment in self.segments])
+            stats['first'] = kept and kept[0].first or None
+            stats['last'] = kept and kept[-1].last or None
+            return stats
+        finally:
+            self.lock.release()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(series, directory=STORE_DIR):
+    """
+    Return the shared store for a series, opening it on first use
+    :return store: TimeSeriesStore
+    """
+    _stores_lock.acquire()
+    try:
+        store = _stores.get(series)
+        if store is None:
+            store = _stores[series] = TimeSeriesStore(series, directory)
+        return store
+    finally:
+        _stores_lock.release()
+
+
+def flush_all():
+    for store in list(_stores.values()):
+        store.flush()
+
+
+def answer(request):
+    """
+    Run a query
+    :param request: dict, 'series', and optional 'start', 'end' (seconds
+        since the epoch), 'bucket' (seconds), 'limit' and 'stream'
+    :return response: dict
+    """
+    series = request.get('series')
+    if series not in _stores:
+        return {'error': 'unknown series: {0}'.format(series)}
+    store = _stores[series]
+    start = request.get('start')
+    end = request.get('end')
+    bucket = request.get('bucket')
+    if bucket:
+        return {'series': series, 'bucket': bucket, 'aggregates': store.aggregate(start, end, bucket)}
+    readings = store.query(start, end, int(request.get('limit') or QUERY_LIMIT))
+    stream = request.get('stream')
+    if stream:
+        import dpupload
+        uploader = dpupload.get_uploader()
+        for when, value in readings:
+            uploader.add(stream, value, data_type='float', timestamp=int(when * 1000), send=False)
+    return {'series': series, 'count': len(readings),
+            'readings': [[round(when, 3), value] for when, value in readings]}
+
+
+def request_callback(target, data):
+    """
+    Device request callback, the request and response are JSON
+    """
+    try:
+        request = json.loads(data)
+    except ValueError as err:
+        return json.dumps({'error': 'bad request: {0}'.format(err)})
+    return json.dumps(answer(request))
+
+
+def register_requests(target=REQUEST_TARGET):
+    """
+    Answer queries sent as device requests, on the shared callback pool
+    """
+    import cbpool
+    # Queries of different ranges must not share a response
+    return cbpool.register_callback(target, request_callback, coalesce=False)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    store = get_store(sys.argv[1])
+    span = len(sys.argv) > 2 and float(sys.argv[2]) or 86400
+    bucket = len(sys.argv) > 3 and float(sys.argv[3]) or 3600
+    stats = store.stats()
+    print '{0}: {1} readings in {2} segments, {3} bytes'.format(
+        store.series, stats['readings'], stats['segments'], stats['bytes'])
+    end = time.time()
+    for row in store.aggregate(end - span, end, bucket):
+        print '{0}  {1:>7}  min {2:.4f}  max {3:.4f}  mean {4:.4f}'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['start'])),
+            row['count'], row['min'], row['max'], row['mean'])
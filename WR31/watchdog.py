@@ -0,0 +1,311 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+In-process resource watchdog for the long-running WR31 applications.
+
+Every CHECK_INTERVAL seconds the watchdog reads the process RSS from
+/proc/self/status (where there is one), the number of Python threads and
+the number of open CLI sessions, and the age of each watched task's last
+heartbeat. They are uploaded to watchdog/<metric> and
+watchdog/heartbeat/<task> through rptfilt filters, so a steady process
+sends little.
+
+A task that has not beaten for its timeout is stuck and is restarted. When
+a resource is over its limit, the task charged with the most growth of it
+is restarted, rather than the whole router. The host measures the
+resources before and after each run of a task and charges the difference
+to it. Each restart is uploaded to watchdog/alert, and a task is not
+restarted again within RESTART_HOLDOFF seconds.
+
+A Python thread can not be stopped from outside, so a restart is a
+callable from the host: taskhost.py closes the task and builds a new one
+between runs.
+
+Usage:
+    import watchdog
+    dog = watchdog.Watchdog()
+    dog.watch('vin', timeout=300, restart=restart_vin)
+    dog.start()
+    while True:
+        before = watchdog.usage()
+        take_reading()
+        dog.charge('vin', before, watchdog.usage())
+        dog.beat('vin')
+
+    > python watchdog.py
+    prints the resources used by a Python process on this router.
+"""
+
+import threading
+import time
+
+import clisess
+import dpupload
+import rptfilt
+import sarcli
+import ticker
+
+CHECK_INTERVAL = 60  # seconds between checks
+RSS_LIMIT = 24 * 1024  # kB
+THREAD_LIMIT = 16
+SESSION_LIMIT = 4  # open CLI sessions
+RESTART_HOLDOFF = 600  # seconds before the same task is restarted again
+MAX_SILENCE = 3600  # seconds, longest time a metric is not uploaded
+RSS_DEADBAND = 256  # kB
+STATUS_PATH = '/proc/self/status'
+STREAM_PREFIX = 'watchdog/'
+ALERT_STREAM = 'watchdog/alert'
+RESOURCES = ['rss', 'threads', 'sessions']
+UNITS = {'rss': 'kB', 'threads': None, 'sessions': None}
+
+
+def read_rss(path=STATUS_PATH):
+    """
+    :return rss: int, Resident set size in kB, None without /proc
+    """
+    try:
+        status = open(path)
+    except (IOError, OSError):
+        return None
+    try:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    finally:
+        status.close()
+    return None
+
+
+def open_sessions():
+    """
+    :return sessions: int, Open sarcli sessions, counted by sarcli where it
+        can, otherwise those of the shared clisess pool
+    """
+    counter = getattr(sarcli, 'open_sessions', None)
+    if counter is not None:
+        return counter()
+    return clisess.get_pool().open_sessions()
+
+
+def usage():
+    """
+    :return usage: dict, 'rss' in kB or None, 'threads' and 'sessions'
+    """
+    return {
+        'rss': read_rss(),
+        'threads': threading.active_count(),
+        'sessions': open_sessions(),
+    }
+
+
+class Watchdog(object):
+    """
+    Tracks heartbeats and resource growth per task, and restarts the
+    offender
+    """
+    def __init__(self, uploader=None, rss_limit=RSS_LIMIT, thread_limit=THREAD_LIMIT,
+                 session_limit=SESSION_LIMIT, holdoff=RESTART_HOLDOFF, max_silence=MAX_SILENCE):
+        self.uploader = uploader or dpupload.get_uploader()
+        self.limits = {'rss': rss_limit, 'threads': thread_limit, 'sessions': session_limit}
+        self.holdoff = holdoff
+        self.max_silence = max_silence
+        self.filters = {
+            'rss': rptfilt.Deadband(RSS_DEADBAND, max_silence),
+            'threads': rptfilt.OnChange(max_silence),
+            'sessions': rptfilt.OnChange(max_silence),
+        }
+        self.tasks = {}
+        self.over = set()  # resources over their limit at the last check
+        self.latest = None
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.counters = {
+            'checks': 0,
+            'restarts': 0,
+            'alerts': 0,
+        }
+
+    def watch(self, name, timeout=None, restart=None):
+        """
+        :param name: str, Task name
+        :param timeout: float, seconds without a heartbeat before the task
+            is stuck, None to only report its heartbeat age
+        :param restart: callable() restarting the task, None to only alert
+        """
+        self.lock.acquire()
+        try:
+            self.tasks[name] = {
+                'timeout': timeout,
+                'restart': restart,
+                'beat': ticker.monotonic(),
+                'charged': dict((resource, 0) for resource in RESOURCES),
+                'restarted': None,
+                'restarts': 0,
+                'filter': rptfilt.Deadband((timeout or CHECK_INTERVAL) / 2.0, self.max_silence),
+            }
+        finally:
+            self.lock.release()
+
+    def beat(self, name):
+        """
+        Record that a task completed a run
+        """
+        task = self.tasks.get(name)
+        if task is not None:
+            task['beat'] = ticker.monotonic()
+
+    def charge(self, name, before, after):
+        """
+        Charge a task with the growth of each resource between two usage()
+        """
+        task = self.tasks.get(name)
+        if task is None:
+            return
+        self.lock.acquire()
+        try:
+            for resource in RESOURCES:
+                if before[resource] is not None and after[resource] is not None:
+                    task['charged'][resource] += after[resource] - before[resource]
+        finally:
+            self.lock.release()
+
+    def check(self):
+        """
+        Measure, queue the DataPoints due and restart stuck or leaking tasks
+        :return restarted: list of (task, reason)
+        """
+        now = ticker.monotonic()
+        when = time.time()
+        sample = usage()
+        self.latest = sample
+        self.counters['checks'] += 1
+        for resource in RESOURCES:
+            if sample[resource] is not None:
+                for point_when, point_value in self.filters[resource].offer(sample[resource], when):
+                    self.add(resource, point_value, UNITS[resource], point_when)
+
+        due = []
+        self.lock.acquire()
+        try:
+            for name, task in sorted(self.tasks.items()):
+                age = now - task['beat']
+                for point_when, point_value in task['filter'].offer(round(age, 1), when):
+                    self.add('heartbeat/' + name, point_value, 's', point_when)
+                if task['timeout'] and age > task['timeout']:
+                    due.append((name, 'no heartbeat for {0:.0f} s'.format(age)))
+            for resource in RESOURCES:
+                limit = self.limits[resource]
+                if sample[resource] is None or not limit or sample[resource] <= limit:
+                    self.over.discard(resource)
+                    continue
+                culprit = self.culprit(resource, now)
+                if culprit is not None:
+                    due.append((culprit, '{0} {1} over {2}, {3:+d} in this task'.format(
+                        resource, sample[resource], limit, self.tasks[culprit]['charged'][resource])))
+                elif resource not in self.over:
+                    self.alert('{0} {1} over {2}, no task to restart'.format(resource, sample[resource], limit))
+                self.over.add(resource)
+        finally:
+            self.lock.release()
+
+        restarted = []
+        for name, reason in due:
+            if name not in [done for done, why in restarted] and self.restart(name, reason, now):
+                restarted.append((name, reason))
+        return restarted
+
+    def culprit(self, resource, now):
+        """
+        :return name: str, Restartable task charged with the most growth of
+            resource, None if none grew it
+        """
+        best = None
+        for name, task in self.tasks.items():
+            if task['restart'] is None or self.held_off(task, now) or task['charged'][resource] <= 0:
+                continue
+            if best is None or task['charged'][resource] > self.tasks[best]['charged'][resource]:
+                best = name
+        return best
+
+    def held_off(self, task, now):
+        return task['restarted'] is not None and now - task['restarted'] < self.holdoff
+
+    def restart(self, name, reason, now=None):
+        """
+        :return restarted: bool, False if the task can not be restarted yet
+        """
+        if now is None:
+            now = ticker.monotonic()
+        task = self.tasks[name]
+        if task['restart'] is None:
+            self.alert('{0}: {1}'.format(name, reason))
+            return False
+        if self.held_off(task, now):
+            return False
+        self.alert('Restarting {0}: {1}'.format(name, reason))
+        try:
+            task['restart']()
+        except Exception as err:
+            self.alert('Restarting {0} failed: {1}'.format(name, err))
+            return False
+        task['charged'] = dict((resource, 0) for resource in RESOURCES)
+        task['beat'] = now
+        task['restarted'] = now
+        task['restarts'] += 1
+        self.counters['restarts'] += 1
+        return True
+
+    def alert(self, message):
+        print('Watchdog: {0}'.format(message))
+        self.counters['alerts'] += 1
+        self.uploader.add(ALERT_STREAM, message, data_type='string')
+
+    def add(self, metric, value, units, when):
+        self.uploader.add(STREAM_PREFIX + metric, value, data_type=isinstance(value, float) and 'float' or 'integer',
+                          units=units, timestamp=int(when * 1000))
+
+    def start(self, interval=CHECK_INTERVAL):
+        """
+        Check on a thread of its own, for applications without taskhost
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(interval,), name='watchdog')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def run(self, interval=CHECK_INTERVAL):
+        timer = ticker.Ticker(interval)
+        while self.running:
+            try:
+                self.check()
+            except Exception as err:
+                print('Watchdog check failed: {0}'.format(err))
+            timer.wait()
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        """
+        :return stats: dict, Checks, restarts and alerts, the latest
+            usage(), and per task the restarts and resources charged
+        """
+        stats = dict(self.counters)
+        stats['usage'] = self.latest
+        stats['tasks'] = {}
+        for name, task in self.tasks.items():
+            task_stats = dict(task['charged'])
+            task_stats['restarts'] = task['restarts']
+            stats['tasks'][name] = task_stats
+        return stats
+
+
+if __name__ == '__main__':
+    sample = usage()
+    for resource in RESOURCES:
+        print('{0:<10}{1}'.format(resource, sample[resource]))
@@ -9,7 +9,8 @@
 ############################################################################
 
 """
-CLI approach to reading Voltage input on a WR31 router.
+Reading Voltage input on a WR31 router, through digihw when available,
+otherwise the CLI.
 The following script assumes a 681K 1% resistor tied between
 Power In (Vin) and the Analog Input (ain).
 
@@ -25,8 +26,40 @@ Options:    Configurable options are found below in "User-configurable Variables
                                     send up reports only when voltage has
                                     changed by the specified threshold
             reportingThreshold:     Set to desired voltage threshold level
+            compression:            Filter used by conditionalReporting,
+                                    'deadband' sends a reading that is
+                                    reportingThreshold from the last one
+                                    sent, 'swingingdoor' sends the readings
+                                    where the voltage trend bends, so the
+                                    line through them is within
+                                    reportingThreshold of every reading
+            maxSilence:             Longest time, in seconds, without a
+                                    report when conditionalReporting is set
             voltageDecimal:         Change to desired voltage decimal accuracy
             streamName:             Data Stream name in Remote Manager
+            uploadInterval:         Longest time, in seconds, readings are
+                                    held to be uploaded together. Readings
+                                    that can not be uploaded are stored and
+                                    sent when the uplink is back.
+            sampleRate:             Readings per second. 0 takes one reading
+                                    per readInterval. Otherwise readings are
+                                    kept in a ring buffer and min, max, mean,
+                                    stddev and count are uploaded for each
+                                    readInterval, to the wr31vin/<stat>
+                                    streams. conditionalReporting then
+                                    compares the mean with reportingThreshold.
+            bufferSize:             Readings kept in the ring buffer
+            excursionThreshold:     A reading this many volts from the last
+                                    reported mean uploads a snapshot of the
+                                    ring buffer, half before and half after
+                                    the excursion, to the wr31vin/raw stream
+            keepHistory:            Store every reading on flash with
+                                    tsstore, as series 'vin', to be queried
+                                    by a 'tsquery' device request. Off by
+                                    default: it takes up to MAX_SEGMENTS x
+                                    128 KB, about 5 MB, of flash, which
+                                    holds about 7 days at one reading a
+                                    second, or under 2 hours at 100
 
 Usage:      The script should be uploaded and then can be run manually via the
             command-line (CLI), as:
@@ -34,11 +67,17 @@ Usage:      The script should be uploaded and then can be run manually via the
             Or it can be set to run on boot.
 """
 
-import sarcli
-import idigidata
+import clisess
+import dpupload
+import math
+import rptfilt
 import time
 import thread
 import sys
+import ticker
+import tsstore
+import wr31io
+from array import array
 
 # User-configurable Variables
 readInterval = 60  # Time between readings in seconds
@@ -46,80 +85,262 @@ resistorVal = 681000  # Value of resistor tied between Vin and Ain
 inputImpedance = 291000  # WR31 Analog Input Impedance
 conditionalReporting = False  # Default = False
 reportingThreshold = 0.01  # Set to desired voltage threshold level
+compression = 'deadband'  # 'deadband' or 'swingingdoor'
+maxSilence = 3600  # Longest time without a report, seconds
 voltageDecimal = 3  # Change to desired voltage decimal accuracy
 streamName = 'wr31ain'  # Data Stream name in Remote Manager
+uploadInterval = 300  # Longest time readings are held before upload, seconds
+sampleRate = 0  # Readings per second, 0 for one reading per readInterval
+bufferSize = 100  # Readings kept for an excursion snapshot
+excursionThreshold = 1.0  # Volts from the last reported mean
+keepHistory = False  # Store every reading on flash, up to about 5 MB
 
 # System Variables
 lastReading = 0.0  # Initialize last reading variable
+analog = wr31io.analog_reader()
+vinFilter = None  # Report filter, created on first use
 
 
 def convert_voltage(rawV):
     return rawV / (float(inputImpedance)/(float(resistorVal)+float(inputImpedance)))
 
 
+def raw_voltage(calcV):
+    return calcV * (float(inputImpedance)/(float(resistorVal)+float(inputImpedance)))
+
+
 def cli(command):
-    s = sarcli.open()
-    s.write(command)
-    resp = s.read()
-    s.close()  # Close sarcli session
-    return resp
+    return clisess.execute(command)
+
+
+def report_filter():
+    """Return the filter deciding which readings are sent"""
+    global vinFilter
+    if vinFilter is None:
+        if conditionalReporting:
+            vinFilter = rptfilt.make_filter(compression, reportingThreshold, maxSilence)
+        else:
+            vinFilter = rptfilt.ReportFilter()
+    return vinFilter
 
 
 def read_gpio():
-    resp = cli('gpio ain')
-    i = resp.find('voltage=')
-    j = resp.find('V')
-    vdc = float(resp[i+8:j-1])
+    vdc = analog.read_ain()
     calc_vdc = float(round(convert_voltage(vdc), voltageDecimal))
     return vdc, calc_vdc
 
 
-def send_up_data():
+class VinBuffer(object):
+    """
+    Fixed-size ring of readings, with running min/max/mean/stddev for the
+    current interval and snapshots taken around excursions
+    """
+    def __init__(self, size):
+        self.size = size
+        self.values = array('d', [0.0] * size)
+        self.times = array('d', [0.0] * size)
+        self.index = 0
+        self.filled = 0
+        self.trigger = 0  # Readings left until a triggered snapshot
+        self.snapshots = []
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.low = None
+        self.high = None
+        self.excursions = 0
+
+    def add(self, value, when):
+        self.values[self.index] = value
+        self.times[self.index] = when
+        self.index = (self.index + 1) % self.size
+        if self.filled < self.size:
+            self.filled += 1
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        if self.low is None or value < self.low:
+            self.low = value
+        if self.high is None or value > self.high:
+            self.high = value
+        if self.trigger:
+            self.trigger -= 1
+            if not self.trigger:
+                self.snapshots.append(self.snapshot())
+
+    def excursion(self):
+        """
+        Take a snapshot once half the buffer has been filled after this reading
+        """
+        self.excursions += 1
+        if not self.trigger:
+            self.trigger = max(1, self.size // 2)
+
+    def snapshot(self):
+        """
+        :return readings: list of (time, value), oldest first
+        """
+        start = self.index - self.filled
+        return [(self.times[i % self.size], self.values[i % self.size])
+                for i in range(start, start + self.filled)]
+
+    def take_stats(self):
+        """
+        Return the stats of the interval and start a new one
+        :return: (count, min, max, mean, stddev, excursions), None if empty
+        """
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        variance = 0.0
+        if self.count > 1:
+            variance = max(0.0, (self.total_sq - self.total * mean) / (self.count - 1))
+        stats = (self.count, self.low, self.high, mean, math.sqrt(variance), self.excursions)
+        self.reset_stats()
+        return stats
+
+
+def take_reading(buf, reference):
+    """Read Vin once into the buffer, checking for an excursion"""
+    vdc, calc_vdc = read_gpio()
+    now = time.time()
+    buf.add(calc_vdc, now)
+    if keepHistory:
+        tsstore.get_store('vin').append(calc_vdc, now)
+    if reference is not None and abs(calc_vdc - reference) >= excursionThreshold:
+        buf.excursion()
+
+
+def sample_interval(buf, reference):
+    """
+    Read Vin sampleRate times a second until readInterval seconds have
+    passed. Readings that fall behind the timeline are skipped, so the
+    interval ends on time with fewer readings rather than stretching.
+    :param reference: float, Last reported mean, None to skip excursion checks
+    :return end: float, Time the interval ended, in seconds since the epoch
+    """
+    timer = ticker.Ticker(1.0 / sampleRate)
+    end = ticker.monotonic() + readInterval
+    while True:
+        take_reading(buf, reference)
+        # The reading due at the end belongs to the next interval
+        if timer.deadline > end - timer.period / 2 or ticker.monotonic() >= end:
+            break
+        # Fell behind, skip the missed readings
+        timer.wait()
+    return time.time()
+
+
+def send_up_stats(buf, poll=True, when=None):
+    """
+    Upload the interval aggregates, and any excursion snapshots
+    :param when: float, End of the interval, the timestamp of all its
+        aggregates, defaults to now
+    """
+    global lastReading
+
+    uploader = dpupload.get_uploader()
+    stats = buf.take_stats()
+    if stats is None:
+        return
+    if when is None:
+        when = time.time()
+    timestamp = int(when * 1000)
+    count, low, high, mean, stddev, excursions = stats
+    mean = float(round(mean, voltageDecimal))
+
+    print "\n----------------------"
+    print "Voltage in: min %.3f, max %.3f, mean %.3f, stddev %.4f, %d readings" % (
+        low, high, mean, stddev, count)
+
+    # The filter picks the means to send, and the rest of the interval
+    # stats go with any report
+    points = report_filter().offer(mean, when)
+    if points or excursions:
+        print "Queueing for Remote Manager..."
+        for point_when, value in points:
+            uploader.add('wr31vin/mean', value, data_type='float', units='V',
+                         description='Calculated voltage mean', timestamp=int(point_when * 1000))
+        for name, value in (('min', low), ('max', high), ('stddev', stddev)):
+            uploader.add('wr31vin/' + name, round(value, voltageDecimal + 1), data_type='float',
+                         units='V', description='Calculated voltage ' + name, timestamp=timestamp)
+        uploader.add('wr31vin/count', count, data_type='integer', description='Readings',
+                     timestamp=timestamp)
+    for snapshot in buf.snapshots:
+        print "Excursion, queueing %d raw readings..." % len(snapshot)
+        for when, value in snapshot:
+            uploader.add('wr31vin/raw', value, data_type='float', units='V',
+                         timestamp=int(when * 1000))
+    buf.snapshots = []
+    if poll:
+        uploader.poll()
+
+    lastReading = mean
+
+
+def send_up_data(poll=True):
     """Adam's stock function for uploading datapoints with mods by Brad"""
     global lastReading
 
-    # Replace 'wr31ain' with the data stream to which you want to upload
-    # Change the xml filename as needed
-    path = 'DataPoint/{}.xml'.format(streamName)
-    # Define datapoint(s)
-    xml = '''<list>
-    <DataPoint>
-      <data>%s</data>
-      <dataType>float</dataType>
-      <units>V</units>
-      <description>Raw voltage reading</description>
-      <streamId>wr31ain</streamId>
-    </DataPoint>
-    <DataPoint>
-      <data>%s</data>
-      <dataType>float</dataType>
-      <units>V</units>
-      <description>Calculated voltage reading</description>
-      <streamId>wr31vin</streamId>
-    </DataPoint>
-    </list>'''
+    uploader = dpupload.get_uploader()
     vdc, calc_vdc = read_gpio()
+    now = time.time()
+    if keepHistory:
+        tsstore.get_store('vin').append(calc_vdc, now)
 
-    z = xml % (vdc, calc_vdc)
     print "\n----------------------"
     print " Analog in: %s" % vdc
     print "Voltage in: %s" % calc_vdc
 
-    # Only send to Remote Manager if conditionalReporting is set to false OR if
-    # the reportingThreshold has been matched or exceeded
-    if conditionalReporting is False or
-        (round(calc_vdc - lastReading, voltageDecimal) >= reportingThreshold or
-                round(lastReading - calc_vdc, voltageDecimal) >= reportingThreshold):
-        print "Sending to Remote Manager..."
-        idigidata.send_to_idigi(z, path)
+    # Send everything if conditionalReporting is set to false, otherwise the
+    # readings picked by the compression filter, which can be earlier ones
+    points = report_filter().offer(calc_vdc, now)
+    if points:
+        print "Queueing for Remote Manager..."
+    for when, value in points:
+        timestamp = int(when * 1000)
+        # The raw reading of this one was read, earlier ones only have their
+        # calculated voltage kept by the filter
+        raw = vdc
+        if when != now:
+            raw = round(raw_voltage(value), 4)
+        # Replace 'wr31ain' with the data stream to which you want to upload
+        uploader.add(streamName, raw, data_type='float', units='V',
+                     description='Raw voltage reading', timestamp=timestamp)
+        uploader.add('wr31vin', value, data_type='float', units='V',
+                     description='Calculated voltage reading', timestamp=timestamp)
+    if poll:
+        uploader.poll()
 
     # Update the last reading to track for threashold changes
     lastReading = calc_vdc
 
 if __name__ == '__main__':
     print "Starting Vin Reading Application"
+    dpupload.get_uploader().max_age = uploadInterval
+    analog.set_mode('voltage')
+    if keepHistory:
+        tsstore.register_requests()
 
-    # spin forever
-    while True:
-        send_up_data()
-        time.sleep(readInterval)
+    try:
+        if sampleRate:
+            buf = VinBuffer(bufferSize)
+            reference = None
+            while True:
+                end = sample_interval(buf, reference)
+                send_up_stats(buf, when=end)
+                reference = lastReading
+
+        # spin forever, a reading every readInterval however long the CLI
+        # and upload take
+        timer = ticker.Ticker(readInterval)
+        while True:
+            send_up_data()
+            timer.wait()
+    finally:
+        # Keep the readings still buffered for the history file
+        if keepHistory:
+            tsstore.flush_all()
@@ -0,0 +1,248 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2016 Digi International Inc. All Rights Reserved.
+
+"""
+WR31 GPIO access, using the fastest read path available.
+
+Inputs are read in-process through the 'digihw' module when it provides the
+needed call, otherwise through the 'gpio' CLI commands on a shared clisess
+session. An analog read that fails through digihw falls back to the CLI.
+
+Usage:
+    import wr31io
+    reader = wr31io.digital_reader()
+    if reader.read_din('D1'):
+        print 'D1 is HIGH'
+
+    analog = wr31io.analog_reader()
+    print analog.read_ain(), analog.unit
+
+    for record in wr31io.parse_gpio_response(clisess.execute('gpio dio')):
+        print record.channel, record.din
+"""
+
+from collections import namedtuple
+
+import clisess
+
+try:
+    import digihw
+except ImportError:
+    digihw = None
+
+CMD_DIO = 'gpio dio'
+CMD_AIN = 'gpio ain'
+DIGITAL_CHANNELS = ['D0', 'D1']
+ANALOG_CHANNEL = 'A0'
+ANALOG_UNITS = {'voltage': 'V', 'current': 'mA'}
+DIGIHW_DIN = 'gpio_get_value'  # digihw call returning the level of a pin
+DIGIHW_AIN = 'wr31_ain_get_value'  # digihw call returning the analog input
+
+# D0: DOUT=OFF, DIN=HIGH (Inactive) -> DigitalRecord('D0', False, True)
+DigitalRecord = namedtuple('DigitalRecord', 'channel dout din')
+# A0: voltage=0.0075 V -> AnalogRecord('A0', 'voltage', 0.0075, 'V')
+AnalogRecord = namedtuple('AnalogRecord', 'channel mode value unit')
+# Builds a record from a tuple without the keyword handling of the
+# namedtuple constructor, which costs as much as parsing the line
+_new_record = tuple.__new__
+
+
+def parse_gpio_response(response):
+    """
+    Parse 'gpio dio' and 'gpio ain' output in a single pass. Lines that are
+    not channel readings, like 'OK' or 'ERROR', are skipped, so a partial or
+    failed response returns the readings it does contain.
+    :param response: str, CLI response
+    :return records: list of DigitalRecord and AnalogRecord
+    """
+    records = []
+    append = records.append
+    for line in response.split('\n'):
+        channel, sep, reading = line.partition(': ')
+        if not sep:
+            continue
+        if reading[:5] == 'DOUT=':
+            append(_new_record(DigitalRecord, (channel, reading[5:7] == 'ON', 'DIN=HIGH' in reading)))
+        else:
+            mode, sep, rest = reading.partition('=')
+            if sep:
+                value, sep, unit = rest.partition(' ')
+                try:
+                    append(_new_record(AnalogRecord, (channel, mode, float(value), unit.rstrip())))
+                except ValueError:
+                    pass
+    return records
+
+
+def format_record(record):
+    """
+    Format a record the way the CLI shows it
+    :param record: DigitalRecord or AnalogRecord
+    :return line: str
+    """
+    if isinstance(record, DigitalRecord):
+        return '{0}: DOUT={1}, DIN={2}'.format(record.channel, record.dout and 'ON' or 'OFF',
+                                               record.din and 'HIGH' or 'LOW')
+    return '{0}: {1}={2:.4f} {3}'.format(record.channel, record.mode, record.value, record.unit)
+
+
+class CliDigitalReader(object):
+    """
+    Reads digital inputs through the 'gpio dio' CLI command
+    >gpio dio
+    D0: DOUT=OFF, DIN=HIGH (Inactive)
+    D1: DOUT=OFF, DIN=LOW (Active)
+    OK
+    """
+    name = 'cli'
+    min_interval = 0.1  # seconds, poll interval while an input is changing
+    max_interval = 0.5  # seconds, poll interval while inputs are steady
+
+    def read_dio(self):
+        return clisess.execute(CMD_DIO)
+
+    def read_din(self, channel):
+        """
+        :param channel: str, Digital channel, 'D0' or 'D1'
+        :return: bool, True if the input is HIGH
+        """
+        response = self.read_dio()
+        pos = response.find(channel + ':')
+        if pos < 0:
+            raise clisess.CliError('{0}: no {1} in response'.format(CMD_DIO, channel))
+        pos = response.find('DIN=', pos)
+        return response.startswith('HIGH', pos + 4)
+
+    def read_douts(self):
+        """
+        :return douts: dict, Digital channel -> True if its output is ON
+        """
+        response = self.read_dio()
+        douts = {}
+        for channel in DIGITAL_CHANNELS:
+            pos = response.find(channel + ': DOUT=')
+            if pos < 0:
+                raise clisess.CliError('{0}: no {1} in response'.format(CMD_DIO, channel))
+            douts[channel] = response.startswith('ON', pos + len(channel) + 7)
+        return douts
+
+
+class DigihwDigitalReader(object):
+    """
+    Reads digital inputs in-process through digihw, and outputs, which
+    digihw does not report, through the CLI
+    """
+    name = 'digihw'
+    min_interval = 0.01  # seconds, poll interval while an input is changing
+    max_interval = 0.05  # seconds, poll interval while inputs are steady
+
+    def __init__(self):
+        self.get_value = getattr(digihw, DIGIHW_DIN)
+        self.cli = CliDigitalReader()
+
+    def read_douts(self):
+        return self.cli.read_douts()
+
+    def read_din(self, channel):
+        """
+        :param channel: str, Digital channel, 'D0' or 'D1'
+        :return: bool, True if the input is HIGH
+        """
+        return bool(self.get_value(DIGITAL_CHANNELS.index(channel)))
+
+
+class CliAnalogReader(object):
+    """
+    Reads the analog input through the 'gpio ain' CLI command
+    >gpio ain
+    A0: voltage=0.0075 V
+    OK
+    """
+    name = 'cli'
+
+    def __init__(self):
+        self.mode = None
+
+    def set_mode(self, mode):
+        """
+        Switch the analog input between 'voltage' and 'current', if needed
+        :param mode: str, Key of ANALOG_UNITS
+        """
+        if mode != self.mode:
+            self.parse(clisess.execute('{0} {1}'.format(CMD_AIN, mode)))
+            self.mode = mode
+
+    @property
+    def unit(self):
+        return ANALOG_UNITS.get(self.mode or 'voltage')
+
+    def parse(self, response):
+        for record in parse_gpio_response(response):
+            if isinstance(record, AnalogRecord):
+                self.mode = record.mode
+                return record
+        raise clisess.CliError('{0}: no {1} in response'.format(CMD_AIN, ANALOG_CHANNEL))
+
+    def read_record(self):
+        """
+        :return record: AnalogRecord
+        """
+        return self.parse(clisess.execute(CMD_AIN))
+
+    def read_ain(self):
+        """
+        :return: float, Analog input, in unit
+        """
+        return self.read_record().value
+
+
+class DigihwAnalogReader(CliAnalogReader):
+    """
+    Reads the analog input in-process through digihw, which returns it in
+    the units of the mode last set with 'gpio ain', and falls back to the
+    CLI when the call fails
+    """
+    name = 'digihw'
+
+    def __init__(self):
+        CliAnalogReader.__init__(self)
+        self.get_value = getattr(digihw, DIGIHW_AIN)
+        self.fallbacks = 0
+
+    def read_record(self):
+        try:
+            value = float(self.get_value())
+        except Exception:
+            self.fallbacks += 1
+            return CliAnalogReader.read_record(self)
+        mode = self.mode or 'voltage'
+        return AnalogRecord(ANALOG_CHANNEL, mode, value, ANALOG_UNITS[mode])
+
+
+def has_digihw(function):
+    return digihw is not None and hasattr(digihw, function)
+
+
+def digital_reader(fast=True):
+    """
+    Return the fastest available digital input reader
+    :param fast: bool, False to always use the CLI
+    :return reader: DigihwDigitalReader or CliDigitalReader
+    """
+    if fast and has_digihw(DIGIHW_DIN):
+        return DigihwDigitalReader()
+    return CliDigitalReader()
+
+
+def analog_reader(fast=True):
+    """
+    Return the fastest available analog input reader
+    :param fast: bool, False to always use the CLI
+    :return reader: DigihwAnalogReader or CliAnalogReader
+    """
+    if fast and has_digihw(DIGIHW_AIN):
+        return DigihwAnalogReader()
+    return CliAnalogReader()
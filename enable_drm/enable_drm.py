@@ -16,10 +16,19 @@ import paramiko
 import re
 import socket
 import sys
+import threading
+import time
 import traceback
+import Queue
 
 from time import gmtime, localtime, strftime
 
+try:
+    import instr
+except ImportError:
+    # SSH call statistics, --stats, need WR31/instr.py on the path
+    instr = None
+
 CSV_FIELDNAMES = ['devId', 'installCode']
 DEVID = '00000000-00000000-00000000-00000000'
 DRM_HOSTNAME = "my.devicecloud.com"
@@ -27,14 +36,19 @@ HR = "----------------------------------------------------------------"
 IP_FILENAME = "iplist.txt"
 PASSWORD = "password"
 SSH_TIMEOUT = 20  # seconds
+BANNER_TIMEOUT = 2  # seconds to wait for the banner and prompt of a new shell
 USERNAME = "username"
 SSH_PORT = 22
+WORKERS = 1  # Routers provisioned in parallel, see --workers
+SSH_CLIENT = paramiko.SSHClient  # Replaced by sim_ssh.SimSSHClient for testing
 
 CMD_ENABLE_DRM = "cloud 0 clientconn ON"
 CMD_SET_SERVER = "cloud 0 server %s" % DRM_HOSTNAME
 CMD_SAVEALL = "config 0 save"
 CMD_HW_INFO = "hw ?"
 CMD_REBOOT = "reboot"
+CMD_TERMINATORS = ('OK', 'ERROR')
+PROMPT_ENDINGS = ('#', '>')
 
 # Global IP List
 ip_addrs = []
@@ -60,33 +74,147 @@ def config_logging(filename, console_level, file_level):
     logging.getLogger('').addHandler(console)
 
 
-def connect_to_router(ip_addr):
-    logging.info("Connecting to %s..." % ip_addr)
-    ssh = paramiko.SSHClient()
+def connect_to_router(ip_addr, log=logging):
+    log.info("Connecting to %s..." % ip_addr)
+    ssh = SSH_CLIENT()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(hostname=ip_addr, port=SSH_PORT, username=USERNAME, password=PASSWORD, timeout=SSH_TIMEOUT)
+    if instr is None:
+        ssh.connect(hostname=ip_addr, port=SSH_PORT, username=USERNAME, password=PASSWORD, timeout=SSH_TIMEOUT)
+        return ssh
+    with instr.timer('ssh connect'):
+        ssh.connect(hostname=ip_addr, port=SSH_PORT, username=USERNAME, password=PASSWORD, timeout=SSH_TIMEOUT)
     return ssh
 
 
-def config_router(ip_addr, reboot=True):
-    ssh_connection = connect_to_router(ip_addr)
-
-    logging.info("Enabling Device Cloud Client for %s..." % ip_addr)
-    stdin, stdout, stderr = ssh_connection.exec_command(CMD_ENABLE_DRM)
-
-    logging.info("Setting Device Cloud hostname for %s..." % ip_addr)
-    stdin, stdout, stderr = ssh_connection.exec_command(CMD_SET_SERVER)
-
-    logging.info("Saving config to flash for %s..." % ip_addr)
-    stdin, stdout, stderr = ssh_connection.exec_command(CMD_SAVEALL)
+class CommandError(Exception):
+    pass
 
-    logging.info("Getting hardware information for %s..." % ip_addr)
-    stdin, stdout, stderr = ssh_connection.exec_command(CMD_HW_INFO)
-    hw_info = stdout.readlines()
 
+def read_banner(channel, timeout=BANNER_TIMEOUT):
+    """
+    Read what a new interactive channel sends before the first command, up
+    to its prompt, so a banner is not taken for the response to the command
+    Returns the banner
+    """
+    banner = ''
+    channel.settimeout(timeout)
+    try:
+        while not banner.rstrip().endswith(PROMPT_ENDINGS):
+            data = channel.recv(4096)
+            if not data:
+                break
+            banner += data
+    except socket.timeout:
+        pass
+    channel.settimeout(SSH_TIMEOUT)
+    return banner
+
+
+def split_response(output, command):
+    """
+    Find the response to command in what the channel has sent so far: the
+    lines after the echoed command, which may follow a prompt, up to and
+    including the first 'OK' or 'ERROR' line
+    Returns the response and its status, None if it is not complete yet
+    """
+    lines = output.splitlines(True)
+    start = 0
+    for index, line in enumerate(lines):
+        if line.strip().endswith(command):
+            start = index + 1
+            break
+    for index in range(start, len(lines)):
+        status = lines[index].strip()
+        if status in CMD_TERMINATORS:
+            return ''.join(lines[start:index + 1]), status
+    return ''.join(lines[start:]), None
+
+
+def read_command_output(channel, command):
+    """
+    Read from an interactive channel until the response to command has an
+    'OK' or 'ERROR' line, wherever it is followed by a prompt
+    Returns the output, without the echoed command or the prompt, and the
+    status: 'OK', 'ERROR' or 'TIMEOUT'
+    """
+    output = ''
+    try:
+        while True:
+            data = channel.recv(4096)
+            if not data:
+                break
+            output += data
+            response, status = split_response(output, command)
+            if status is not None:
+                return response, status
+    except socket.timeout:
+        pass
+    return split_response(output, command)[0], 'TIMEOUT'
+
+
+def run_command_batch(ssh_connection, commands, log=logging):
+    """
+    Run a list of (command, no_wait) tuples on one interactive SSH channel
+    Each command is sent once the previous one has completed, or straight
+    away if no_wait is set, e.g. for a reboot. The batch stops at the first
+    command that does not return 'OK'.
+    Returns a list of dicts, one per command run, with the 'command', its
+    'output', 'status' and 'elapsed' time in seconds
+    """
+    results = []
+    channel = ssh_connection.invoke_shell()
+    try:
+        read_banner(channel)
+        for command, no_wait in commands:
+            start = time.time()
+            channel.send(command + '\r\n')
+            if no_wait:
+                output, status = '', 'SENT'
+            else:
+                output, status = read_command_output(channel, command)
+            result = {
+                'command': command,
+                'output': output,
+                'status': status,
+                'elapsed': time.time() - start,
+            }
+            log.info("  %s: %s (%d ms)" % (command, status, result['elapsed'] * 1000))
+            if instr is not None:
+                instr.record('ssh', result['elapsed'], status not in ('OK', 'SENT'), command)
+            results.append(result)
+            if status not in ('OK', 'SENT'):
+                break
+    finally:
+        channel.close()
+    return results
+
+
+def config_router(ip_addr, reboot=True, log=logging):
+    ssh_connection = connect_to_router(ip_addr, log)
+
+    log.info("Enabling Device Cloud for %s..." % ip_addr)
+    commands = [
+        (CMD_ENABLE_DRM, False),
+        (CMD_SET_SERVER, False),
+        (CMD_SAVEALL, False),
+        (CMD_HW_INFO, False),
+    ]
     if reboot:
-        logging.info("Rebooting %s..." % ip_addr)
-        stdin, stdout, stderr = ssh_connection.exec_command(CMD_REBOOT)
+        commands.append((CMD_REBOOT, True))
+    try:
+        results = run_command_batch(ssh_connection, commands, log)
+    finally:
+        ssh_connection.close()
+
+    failed = results[-1]
+    if failed['status'] not in ('OK', 'SENT'):
+        detail = failed['output'].strip().splitlines()
+        # The status line is already in the message
+        if detail and detail[-1].strip() in CMD_TERMINATORS:
+            detail = detail[:-1]
+        raise CommandError(("'%s' returned %s %s" % (failed['command'], failed['status'],
+                                                      ' '.join(detail))).strip())
+    hw_info = results[3]['output'].splitlines(True)
 
     return hw_info
 
@@ -108,18 +236,18 @@ def format_mac_as_devId(mac):
     return '00000000-00000000-' + mac[:6] + 'FF-FF' + mac[6:]
 
 
-def parse_hw_info(hw_info):
-    logging.debug("HW INFO: %s" % hw_info)
+def parse_hw_info(hw_info, log=logging):
+    log.debug("HW INFO: %s" % hw_info)
     string_match = "MAC 0:"
     devId = DEVID
     for line in hw_info:
         # logging.debug(line)
         if string_match in line:
             line = line.replace(string_match, '').strip('\r\n').strip().upper()
-            logging.info("MAC: %s" % line)
+            log.info("MAC: %s" % line)
             devId = format_mac_as_devId(line)
             break
-    logging.info("DevId: %s" % devId)
+    log.info("DevId: %s" % devId)
     return devId
 
 
@@ -149,6 +277,166 @@ def log_status(ip_addr, devId, status='Success', error_msg=None):
     pass
 
 
+class HostLog(object):
+    """
+    Buffers the log records for one router, so routers provisioned in
+    parallel are written to the log one after another, in IP list order
+    """
+    def __init__(self):
+        self.records = []
+
+    def debug(self, msg):
+        self.records.append((logging.DEBUG, msg))
+
+    def info(self, msg):
+        self.records.append((logging.INFO, msg))
+
+    def error(self, msg):
+        self.records.append((logging.ERROR, msg))
+
+    def flush(self):
+        for level, msg in self.records:
+            logging.log(level, msg)
+        self.records = []
+
+
+def provision_router(ip_addr, reboot=True, log=logging):
+    """
+    Enable Remote Manager on one router
+    Returns a result dict with the 'ip', the 'devId' (None on failure), the
+    'error' message (None on success) and the 'elapsed' time in seconds
+    """
+    result = {'ip': ip_addr, 'devId': None, 'error': None}
+    start = time.time()
+    try:
+        cmd_resp = config_router(ip_addr, reboot, log)
+        result['devId'] = parse_hw_info(cmd_resp, log)
+    except socket.error as msg:
+        if str(msg) == 'timed out':
+            msg = "SSH connection timed out"
+        result['error'] = str(msg)
+    except paramiko.ssh_exception.AuthenticationException as auth_err:
+        result['error'] = str(auth_err)
+    except paramiko.ssh_exception.SSHException as ssh_err:
+        result['error'] = str(ssh_err)
+    except CommandError as cmd_err:
+        result['error'] = str(cmd_err)
+    if result['error']:
+        log.error('%s for %s' % (result['error'], ip_addr))
+    result['elapsed'] = time.time() - start
+    return result
+
+
+class ProvisionSummary(object):
+    """
+    Counts results and reports throughput and failures
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.succeeded = 0
+        self.failures = []
+        self.host_time = 0.0
+
+    def add(self, result):
+        self.host_time += result['elapsed']
+        if result['error']:
+            self.failures.append((result['ip'], result['error']))
+        else:
+            self.succeeded += 1
+
+    def log(self, workers):
+        elapsed = time.time() - self.start
+        total = self.succeeded + len(self.failures)
+        logging.info(HR)
+        logging.info("| Routers: %d, succeeded: %d, failed: %d" % (total, self.succeeded, len(self.failures)))
+        logging.info("| Workers: %d, elapsed: %.1f s, per router: %.1f s" %
+                     (workers, elapsed, self.host_time / max(total, 1)))
+        if elapsed > 0:
+            logging.info("| Throughput: %.1f routers/min" % (total * 60.0 / elapsed))
+        reasons = {}
+        for ip_addr, error in self.failures:
+            reasons[error] = reasons.get(error, 0) + 1
+        for error in sorted(reasons, key=reasons.get, reverse=True):
+            logging.info("| %5d x %s" % (reasons[error], error))
+
+
+def record_result(result, csv_filename, summary):
+    if result['devId']:
+        log_to_csv(csv_filename, result['devId'])
+    summary.add(result)
+
+
+def provision_host(ip_addr, reboot=True, log=logging):
+    """
+    Provision one router, recording any unexpected error as its result so
+    the rest of the list still runs
+    """
+    try:
+        return provision_router(ip_addr, reboot, log)
+    except Exception as err:
+        log.error('%s for %s' % (err, ip_addr))
+        return {'ip': ip_addr, 'devId': None, 'error': str(err), 'elapsed': 0.0}
+
+
+def provision_worker(jobs, results, reboot):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        index, ip_addr = job
+        log = HostLog()
+        results.put((index, provision_host(ip_addr, reboot, log), log))
+
+
+def provision_routers(ip_list, csv_filename, reboot=True, workers=WORKERS):
+    """
+    Provision every router in ip_list, up to workers at a time
+    Results are written to the CSV file and the log in ip_list order.
+    """
+    summary = ProvisionSummary()
+    workers = max(1, min(workers, len(ip_list)))
+    if workers == 1:
+        first = True
+        for ip in ip_list:
+            if not first:
+                logging.info(HR)
+            first = False
+            record_result(provision_host(ip, reboot), csv_filename, summary)
+        summary.log(workers)
+        return summary
+
+    jobs = Queue.Queue()
+    results = Queue.Queue()
+    for job in enumerate(ip_list):
+        jobs.put(job)
+    threads = []
+    for x in range(workers):
+        jobs.put(None)
+        thread = threading.Thread(target=provision_worker, args=(jobs, results, reboot))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    # Single writer: hold results that finish early until the ones before
+    # them in the list are written
+    pending = {}
+    next_index = 0
+    while next_index < len(ip_list):
+        index, result, log = results.get()
+        pending[index] = (result, log)
+        while next_index in pending:
+            result, log = pending.pop(next_index)
+            if next_index:
+                logging.info(HR)
+            log.flush()
+            record_result(result, csv_filename, summary)
+            next_index += 1
+    for thread in threads:
+        thread.join()
+    summary.log(workers)
+    return summary
+
+
 def is_valid_ipv4_address(address):
     try:
         socket.inet_pton(socket.AF_INET, address)
@@ -233,27 +521,29 @@ if __name__ == "__main__":
             if '--continuous' in sys.argv:
                 continuous = True
                 logging.info('Continuous script enabled')
+
+            if '--stats' in sys.argv:
+                if instr is None:
+                    logging.info('--stats needs WR31/instr.py on PYTHONPATH')
+                else:
+                    instr.enable()
+                    instr.install_signal()
+                    logging.info('SSH call statistics enabled, printed on SIGUSR1 and at the end')
+
+            if '--workers' in sys.argv:
+                loc = sys.argv.index('--workers')
+                try:
+                    WORKERS = int(sys.argv[loc + 1])
+                except (IndexError, ValueError):
+                    pass
+                logging.info('Provisioning up to %d routers in parallel' % WORKERS)
             logging.info(HR)
 
         reloop = True
         while reloop:
-            first = True
-            for ip in ip_addrs:
-                if not first:
-                    logging.info(HR)
-                try:
-                    first = False
-                    cmd_resp = config_router(ip, reboot)
-                    devId = parse_hw_info(cmd_resp)
-                    log_to_csv(csv_filename, devId)
-                except socket.error as msg:
-                    if str(msg) == 'timed out':
-                        msg = "SSH connection timed out"
-                    logging.error('%s for %s' % (msg, ip))
-                    continue
-                except paramiko.ssh_exception.AuthenticationException as auth_err:
-                    logging.error('%s for %s' % (auth_err, ip))
-                    continue
+            provision_routers(ip_addrs, csv_filename, reboot, WORKERS)
+            if csvfile:
+                csvfile.flush()
             if continuous:
                 prompt('Type Enter to continue', default="Enter")
 
@@ -264,6 +554,8 @@ if __name__ == "__main__":
             csvfile.close()
         logging.error(traceback.print_exc())
 
+    if instr is not None and instr.enabled:
+        logging.info(instr.format_summary())
     logging.info(HR)
     logging.info("| Application Complete")
     logging.info(HR)
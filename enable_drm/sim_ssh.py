@@ -0,0 +1,208 @@
+############################################################################
+#                                                                          #
+# This Source Code Form is subject to the terms of the Mozilla Public      #
+# License, v. 2.0. If a copy of the MPL was not distributed with this      #
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.                 #
+#                                                                          #
+# Copyright (c)2017 Digi International Inc. All Rights Reserved.           #
+#                                                                          #
+############################################################################
+
+"""
+In-process stand-in for paramiko.SSHClient, simulating a fleet of TransPort
+routers so enable_drm.py can be exercised without real hardware.
+
+Each simulated router is either reachable after a connect delay, slow,
+unreachable (the connect fails after the SSH timeout, scaled down), rejects
+the login or fails to save its configuration. Every command costs one
+round trip of COMMAND_DELAY. A shell opens with a banner and a prompt, and
+each response is followed by the prompt, as on a router.
+
+Usage:      Compare sequential and parallel provisioning of a simulated fleet
+            > python sim_ssh.py [routers] [workers]
+"""
+
+import logging
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+import paramiko
+
+import enable_drm
+
+CONNECT_DELAY = 0.05  # seconds, reachable router
+SLOW_DELAY = 0.5  # seconds, slow router
+TIMEOUT_SCALE = 0.02  # Unreachable routers fail after SSH_TIMEOUT * TIMEOUT_SCALE
+COMMAND_DELAY = 0.01  # seconds, round trip per command
+
+OK = 'ok'
+SLOW = 'slow'
+UNREACHABLE = 'unreachable'
+BAD_LOGIN = 'badlogin'
+SAVE_ERROR = 'saveerror'
+
+# IP address -> behaviour, routers not listed are unreachable
+ROUTERS = {}
+
+BANNER = """
+Welcome. Your last login was from 10.0.0.1
+
+"""
+PROMPT = '#'
+
+HW_INFO = """Digi TransPort WR31-N2A3-CE1-SW
+Serial number: 1234567
+MAC 0: %s
+MAC 1: 00:04:2D:FF:FF:FF
+OK
+"""
+
+
+def mac_for(ip_addr):
+    octets = [int(x) for x in ip_addr.split('.')]
+    return '00:04:2D:%02X:%02X:%02X' % (octets[1], octets[2], octets[3])
+
+
+def command_output(hostname, command):
+    if command == enable_drm.CMD_HW_INFO:
+        return HW_INFO % mac_for(hostname)
+    if command == enable_drm.CMD_SAVEALL and ROUTERS.get(hostname) == SAVE_ERROR:
+        return 'ERROR\n'
+    return 'OK\n'
+
+
+class SimChannel(object):
+    """
+    Interactive shell channel, sending a banner and prompt when opened and
+    echoing each command before its output and the next prompt
+    """
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.timeout = None
+        self.pending = [(time.time() + COMMAND_DELAY, BANNER.replace('\n', '\r\n') + PROMPT)]
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def send(self, data):
+        command = data.strip()
+        output = command_output(self.hostname, command).replace('\n', '\r\n')
+        self.pending.append((time.time() + COMMAND_DELAY, command + '\r\n' + output + '\r\n' + PROMPT))
+        return len(data)
+
+    def recv(self, nbytes):
+        if not self.pending:
+            time.sleep(self.timeout * TIMEOUT_SCALE)
+            raise socket.timeout('timed out')
+        ready, data = self.pending.pop(0)
+        delay = ready - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        if len(data) > nbytes:
+            self.pending.insert(0, (0, data[nbytes:]))
+        return data[:nbytes]
+
+    def close(self):
+        self.pending = []
+
+
+class SimSSHClient(object):
+    """
+    Implements the subset of paramiko.SSHClient used by enable_drm.py
+    """
+    def __init__(self):
+        self.hostname = None
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, hostname, port=22, username=None, password=None, timeout=None):
+        behaviour = ROUTERS.get(hostname, UNREACHABLE)
+        if behaviour == UNREACHABLE:
+            time.sleep((timeout or enable_drm.SSH_TIMEOUT) * TIMEOUT_SCALE)
+            raise socket.timeout('timed out')
+        time.sleep(SLOW_DELAY if behaviour == SLOW else CONNECT_DELAY)
+        if behaviour == BAD_LOGIN:
+            raise paramiko.ssh_exception.AuthenticationException('Authentication failed.')
+        self.hostname = hostname
+
+    def invoke_shell(self):
+        if self.hostname is None:
+            raise paramiko.ssh_exception.SSHException('SSH session not active')
+        return SimChannel(self.hostname)
+
+    def close(self):
+        self.hostname = None
+
+
+def simulate_fleet(count, slow=0.1, unreachable=0.1, bad_login=0.02, save_error=0.02, seed=1):
+    """
+    Register count simulated routers with a random mix of behaviours
+    :return ip_list: list, IP addresses of the simulated routers
+    """
+    rand = random.Random(seed)
+    ROUTERS.clear()
+    ip_list = []
+    for x in range(count):
+        n = x + 1
+        ip_addr = '10.%d.%d.%d' % ((n >> 16) & 255, (n >> 8) & 255, n & 255)
+        roll = rand.random()
+        if roll < unreachable:
+            behaviour = UNREACHABLE
+        elif roll < unreachable + bad_login:
+            behaviour = BAD_LOGIN
+        elif roll < unreachable + bad_login + slow:
+            behaviour = SLOW
+        elif roll < unreachable + bad_login + slow + save_error:
+            behaviour = SAVE_ERROR
+        else:
+            behaviour = OK
+        ROUTERS[ip_addr] = behaviour
+        ip_list.append(ip_addr)
+    return ip_list
+
+
+class SummaryFilter(logging.Filter):
+    """
+    Only let the provisioning summary through to the console
+    """
+    def filter(self, record):
+        return record.getMessage().startswith('|')
+
+
+def install():
+    """
+    Make enable_drm connect to the simulated routers
+    """
+    enable_drm.SSH_CLIENT = SimSSHClient
+
+
+if __name__ == "__main__":
+    routers = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logging.getLogger('').handlers[0].addFilter(SummaryFilter())
+    install()
+    ip_list = simulate_fleet(routers)
+    if enable_drm.instr is not None:
+        # With ../WR31 on PYTHONPATH, summarize the SSH calls
+        enable_drm.instr.enable()
+    workdir = tempfile.mkdtemp()
+    try:
+        for count in (1, workers):
+            filename = os.path.join(workdir, 'sim_bulkadd_%d.csv' % count)
+            enable_drm.provision_routers(ip_list, filename, reboot=True, workers=count)
+            # No CSV file is opened when no router succeeds
+            if enable_drm.csvfile is not None:
+                enable_drm.csvfile.close()
+            enable_drm.csvfile = None
+            enable_drm.csvwriter = None
+    finally:
+        shutil.rmtree(workdir)
+    if enable_drm.instr is not None:
+        print(enable_drm.instr.format_summary())
@@ -16,36 +16,105 @@ VERSION = {
     'patch': 0
 }
 
+import os
 import sys
 import csv
+import gzip
 import json
+import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
 from devicecloud import DeviceCloud
 from devicecloud.version import __version__
 from devicecloud.examples.example_helpers import get_authenticated_dc
 from devicecloud.conditions import Attribute
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Parquet output is only available with pyarrow installed
+    pyarrow = None
+
+try:
+    import instr
+except ImportError:
+    # Request statistics, --stats, need WR31/instr.py on the path
+    instr = None
+
 
 DEBUG = False
+INCREMENTAL = False
+GZIP = False
+FORMAT = 'csv'
+PAGE_SIZE = 1000  # Devices requested per page
+CONCURRENCY = 1  # Pages requested at the same time
+FLUSH_ROWS = 1000  # Flush the export file every FLUSH_ROWS rows
+PROGRESS_ROWS = 10000  # Report progress every PROGRESS_ROWS rows
+DEVICECORE_PATH = '/ws/DeviceCore'
+CHECKPOINT_SUFFIX = '.checkpoint'
+KEY_FIELD = 'devConnectwareId'
+UPDATE_FIELD = 'dpLastUpdateTime'
+
+FIELDNAMES = ['devMac', 'devCellularModemId', 'devConnectwareId', 'xpExtAddr', 'dpLastKnownIp',
+              'dpGlobalIp', 'dpDeviceType', 'dpDescription', 'dpConnectionStatus', 'dpRestrictedStatus',
+              'dpFirmwareLevelDesc', 'dpLastConnectTime', 'dpContact', 'dpLocation', 'dpMapLat', 'dpMapLong',
+              'dpCapabilities', 'dvVendorId', 'dpUserMetaData', 'dpTags', 'dpLastDisconnectTime',
+              'dpLastUpdateTime', 'dpHealthStatus', 'grpPath', 'dpPanId', 'dpFirmwareLevel',
+              'devTerminated', 'devEffectiveStartDate', 'grpId', 'cstId', 'devRecordStartDate', 'id',
+              'dpZigbeeCapabilities']
+FIELDS = FIELDNAMES  # Fields written to the export, see --fields
 
 
 def disp_help():
-    print("""Usage: python {} export_file_path [--debug] [--help]
+    print("""Usage: python {0} export_file_path [--format <format>] [--gzip] [--fields <fields>] [--incremental]
+        [--concurrency <n>] [--page-size <n>] [--stats] [--debug] [--help]
 
-This script exports registered devices within a Digi Remote Manager (Device Cloud) account to a CSV file.
+This script exports registered devices within a Digi Remote Manager (Device Cloud) account to a file.
 
 Required:
-export_file_path: the output CSV file name and path
+export_file_path: the output file name and path
 
 Optional:
+--format <format>: Output format, one of {1} [default: {2}]
+    csv: CSV file, non-numeric fields quoted
+    jsonl: JSON Lines, one JSON object per device
+    parquet: Columnar Parquet file, requires the pyarrow package
+--gzip, -z: Compress the output with gzip, also set by a .gz export_file_path
+--fields <fields>: Comma separated list of the fields to export [default: all]
+--incremental, -i: Only fetch devices updated since the previous export and merge them into export_file_path
+--concurrency <n>: Pages requested at the same time [default: {3}]
+--page-size <n>: Devices requested per page [default: {4}]
+--stats: Print the count, latency percentiles and errors of the page requests at the end, or on SIGUSR1,
+    needs WR31/instr.py on PYTHONPATH
 --debug, -d: Debug, display registered devices
 --help, -h -?: Help, display help
-""".format(sys.argv[0]))
+""".format(sys.argv[0], ', '.join(sorted(WRITERS)), FORMAT, CONCURRENCY, PAGE_SIZE))
     sys.exit()
 
 
+def int_arg(name, default):
+    if name not in sys.argv:
+        return default
+    loc = sys.argv.index(name)
+    try:
+        return int(sys.argv[loc + 1])
+    except (IndexError, ValueError):
+        disp_help()
+
+
+def str_arg(name, default):
+    if name not in sys.argv:
+        return default
+    loc = sys.argv.index(name)
+    if loc + 1 >= len(sys.argv):
+        disp_help()
+    return sys.argv[loc + 1]
+
+
 def parse_args(argv):
-    global DEBUG
+    global DEBUG, INCREMENTAL, PAGE_SIZE, CONCURRENCY, GZIP, FORMAT, FIELDS
 
     if '--help' in sys.argv or '-h' in sys.argv or '-?' in sys.argv:
         disp_help()
@@ -53,40 +122,360 @@ def parse_args(argv):
     if '--debug' in sys.argv or '-d' in sys.argv:
         DEBUG = True
 
+    if '--stats' in sys.argv:
+        if instr is None:
+            print("--stats needs WR31/instr.py on PYTHONPATH")
+        else:
+            instr.enable()
+            instr.install_signal()
+
+    if '--incremental' in sys.argv or '-i' in sys.argv:
+        INCREMENTAL = True
+
+    PAGE_SIZE = int_arg('--page-size', PAGE_SIZE)
+    CONCURRENCY = int_arg('--concurrency', CONCURRENCY)
+
+    FORMAT = str_arg('--format', FORMAT)
+    if FORMAT not in WRITERS:
+        disp_help()
+
+    if '--fields' in sys.argv:
+        FIELDS = [field.strip() for field in str_arg('--fields', '').split(',') if field.strip()]
+
     if len(sys.argv) < 2:
         # print sys.argv
         disp_help()
 
+    if '--gzip' in sys.argv or '-z' in sys.argv or sys.argv[1].endswith('.gz'):
+        GZIP = True
+
     return sys.argv
 
 
+def fetch_page(conn, start, params):
+    reqparams = {'start': start, 'size': PAGE_SIZE}
+    reqparams.update(params)
+    if instr is None:
+        return conn.get_json(DEVICECORE_PATH, params=reqparams)
+    with instr.timer('drm get_json', DEVICECORE_PATH):
+        return conn.get_json(DEVICECORE_PATH, params=reqparams)
+
+
+def iter_devices_sequential(conn, params):
+    """
+    Yield device JSON one page request at a time
+    """
+    start = 0
+    while True:
+        page = fetch_page(conn, start, params)
+        items = page.get('items', [])
+        for item in items:
+            yield item
+        start += PAGE_SIZE
+        if not items or start >= int(page.get('resultTotalRows', 0)):
+            break
+
+
+def iter_devices_concurrent(conn, params, concurrency):
+    """
+    Yield device JSON in page order, with up to concurrency page requests
+    in flight. The first page gives the total number of devices.
+    """
+    first = fetch_page(conn, 0, params)
+    for item in first.get('items', []):
+        yield item
+    total = int(first.get('resultTotalRows', 0))
+    pool = ThreadPool(concurrency)
+    pending = deque()
+    try:
+        for start in range(PAGE_SIZE, total, PAGE_SIZE):
+            pending.append(pool.apply_async(fetch_page, (conn, start, params)))
+            if len(pending) >= concurrency:
+                for item in pending.popleft().get().get('items', []):
+                    yield item
+        while pending:
+            for item in pending.popleft().get().get('items', []):
+                yield item
+    finally:
+        pool.terminate()
+
+
+def iter_devices(dc, condition=None):
+    """
+    Yield the JSON of every device matching condition
+    :param dc: DeviceCloud
+    :param condition: devicecloud.conditions expression or None for all devices
+    """
+    params = {'embed': 'true'}
+    if condition is not None:
+        params['condition'] = condition.compile()
+    if CONCURRENCY > 1:
+        return iter_devices_concurrent(dc.get_connection(), params, CONCURRENCY)
+    # The same requests as dc.devicecore.get_devices(), through fetch_page()
+    # so each page is timed with --stats
+    return iter_devices_sequential(dc.get_connection(), params)
+
+
+def report_progress(count, start):
+    elapsed = time.time() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print("{0} devices exported in {1:.1f} s ({2:.0f} devices/s)".format(count, elapsed, rate))
+
+
+class ExportError(Exception):
+    pass
+
+
+def open_text(path, mode):
+    """
+    Open path for reading ('r') or writing ('w') text, through gzip if GZIP
+    is set
+    """
+    if GZIP:
+        return gzip.open(path, mode + ('t' if sys.version_info[0] >= 3 else 'b'))
+    return open(path, mode)
+
+
+def csv_value(value):
+    # QUOTE_NONNUMERIC reads every unquoted field back as a float
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class CsvWriter(object):
+    """
+    CSV with non-numeric fields quoted, one device per row. Fields not in
+    the header are ignored.
+    """
+    def __init__(self, path, fields):
+        self.file = open_text(path, 'w')
+        self.writer = csv.DictWriter(self.file, fieldnames=fields, quoting=csv.QUOTE_NONNUMERIC,
+                                     extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, dvc):
+        self.writer.writerow(dvc)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def read(path):
+        with open_text(path, 'r') as export_file:
+            for row in csv.DictReader(export_file, quoting=csv.QUOTE_NONNUMERIC):
+                yield dict((k, csv_value(v)) for k, v in row.items())
+
+
+class JsonLinesWriter(object):
+    """
+    JSON Lines, one compact JSON object per device, holding only fields
+    """
+    def __init__(self, path, fields):
+        self.file = open_text(path, 'w')
+        self.fields = fields
+
+    def write(self, dvc):
+        row = dict((field, dvc.get(field)) for field in self.fields)
+        self.file.write(json.dumps(row, separators=(',', ':')) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def read(path):
+        with open_text(path, 'r') as export_file:
+            for line in export_file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class ParquetWriter(object):
+    """
+    Columnar Parquet file with every field stored as a string column,
+    written in row groups of ROW_GROUP devices. Nested values are stored as
+    JSON. Needs pyarrow.
+    """
+    ROW_GROUP = 10000
+    read = None  # Incremental merge is not supported
+
+    def __init__(self, path, fields):
+        if pyarrow is None:
+            raise ExportError("The parquet format requires the pyarrow package")
+        self.fields = fields
+        schema = pyarrow.schema([(field, pyarrow.string()) for field in fields])
+        self.writer = pyarrow.parquet.ParquetWriter(path, schema, compression='gzip' if GZIP else 'snappy')
+        self.columns = [[] for field in fields]
+
+    @staticmethod
+    def column_value(value):
+        if value is None or value == '':
+            return None
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, separators=(',', ':'))
+        return str(value)
+
+    def write(self, dvc):
+        for field, column in zip(self.fields, self.columns):
+            column.append(self.column_value(dvc.get(field)))
+        if len(self.columns[0]) >= self.ROW_GROUP:
+            self.write_group()
+
+    def flush(self):
+        # A row group is only written once ROW_GROUP devices are buffered,
+        # not on every periodic flush, see close()
+        pass
+
+    def write_group(self):
+        if self.columns and self.columns[0]:
+            arrays = [pyarrow.array(column, type=pyarrow.string()) for column in self.columns]
+            self.writer.write_table(pyarrow.Table.from_arrays(arrays, names=self.fields))
+            self.columns = [[] for field in self.fields]
+
+    def close(self):
+        self.write_group()
+        self.writer.close()
+
+
+WRITERS = {
+    'csv': CsvWriter,
+    'jsonl': JsonLinesWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def open_writer(path):
+    return WRITERS[FORMAT](path, FIELDS)
+
+
+def export_devices(devices, writer):
+    """
+    Write each device to the export as soon as its page arrives, so only
+    the pages being fetched are held in memory
+    :param devices: iterable of device JSON dicts, e.g. from iter_devices()
+    :param writer: export writer, e.g. from open_writer(), flushed every
+        FLUSH_ROWS rows
+    :return (count, last_update): int, Number of devices exported and str,
+        the latest dpLastUpdateTime seen
+    """
+    start = time.time()
+    count = 0
+    last_update = ''
+    for dvc in devices:
+        if DEBUG:
+            print(json.dumps(dvc, indent=4, sort_keys=True))
+        writer.write(dvc)
+        last_update = max(last_update, dvc.get(UPDATE_FIELD) or '')
+        count += 1
+        if count % FLUSH_ROWS == 0:
+            writer.flush()
+        if count % PROGRESS_ROWS == 0:
+            report_progress(count, start)
+    writer.flush()
+    report_progress(count, start)
+    return count, last_update
+
+
+def checkpoint_path(export_path):
+    return export_path + CHECKPOINT_SUFFIX
+
+
+def read_checkpoint(export_path):
+    """
+    Return the latest dpLastUpdateTime of the previous export of export_path,
+    or None if there is no usable previous export
+    """
+    if not os.path.isfile(export_path) or not os.path.isfile(checkpoint_path(export_path)):
+        return None
+    with open(checkpoint_path(export_path), 'r') as checkpoint_file:
+        return json.load(checkpoint_file).get(UPDATE_FIELD) or None
+
+
+def write_checkpoint(export_path, last_update):
+    with open(checkpoint_path(export_path), 'w') as checkpoint_file:
+        json.dump({UPDATE_FIELD: last_update}, checkpoint_file)
+
+
+def merge_export(export_path, changed):
+    """
+    Replace the rows of changed devices in export_path and append new ones,
+    streaming the existing export through a temporary copy
+    :param changed: dict, device JSON keyed by devConnectwareId
+    :return (updated, added): int, Number of rows replaced and appended
+    """
+    updated = 0
+    tmp_path = export_path + '.tmp'
+    writer = open_writer(tmp_path)
+    try:
+        for row in WRITERS[FORMAT].read(export_path):
+            key = row.get(KEY_FIELD)
+            if key in changed:
+                writer.write(changed.pop(key))
+                updated += 1
+            else:
+                writer.write(row)
+        for dvc in changed.values():
+            writer.write(dvc)
+    finally:
+        writer.close()
+    os.remove(export_path)
+    os.rename(tmp_path, export_path)
+    return updated, len(changed)
+
+
+def run_export(dc, export_path):
+    """
+    Export all devices to export_path or, with INCREMENTAL set and a previous
+    export to build on, only those updated since the previous export
+    """
+    since = None
+    if INCREMENTAL:
+        if WRITERS[FORMAT].read is None:
+            raise ExportError("--incremental is not supported by the {0} format".format(FORMAT))
+        if KEY_FIELD not in FIELDS:
+            raise ExportError("--incremental requires {0} in --fields".format(KEY_FIELD))
+        since = read_checkpoint(export_path)
+    if since:
+        print("Fetching devices updated since {0}".format(since))
+        changed = {}
+        last_update = since
+        for dvc in iter_devices(dc, Attribute(UPDATE_FIELD) > since):
+            if DEBUG:
+                print(json.dumps(dvc, indent=4, sort_keys=True))
+            changed[dvc.get(KEY_FIELD)] = dvc
+            last_update = max(last_update, dvc.get(UPDATE_FIELD) or '')
+        updated, added = merge_export(export_path, changed)
+        print("{0} devices updated, {1} devices added".format(updated, added))
+    else:
+        writer = open_writer(export_path)
+        try:
+            count, last_update = export_devices(iter_devices(dc), writer)
+        finally:
+            writer.close()
+    if last_update:
+        write_checkpoint(export_path, last_update)
+
+
 if __name__ == "__main__":
     print("Device Exporter - version {major}.{minor}.{patch}".format(**VERSION))
     args = parse_args(sys.argv)
 
-    print("Opening {}".format(args[1]))
+    print("Opening {0}".format(args[1]))
 
     dc = get_authenticated_dc()
-    devices = dc.devicecore.get_devices()
-
-    fieldnames = ['devMac', 'devCellularModemId', 'devConnectwareId', 'xpExtAddr', 'dpLastKnownIp',
-                  'dpGlobalIp', 'dpDeviceType', 'dpDescription', 'dpConnectionStatus', 'dpRestrictedStatus',
-                  'dpFirmwareLevelDesc', 'dpLastConnectTime', 'dpContact', 'dpLocation', 'dpMapLat', 'dpMapLong',
-                  'dpCapabilities', 'dvVendorId', 'dpUserMetaData', 'dpTags', 'dpLastDisconnectTime',
-                  'dpLastUpdateTime', 'dpHealthStatus', 'grpPath', 'dpPanId', 'dpFirmwareLevel',
-                  'devTerminated', 'devEffectiveStartDate', 'grpId', 'cstId', 'devRecordStartDate', 'id',
-                  'dpZigbeeCapabilities']
-
-    with open(args[1], 'w') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, quoting=csv.QUOTE_NONNUMERIC)
-        writer.writeheader()
-        csv_devices = []
-        for device in devices:
-            if DEBUG:
-                print(json.dumps(device.get_device_json(), indent=4, sort_keys=True))
-            dvc = device.get_device_json()
-            csv_devices.append(dvc)
-
-        writer.writerows(csv_devices)
+    try:
+        run_export(dc, args[1])
+    except ExportError as err:
+        print("ERROR: {0}".format(err))
+        sys.exit(1)
+    finally:
+        if instr is not None and instr.enabled:
+            print(instr.format_summary())
 
-    print("DONE! Device export complete. Open {} to verify file complete.".format(args[1]))
+    print("DONE! Device export complete. Open {0} to verify file complete.".format(args[1]))
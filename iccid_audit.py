@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+
+############################################################################
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018 Digi International Inc. All Rights Reserved.
+#
+############################################################################
+
+"""
+Fleet-wide SIM audit: reads the ICCID of many TransPort routers at once and
+reports the routers whose SIM has changed since the last audit.
+
+Flow:       Each router in the device list is checked over SSH, up to
+            WORKERS at a time, by running 'modemstat ?' and reading the
+            ICCID with read_sim.parse_modemStat(). The ICCID of every
+            router is kept in a local SQLite database, with the history of
+            the SIMs each router has had, and only the changes are logged,
+            and written to the changes file. A SIM that turns up in another
+            router is reported with the router it moved from.
+
+Options:    Device list file, one router per line, its IP address and
+            optionally its device ID (the IP address is used otherwise).
+            Lines starting with # are skipped.
+            --workers <n>       Routers checked in parallel [default: 32]
+            --db <file>         History database [default: iccid_history.db]
+            --output <file>     Append the changes to a CSV file
+            --new               Also report routers seen for the first time
+            --history <id>      Print the SIM history of one router and exit
+            --stats             Log the count, latency percentiles and
+                                errors of the SSH calls at the end, or on
+                                SIGUSR1, needs WR31/instr.py on PYTHONPATH
+
+Usage:      Run from a PC, with Python 2 or 3 and paramiko installed
+            > python iccid_audit.py iplist.txt --workers 64 --output changes.csv
+            Simulated routers, see sim_iccid.py:
+            > python sim_iccid.py 5000 64
+"""
+
+import csv
+import logging
+import os.path
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import paramiko
+except ImportError:
+    # Only needed for SshTransport, the simulated transport runs without it
+    paramiko = None
+
+try:
+    import instr
+except ImportError:
+    # SSH call statistics, --stats, need WR31/instr.py on the path
+    instr = None
+
+import read_sim
+
+DB_FILENAME = "iccid_history.db"
+IP_FILENAME = "iplist.txt"
+HR = "----------------------------------------------------------------"
+USERNAME = "username"
+PASSWORD = "password"
+SSH_PORT = 22
+SSH_TIMEOUT = 20  # seconds
+WORKERS = 32  # Routers checked in parallel, see --workers
+COMMIT_ROWS = 500  # History rows written per transaction
+CHANGE_FIELDS = ['time', 'deviceId', 'address', 'previous', 'iccid', 'movedFrom']
+VALUE_OPTIONS = ['--workers', '--db', '--output', '--history']
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS iccid_current (
+        device_id TEXT PRIMARY KEY,
+        iccid TEXT NOT NULL,
+        since REAL NOT NULL,
+        checked REAL NOT NULL,
+        history_id INTEGER NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS iccid_history (
+        id INTEGER PRIMARY KEY,
+        device_id TEXT NOT NULL,
+        iccid TEXT NOT NULL,
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS iccid_history_device ON iccid_history (device_id, first_seen)",
+    "CREATE INDEX IF NOT EXISTS iccid_history_iccid ON iccid_history (iccid)",
+]
+
+
+class AuditError(Exception):
+    pass
+
+
+class SshTransport(object):
+    """
+    Runs 'modemstat ?' on a router over SSH
+    """
+    name = 'ssh'
+
+    def __init__(self, username=USERNAME, password=PASSWORD, port=SSH_PORT, timeout=SSH_TIMEOUT):
+        if paramiko is None:
+            raise AuditError("paramiko is required to audit routers over SSH")
+        self.username = username
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+
+    def modemstat(self, device_id, address):
+        if instr is None:
+            return self.run(address)
+        with instr.timer('ssh modemstat'):
+            return self.run(address)
+
+    def run(self, address):
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(hostname=address, port=self.port, username=self.username,
+                    password=self.password, timeout=self.timeout)
+        try:
+            stdin, stdout, stderr = ssh.exec_command(read_sim.MODEM_STAT, timeout=self.timeout)
+            return stdout.read()
+        finally:
+            ssh.close()
+
+
+def read_devices(filename):
+    """
+    Read the device list
+    :return devices: list of (device_id, address)
+    """
+    if not os.path.isfile(filename):
+        raise AuditError("File not found, %s" % filename)
+    devices = []
+    with open(filename) as device_file:
+        for line in device_file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            devices.append((fields[1] if len(fields) > 1 else fields[0], fields[0]))
+    return devices
+
+
+def check_device(transport, device_id, address):
+    """
+    Read the ICCID of one router
+    :return result: dict, 'deviceId', 'address', 'iccid' (None on failure),
+        'error' (None on success), 'checked' time and 'elapsed' seconds
+    """
+    result = {'deviceId': device_id, 'address': address, 'iccid': None, 'error': None}
+    start = time.time()
+    try:
+        output = transport.modemstat(device_id, address)
+        lines = output.strip().splitlines()
+        if lines and lines[-1].strip() == 'ERROR':
+            raise AuditError("'%s' returned ERROR" % read_sim.MODEM_STAT)
+        result['iccid'] = read_sim.parse_modemStat(output)
+    except socket.timeout:
+        result['error'] = "SSH connection timed out"
+    except (socket.error, AuditError) as err:
+        result['error'] = str(err)
+    except Exception as err:
+        if paramiko is None or not isinstance(err, paramiko.ssh_exception.SSHException):
+            raise
+        result['error'] = str(err)
+    result['checked'] = time.time()
+    result['elapsed'] = result['checked'] - start
+    return result
+
+
+class IccidHistory(object):
+    """
+    ICCID per device ID, and the SIMs each device has had, in SQLite.
+    Only the thread that created it may use it.
+    """
+    def __init__(self, filename=DB_FILENAME):
+        self.db = sqlite3.connect(filename)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        # device_id -> (iccid, history_id), so unchanged routers need no
+        # SELECT
+        self.current = {}
+        for device_id, iccid, history_id in self.db.execute(
+                "SELECT device_id, iccid, history_id FROM iccid_current"):
+            self.current[device_id] = (iccid, history_id)
+        self.uncommitted = 0
+
+    def record(self, device_id, iccid, when):
+        """
+        Store the ICCID read from a device
+        :return change: tuple, (previous ICCID, None for a new device, and the
+            device the SIM was in before, or None), None if unchanged
+        """
+        previous = self.current.get(device_id)
+        if previous is not None and previous[0] == iccid:
+            self.db.execute("UPDATE iccid_history SET last_seen = ? WHERE id = ?", (when, previous[1]))
+            self.db.execute("UPDATE iccid_current SET checked = ? WHERE device_id = ?", (when, device_id))
+            self.written()
+            return None
+        moved_from = None
+        if iccid:
+            # The latest other device seen with the SIM, whether or not it
+            # has been read since in this pass
+            row = self.db.execute("SELECT device_id FROM iccid_history WHERE iccid = ? AND device_id != ? "
+                                  "ORDER BY last_seen DESC, id DESC LIMIT 1", (iccid, device_id)).fetchone()
+            moved_from = row and row[0]
+        cursor = self.db.execute("INSERT INTO iccid_history (device_id, iccid, first_seen, last_seen) "
+                                 "VALUES (?, ?, ?, ?)", (device_id, iccid, when, when))
+        history_id = cursor.lastrowid
+        self.db.execute("INSERT OR REPLACE INTO iccid_current (device_id, iccid, since, checked, history_id) "
+                        "VALUES (?, ?, ?, ?, ?)", (device_id, iccid, when, when, history_id))
+        self.current[device_id] = (iccid, history_id)
+        self.written()
+        return (previous and previous[0], moved_from)
+
+    def written(self):
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_ROWS:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+    def history(self, device_id):
+        """
+        :return history: list of (iccid, first_seen, last_seen), oldest first
+        """
+        return self.db.execute("SELECT iccid, first_seen, last_seen FROM iccid_history "
+                               "WHERE device_id = ? ORDER BY first_seen", (device_id,)).fetchall()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+class AuditSummary(object):
+    """
+    Counts results and reports throughput and failures
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.unchanged = 0
+        self.new = 0
+        self.changed = 0
+        self.failures = []
+        self.host_time = 0.0
+
+    def add(self, result, change):
+        self.host_time += result['elapsed']
+        if result['error']:
+            self.failures.append((result['address'], result['error']))
+        elif change is None:
+            self.unchanged += 1
+        elif change[0] is None:
+            self.new += 1
+        else:
+            self.changed += 1
+
+    def log(self, workers):
+        elapsed = time.time() - self.start
+        total = self.unchanged + self.new + self.changed + len(self.failures)
+        logging.info(HR)
+        logging.info("| Routers: %d, unchanged: %d, new: %d, changed: %d, failed: %d" %
+                     (total, self.unchanged, self.new, self.changed, len(self.failures)))
+        logging.info("| Workers: %d, elapsed: %.1f s, per router: %.2f s" %
+                     (workers, elapsed, self.host_time / max(total, 1)))
+        if elapsed > 0:
+            logging.info("| Throughput: %.1f routers/min" % (total * 60.0 / elapsed))
+        reasons = {}
+        for address, error in self.failures:
+            reasons[error] = reasons.get(error, 0) + 1
+        for error in sorted(reasons, key=reasons.get, reverse=True):
+            logging.info("| %5d x %s" % (reasons[error], error))
+
+
+class ChangeWriter(object):
+    """
+    Logs changes, and appends them to a CSV file when one is given
+    """
+    def __init__(self, filename=None, show_new=False):
+        self.show_new = show_new
+        self.csvfile = None
+        self.writer = None
+        if filename:
+            exists = os.path.isfile(filename)
+            self.csvfile = open(filename, 'a')
+            self.writer = csv.DictWriter(self.csvfile, fieldnames=CHANGE_FIELDS)
+            if not exists:
+                self.writer.writeheader()
+
+    def write(self, result, change):
+        previous, moved_from = change
+        if previous is None and not self.show_new:
+            return
+        if previous is None:
+            message = "NEW %s (%s): %s" % (result['deviceId'], result['address'], result['iccid'] or 'no SIM')
+        else:
+            message = "CHANGED %s (%s): %s -> %s" % (result['deviceId'], result['address'],
+                                                     previous or 'no SIM', result['iccid'] or 'no SIM')
+        if moved_from:
+            message += ", SIM was in %s" % moved_from
+        logging.info(message)
+        if self.writer is not None:
+            self.writer.writerow({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(result['checked'])),
+                'deviceId': result['deviceId'],
+                'address': result['address'],
+                'previous': previous or '',
+                'iccid': result['iccid'],
+                'movedFrom': moved_from or '',
+            })
+
+    def close(self):
+        if self.csvfile is not None:
+            self.csvfile.close()
+
+
+def audit_worker(transport, jobs, results):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        device_id, address = job
+        try:
+            result = check_device(transport, device_id, address)
+        except Exception as err:
+            result = {'deviceId': device_id, 'address': address, 'iccid': None, 'error': str(err),
+                      'checked': time.time(), 'elapsed': 0.0}
+        results.put(result)
+
+
+def audit_devices(devices, transport, history, changes, workers=WORKERS):
+    """
+    Check every device, up to workers at a time
+    The history is written from this thread only, as results arrive.
+    :param devices: list of (device_id, address)
+    :return summary: AuditSummary
+    """
+    summary = AuditSummary()
+    workers = max(1, min(workers, len(devices)))
+    jobs = queue.Queue()
+    results = queue.Queue()
+    for device in devices:
+        jobs.put(device)
+    threads = []
+    for x in range(workers):
+        jobs.put(None)
+        thread = threading.Thread(target=audit_worker, args=(transport, jobs, results))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for x in range(len(devices)):
+        result = results.get()
+        change = None
+        if result['error']:
+            logging.debug("%s for %s" % (result['error'], result['address']))
+        else:
+            change = history.record(result['deviceId'], result['iccid'], result['checked'])
+            if change is not None:
+                changes.write(result, change)
+        summary.add(result, change)
+    for thread in threads:
+        thread.join()
+    history.commit()
+    summary.log(workers)
+    return summary
+
+
+def positional_args(argv):
+    args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in VALUE_OPTIONS:
+            skip = True
+        elif not arg.startswith('--'):
+            args.append(arg)
+    return args
+
+
+def arg_value(name, default):
+    if name not in sys.argv:
+        return default
+    loc = sys.argv.index(name)
+    try:
+        return sys.argv[loc + 1]
+    except IndexError:
+        return default
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if '--help' in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+    db_filename = arg_value('--db', DB_FILENAME)
+    history = IccidHistory(db_filename)
+    try:
+        device_id = arg_value('--history', None)
+        if device_id:
+            for iccid, first_seen, last_seen in history.history(device_id):
+                logging.info("%s  %s to %s" % (iccid or 'no SIM',
+                                               time.strftime('%Y-%m-%d %H:%M', time.localtime(first_seen)),
+                                               time.strftime('%Y-%m-%d %H:%M', time.localtime(last_seen))))
+            sys.exit(0)
+
+        if '--stats' in sys.argv:
+            if instr is None:
+                logging.info("--stats needs WR31/instr.py on PYTHONPATH")
+            else:
+                instr.enable()
+                instr.install_signal()
+        args = positional_args(sys.argv[1:])
+        devices = read_devices(args[0] if args else IP_FILENAME)
+        workers = int(arg_value('--workers', WORKERS))
+        changes = ChangeWriter(arg_value('--output', None), '--new' in sys.argv)
+        logging.info(HR)
+        logging.info("| Auditing the SIMs of %d routers, %d at a time" % (len(devices), workers))
+        logging.info(HR)
+        try:
+            audit_devices(devices, SshTransport(), history, changes, workers)
+        finally:
+            changes.close()
+            if instr is not None and instr.enabled:
+                logging.info(instr.format_summary())
+    finally:
+        history.close()
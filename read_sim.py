@@ -24,36 +24,117 @@ Options:    When a non-matching ICCID is found, an alert, data point or some
 
 Usage:      The script should be uploaded and then can be run manually via the
             command-line (CLI), as:
-            > python read_sim.py
+            > python read_sim.py [--stats]
+            WR31/clisess.py must be uploaded alongside it. With
+            WR31/instr.py uploaded too, --stats prints the time taken by
+            the CLI commands.
+            parse_modemStat() is also used off the router, by
+            iccid_audit.py under Python 2 or 3, so this file must stay
+            importable by both, and parse_modem_status() by WR31/cellmon.py.
             It should updated with an appropriate action and then set to run
             on boot.
 """
 
 import os
-import sarcli
+import re
 import sys
+from collections import namedtuple
+
+try:
+    import clisess
+except ImportError:
+    # Not on a TransPort, e.g. imported by iccid_audit.py for the parser
+    clisess = None
+
+try:
+    import instr
+except ImportError:
+    # Call statistics, --stats, need WR31/instr.py
+    instr = None
 
 SIM_FILE = "iccid.txt"
 MODEM_STAT = "modemstat ?"
+ICCID_MATCH = "ICCID:"
+
+ModemStatus = namedtuple('ModemStatus', 'manufacturer model firmware imei imsi iccid operator network '
+                                        'technology rssi rsrp rsrq sinr quality temperature cell_id lac')
+NUMBER_RE = re.compile(r'\s*([-+]?\d+(\.\d+)?)')
+
+
+def leading_number(text):
+    """Return the number text starts with, e.g. -71 for '-71 dBm', or None"""
+    match = NUMBER_RE.match(text)
+    if match is None:
+        return None
+    if match.group(2):
+        return float(match.group(1))
+    return int(match.group(1))
+
+
+def plain_text(text):
+    return text or None
+
+
+# 'modemstat ?' label, lower case -> (ModemStatus field, converter)
+MODEM_STATUS_LABELS = {
+    'manufacturer': ('manufacturer', plain_text),
+    'model': ('model', plain_text),
+    'firmware': ('firmware', plain_text),
+    'revision': ('firmware', plain_text),
+    'imei': ('imei', plain_text),
+    'imsi': ('imsi', plain_text),
+    'iccid': ('iccid', plain_text),
+    'operator': ('operator', plain_text),
+    'network operator': ('operator', plain_text),
+    'network status': ('network', plain_text),
+    'registration status': ('network', plain_text),
+    'technology': ('technology', plain_text),
+    'connection type': ('technology', plain_text),
+    'signal strength': ('rssi', leading_number),
+    'rssi': ('rssi', leading_number),
+    'rsrp': ('rsrp', leading_number),
+    'rsrq': ('rsrq', leading_number),
+    'sinr': ('sinr', leading_number),
+    'snr': ('sinr', leading_number),
+    'signal quality': ('quality', plain_text),
+    'temperature': ('temperature', leading_number),
+    'cell id': ('cell_id', plain_text),
+    'lac': ('lac', plain_text),
+}
 
 
 def cli(command):
-    cli = sarcli.open()
-    cli.write(command)
-    response = cli.read()
-    cli.close()
-    return response
+    return clisess.execute(command)
 
 
 def parse_modemStat(modemstat):
-    iccid = ""
-    string_match = "ICCID:"
-    lines = modemstat.split('\r\n')
-    for line in lines:
-        if string_match in line:
-            iccid = line.strip('\r\n').replace(string_match, '').strip()
-            break
-    return iccid
+    """Return the ICCID from 'modemstat ?' output, "" if there is none"""
+    start = modemstat.find(ICCID_MATCH)
+    if start < 0:
+        return ""
+    start += len(ICCID_MATCH)
+    end = modemstat.find('\n', start)
+    if end < 0:
+        end = len(modemstat)
+    return modemstat[start:end].strip()
+
+
+def parse_modem_status(modemstat):
+    """
+    Parse the whole 'modemstat ?' response in one pass
+    :return status: ModemStatus, None for the fields not in the response,
+        numbers for the signal levels and temperature
+    """
+    values = {}
+    labels = MODEM_STATUS_LABELS
+    for line in modemstat.splitlines():
+        label, sep, value = line.partition(':')
+        if not sep:
+            continue
+        field = labels.get(label.strip().lower())
+        if field is not None:
+            values[field[0]] = field[1](value.strip())
+    return ModemStatus._make([values.get(name) for name in ModemStatus._fields])
 
 
 def get_iccid():
@@ -81,21 +162,26 @@ def write_sim_file(iccid):
 
 
 if __name__ == "__main__":
+    stats = instr is not None and "--stats" in sys.argv
+    if stats:
+        instr.enable()
     if not sim_file_exists():
-        print "First run, no SIM file exists"
+        print("First run, no SIM file exists")
         write_sim_file(get_iccid())
     else:
-        print "Checking SIM information"
+        print("Checking SIM information")
         modem_stat = cli(MODEM_STAT)
         current_sim = parse_modemStat(modem_stat)
-        print "SIM number %s" % (current_sim,)
+        print("SIM number %s" % (current_sim,))
         sim = read_sim_file()
-        print "Previous SIM %s" % (sim,)
+        print("Previous SIM %s" % (sim,))
         if sim != current_sim:
-            print "SIM is different than previous!"
+            print("SIM is different than previous!")
             # ---- DO SOMETHING HERE ----
             # send datapoint here
         else:
-            print "SIM ICCIDs match"
+            print("SIM ICCIDs match")
         write_sim_file(current_sim)
+    if stats:
+        print(instr.format_summary())
     sys.exit()
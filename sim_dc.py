@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+############################################################################
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018 Digi International Inc. All Rights Reserved.
+#
+############################################################################
+
+"""
+Local stand-in for a Digi Remote Manager (Device Cloud) account, serving
+simulated devices as paged DeviceCore JSON, so export_devices.py can be
+exercised and benchmarked without a real account.
+
+Usage:      Benchmark sequential, concurrent and incremental exports
+            > python sim_dc.py [devices] [concurrency] [latency_ms]
+"""
+
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import export_devices
+
+LATENCY = 0.1  # seconds per page request
+CONDITION_RE = re.compile(r"^(\w+)(>=|<=|>|<|=)'(.*)'$")
+
+
+def timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + '.000Z'
+
+
+def make_device(index, updated):
+    mac = '00:40:9D:%02X:%02X:%02X' % ((index >> 16) & 255, (index >> 8) & 255, index & 255)
+    dvc = dict((field, '') for field in export_devices.FIELDNAMES)
+    dvc.update({
+        'devMac': mac,
+        'devConnectwareId': '00000000-00000000-00409DFF-FF%06X' % index,
+        'dpDeviceType': 'TransPort WR31',
+        'dpConnectionStatus': index % 3 and 1 or 0,
+        'dpFirmwareLevelDesc': '5.2.19.4',
+        'dpLastUpdateTime': timestamp(updated),
+        'dpMapLat': 44.9 + index % 100 / 1000.0,
+        'dpMapLong': -93.2 - index % 100 / 1000.0,
+        'grpPath': '',
+        'cstId': 1234,
+        'id': {'devId': 100000 + index, 'devVersion': 1},
+    })
+    return dvc
+
+
+class SimConnection(object):
+    """
+    Serves GET /ws/DeviceCore pages like DeviceCloudConnection.get_json()
+    """
+    def __init__(self, devices, latency=LATENCY):
+        self.devices = devices
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def matching(self, condition):
+        if not condition:
+            return self.devices
+        field, op, value = CONDITION_RE.match(condition).groups()
+        compare = {
+            '>': lambda a: a > value,
+            '>=': lambda a: a >= value,
+            '<': lambda a: a < value,
+            '<=': lambda a: a <= value,
+            '=': lambda a: a == value,
+        }[op]
+        return [dvc for dvc in self.devices if compare(str(dvc.get(field)))]
+
+    def get_json(self, path, params=None):
+        params = params or {}
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        devices = self.matching(params.get('condition'))
+        start = int(params.get('start', 0))
+        size = int(params.get('size', 1000))
+        items = devices[start:start + size]
+        return {
+            'resultTotalRows': str(len(devices)),
+            'requestedStartRow': str(start),
+            'resultSize': str(len(items)),
+            'requestedSize': str(size),
+            'remainingSize': str(max(0, len(devices) - start - len(items))),
+            'items': items,
+        }
+
+
+class SimDeviceCloud(object):
+    def __init__(self, count, latency=LATENCY, seed=1):
+        self.rand = random.Random(seed)
+        self.now = time.time() - 86400
+        devices = [make_device(x, self.now - self.rand.randint(0, 86400 * 30)) for x in range(count)]
+        self.conn = SimConnection(devices, latency)
+
+    def get_connection(self):
+        return self.conn
+
+    def touch(self, count):
+        """
+        Simulate count devices reporting in since the last export
+        """
+        self.now += 3600
+        for dvc in self.rand.sample(self.conn.devices, count):
+            dvc['dpLastUpdateTime'] = timestamp(self.now)
+            dvc['dpConnectionStatus'] = 1
+
+    def add(self, count):
+        index = len(self.conn.devices)
+        for x in range(count):
+            self.conn.devices.append(make_device(index + x, self.now))
+
+
+def timed_export(dc, export_path):
+    dc.conn.requests = 0
+    start = time.time()
+    export_devices.run_export(dc, export_path)
+    print("  {0:.2f} s, {1} page requests".format(time.time() - start, dc.conn.requests))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    latency = float(sys.argv[3]) / 1000.0 if len(sys.argv) > 3 else LATENCY
+    export_devices.PROGRESS_ROWS = count + 1
+
+    dc = SimDeviceCloud(count, latency)
+    if export_devices.instr is not None:
+        # With WR31 on PYTHONPATH, summarize the page requests
+        export_devices.instr.enable()
+    workdir = tempfile.mkdtemp()
+    export_path = os.path.join(workdir, 'devices.csv')
+    try:
+        for n in (1, concurrency):
+            print("Full export, concurrency {0}".format(n))
+            export_devices.CONCURRENCY = n
+            timed_export(dc, export_path)
+
+        dc.touch(count // 100)
+        dc.add(10)
+        print("Incremental export, concurrency {0}".format(concurrency))
+        export_devices.INCREMENTAL = True
+        timed_export(dc, export_path)
+        with open(export_path) as csvfile:
+            rows = sum(1 for line in csvfile) - 1
+        print("  {0} rows in export, {1} devices in account".format(rows, len(dc.conn.devices)))
+        if export_devices.instr is not None:
+            print(export_devices.instr.format_summary())
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+############################################################################
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018 Digi International Inc. All Rights Reserved.
+#
+############################################################################
+
+"""
+Simulated fleet of TransPort routers answering 'modemstat ?' with canned
+output, so iccid_audit.py can be exercised and benchmarked without real
+hardware or paramiko.
+
+Usage:      Audit a simulated fleet, swap some SIMs, and audit it again
+            > python sim_iccid.py [routers] [workers] [latency_ms]
+"""
+
+import csv
+import logging
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import iccid_audit
+
+LATENCY = 0.05  # seconds, SSH connect and command round trip
+TIMEOUT = 0.2  # seconds, before an unreachable router fails
+
+MODEMSTAT = """Modem Status:
+Manufacturer: Telit
+Model: LE910-NA1
+Firmware: 20.00.526
+IMEI: 35{index:013d}
+IMSI: 31041{index:010d}
+ICCID: {iccid}
+Network Status: Registered (Home network)
+Signal Strength: -{rssi} dBm
+Signal Quality: Excellent
+Technology: 4G
+Temperature: 41 C
+OK
+"""
+
+NO_SIM = """Modem Status:
+Manufacturer: Telit
+Model: LE910-NA1
+SIM status: SIM not inserted
+OK
+"""
+
+
+class SimulatedTransport(object):
+    """
+    Answers modemstat for count routers, of which a fraction is unreachable
+    """
+    name = 'sim'
+
+    def __init__(self, count, unreachable=0.01, latency=LATENCY, seed=1):
+        self.rand = random.Random(seed)
+        self.latency = latency
+        self.devices = []
+        self.iccids = {}  # address -> ICCID, '' for no SIM
+        self.down = set()
+        self.index = {}
+        for x in range(count):
+            n = x + 1
+            address = '10.%d.%d.%d' % ((n >> 16) & 255, (n >> 8) & 255, n & 255)
+            device_id = '00000000-00000000-00042DFF-FF%06X' % n
+            self.devices.append((device_id, address))
+            self.index[address] = n
+            self.iccids[address] = self.new_iccid()
+            if self.rand.random() < unreachable:
+                self.down.add(address)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def new_iccid(self):
+        return '8901260%012d' % self.rand.randint(0, 10 ** 12 - 1)
+
+    def modemstat(self, device_id, address):
+        self.lock.acquire()
+        self.requests += 1
+        self.lock.release()
+        if address in self.down:
+            time.sleep(TIMEOUT)
+            raise socket.timeout('timed out')
+        time.sleep(self.latency)
+        iccid = self.iccids[address]
+        if not iccid:
+            return NO_SIM
+        return MODEMSTAT.format(index=self.index[address], iccid=iccid, rssi=60 + self.index[address] % 40)
+
+    def swap(self, count):
+        """
+        Fit new SIMs in count routers
+        :return addresses: list
+        """
+        addresses = self.rand.sample(sorted(self.iccids), count)
+        for address in addresses:
+            self.iccids[address] = self.new_iccid()
+        return addresses
+
+    def move(self, source, destination):
+        """
+        Move the SIM of one router into another
+        """
+        self.iccids[destination] = self.iccids[source]
+        self.iccids[source] = ''
+
+
+def timed_audit(transport, history, changes, workers):
+    transport.requests = 0
+    start = time.time()
+    summary = iccid_audit.audit_devices(transport.devices, transport, history, changes, workers)
+    print("  {0:.2f} s, {1} requests".format(time.time() - start, transport.requests))
+    return summary
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    latency = float(sys.argv[3]) / 1000.0 if len(sys.argv) > 3 else LATENCY
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    transport = SimulatedTransport(count, latency=latency)
+    workdir = tempfile.mkdtemp()
+    try:
+        history = iccid_audit.IccidHistory(os.path.join(workdir, 'iccid.db'))
+        changes = iccid_audit.ChangeWriter(os.path.join(workdir, 'changes.csv'))
+        print("First audit, {0} workers".format(workers))
+        timed_audit(transport, history, changes, workers)
+
+        swapped = transport.swap(5)
+        up = [address for device_id, address in transport.devices if address not in transport.down]
+        # One SIM moves to a router audited after its old one, one before
+        moves = [(up[0], up[1]), (up[3], up[2])]
+        for source, destination in moves:
+            transport.move(source, destination)
+        print("Second audit, after {0} swaps and {1} SIMs moved".format(len(swapped), len(moves)))
+        summary = timed_audit(transport, history, changes, workers)
+        expected = len(set(swapped) - transport.down | set(up[:4]))
+        print("  {0} changes reported, {1} expected".format(summary.changed, expected))
+        history.close()
+        changes.close()
+
+        device_ids = dict((address, device_id) for device_id, address in transport.devices)
+        reported = {}
+        with open(os.path.join(workdir, 'changes.csv')) as csvfile:
+            for row in csv.DictReader(csvfile):
+                reported[row['address']] = row['movedFrom']
+        found = [source for source, destination in moves if reported.get(destination) == device_ids[source]]
+        print("  {0} of {1} moves traced to their old router".format(len(found), len(moves)))
+    finally:
+        shutil.rmtree(workdir)